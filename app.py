@@ -1,15 +1,26 @@
 import streamlit as st
-from database import create_tables
-from auth import register, sign_in, reset_password, forgot_password_flow
+import metrics
+import sessions
+from database import init_db
+from auth import register, sign_in, get_user, forgot_password_flow, confirm_password_reset
 from suppliers import (
     view_supplier_details,
     modify_supplier_details,
     add_new_suppliers,
-    view_password_reset_reminders
+    view_password_reset_reminders,
+    export_suppliers,
+    view_password_audit
 )
 
 def main():
-    create_tables()
+    metrics.start_exporter()
+    # Times the whole script run, labelled with the action it served
+    with metrics.time_script_run() as run:
+        _run(run)
+
+
+def _run(run):
+    init_db()
 
     # Centered title and subtitle using HTML
     st.markdown("<h1 style='text-align: center;'>Password Manager</h1>", unsafe_allow_html=True)
@@ -17,14 +28,16 @@ def main():
     st.write("---")
 
 
-    # State management: store user info if signed in
-    if "user_data" not in st.session_state:
-        st.session_state.user_data = None
+    # State management: the signed-in user lives in the server-side session
+    # store; st.session_state only carries its id (see sessions.py)
     if "sign_in_attempts" not in st.session_state:
         st.session_state.sign_in_attempts = 0
+    if "reset_user_id" not in st.session_state:
+        st.session_state.reset_user_id = None
 
     # Radio to switch between Register & Sign In
     choice = st.radio("Choose an option:", ("Register", "Sign In"))
+    run.action = choice
     
     if choice == "Register":
         st.subheader("Register")
@@ -50,7 +63,7 @@ def main():
                 if username and password:
                     success, msg, user_data = sign_in(username, password)
                     if success:
-                        st.session_state.user_data = user_data
+                        sessions.start_session(user_data)
                         st.session_state.sign_in_attempts = 0
                         st.write(msg)
                     else:
@@ -74,32 +87,42 @@ def main():
                 # or we want to do the reset flow
                 if username:
                     # We must fetch the email from DB if user exists
-                    success, msg, user_data = sign_in(username, "dummy")  # just to get user_data
+                    user_data = get_user(username)
                     if user_data:
-                        user_id, db_username, db_email, db_password = user_data
-                        otp_code = forgot_password_flow(db_email, user_id)
-                        if otp_code:
-                            st.info("OTP has been sent to your email. Please enter it below:")
-                            user_otp = st.text_input("Enter OTP:", type="password")
-                            new_pass = st.text_input("Enter your new password:", type="password")
-                            if st.button("Reset Now"):
-                                if user_otp == otp_code:
-                                    reset_password(user_id, new_pass)
-                                    st.success("Password has been reset. Please sign in again.")
-                                    st.session_state.sign_in_attempts = 0
-                                else:
-                                    st.error("OTP mismatch.")
+                        user_id, db_username, db_email = user_data[:3]
+                        sent, msg = forgot_password_flow(db_email, user_id)
+                        if sent:
+                            # Remember who is resetting so the form survives reruns
+                            st.session_state.reset_user_id = user_id
+                            st.info(msg)
                         else:
-                            st.error("Failed to send OTP. Check your email configuration.")
+                            st.error(msg)
                     else:
                         st.error("That username does not exist. Please register or check spelling.")
                 else:
                     st.write("Enter a username first, then click 'Forgot Password?' again.")
 
-    # If user_data is set, show the main menu
-    if st.session_state.user_data:
-        user_id, username, email, db_password = st.session_state.user_data
+        if st.session_state.reset_user_id:
+            user_otp = st.text_input("Enter OTP:", type="password", key="reset_otp")
+            new_pass = st.text_input("Enter your new password:", type="password", key="reset_new_password")
+            if st.button("Reset Now"):
+                if not new_pass:
+                    st.error("Please enter a new password.")
+                else:
+                    success, msg = confirm_password_reset(st.session_state.reset_user_id, user_otp, new_pass)
+                    if success:
+                        st.success(msg)
+                        st.session_state.sign_in_attempts = 0
+                        st.session_state.reset_user_id = None
+                    else:
+                        st.error(msg)
 
+    # If signed in, show the main menu
+    had_session = st.session_state.get(sessions.SESSION_KEY) is not None
+    principal = sessions.current_principal()
+    if had_session and principal is None:
+        st.info("Your session has expired. Please sign in again.")
+    if principal:
         st.markdown("---")
         st.subheader("Main Menu")
 
@@ -108,19 +131,26 @@ def main():
             "Modify Supplier Details",
             "Add New Suppliers",
             "View Supplier Password Reset Reminders",
+            "Export Suppliers",
+            "Password Audit",
             "Log Out"
         ])
+        run.action = menu_choice
 
         if menu_choice == "View Supplier Details":
-            view_supplier_details(st.session_state.user_data)
+            view_supplier_details(principal)
         elif menu_choice == "Modify Supplier Details":
-            modify_supplier_details(st.session_state.user_data)
+            modify_supplier_details(principal)
         elif menu_choice == "Add New Suppliers":
-            add_new_suppliers(st.session_state.user_data)
+            add_new_suppliers(principal)
         elif menu_choice == "View Supplier Password Reset Reminders":
-            view_password_reset_reminders(st.session_state.user_data)
+            view_password_reset_reminders(principal)
+        elif menu_choice == "Export Suppliers":
+            export_suppliers(principal)
+        elif menu_choice == "Password Audit":
+            view_password_audit(principal)
         elif menu_choice == "Log Out":
-            st.session_state.user_data = None
+            sessions.end_session()
             st.write("Logged out.")
 
 if __name__ == "__main__":
@@ -0,0 +1,429 @@
+# audit_log.py
+"""
+Append-only log of vault changes: who unmasked, changed, deleted,
+imported or exported what, and when.
+
+    python audit_log.py show <username> [--days 30] [--action unmask]
+    python audit_log.py retention [--archive-dir audit_archive]
+
+record() only appends to an in-memory buffer. A background thread flushes
+it every AUDIT_FLUSH_INTERVAL seconds (or once AUDIT_FLUSH_SIZE events
+are waiting) with one executemany per partition, so auditing adds no
+write transactions to the request path. A batch that fails
+MAX_FLUSH_ATTEMPTS flushes in a row is written event by event instead;
+events that still can't be stored go to a dead-letter file
+(<audit db>_deadletter.jsonl) so they don't hold up the ones behind them.
+
+Events live in their own database file (AUDIT_DB_PATH, default next to
+DB_PATH), so flushing and retention never take the vault's write lock.
+Each calendar month (UTC) is a separate table, audit_log_YYYYMM, indexed
+on (owner_user_id, ts). Retention drops whole months older than
+AUDIT_RETENTION_MONTHS, optionally archiving them to gzipped JSON lines
+first, which is a quick metadata change instead of a large DELETE.
+"""
+import argparse
+import atexit
+import gzip
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from database import ConnectionPool
+
+DEFAULT_FLUSH_INTERVAL = 2.0
+DEFAULT_FLUSH_SIZE = 500
+DEFAULT_RETENTION_MONTHS = 12
+# Events kept in memory while the audit database is unavailable
+MAX_BUFFERED = 100000
+# Failed flushes in a row before the buffer is written event by event
+MAX_FLUSH_ATTEMPTS = 5
+# Free pages returned to the file system per step after dropping partitions
+VACUUM_STEP_PAGES = 1000
+
+# Actions recorded by services / exporter
+ADD = "add"
+IMPORT = "import"
+UNMASK = "unmask"
+MODIFY = "modify"
+BULK_MODIFY = "bulk_modify"
+DELETE = "delete"
+DELETE_ALL = "delete_all"
+EXPORT = "export"
+ROTATE_KEY = "rotate_key"
+POLICY = "policy"
+
+PARTITION_PATTERN = re.compile(r"^audit_log_(\d{6})$")
+
+
+def _audit_db_path():
+    path = os.getenv("AUDIT_DB_PATH")
+    if path:
+        return path
+    db_path = os.getenv("DB_PATH", "password_manager.db")
+    return f"{os.path.splitext(db_path)[0]}_audit.db"
+
+
+def partition_for(ts):
+    """
+    Table name of the month a unix timestamp falls in.
+    """
+    return "audit_log_" + datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m")
+
+
+class AuditLog:
+    """
+    Buffered writer and reader of the partitioned audit tables.
+    """
+
+    def __init__(self, db_path, flush_interval=DEFAULT_FLUSH_INTERVAL, flush_size=DEFAULT_FLUSH_SIZE):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._pool = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.dead_letter_path = f"{os.path.splitext(db_path)[0]}_deadletter.jsonl"
+        self._partitions = set()
+        self._failures = 0
+        self._stats = {"recorded": 0, "flushed": 0, "flushes": 0, "dropped": 0, "errors": 0,
+                       "dead_lettered": 0}
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    pool = ConnectionPool(self.db_path, max_size=2)
+                    with pool.connection() as conn:
+                        # Lets retention hand dropped pages back in small
+                        # steps. Can only be switched on while the file is
+                        # empty, and needs a VACUUM to stick in WAL mode
+                        empty = conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+                        if empty and conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+                            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                            conn.execute("VACUUM")
+                    self._pool = pool
+        return self._pool
+
+    # -- writing ----------------------------------------------------------
+
+    def record(self, owner_user_id, action, supplier_id=None, detail=""):
+        """
+        Queue one event. Never touches the database.
+        """
+        event = (time.time(), owner_user_id, action, supplier_id, detail or "")
+        with self._lock:
+            self._buffer.append(event)
+            self._stats["recorded"] += 1
+            self._trim()
+            full = len(self._buffer) >= self.flush_size
+        self._start()
+        if full:
+            self._wakeup.set()
+
+    def _trim(self):
+        # Caller holds self._lock. Drops the oldest events over MAX_BUFFERED
+        excess = len(self._buffer) - MAX_BUFFERED
+        if excess > 0:
+            del self._buffer[:excess]
+            self._stats["dropped"] += excess
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="audit-log-flusher", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _ensure_partition(self, conn, table):
+        if table in self._partitions:
+            return
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            ts REAL NOT NULL,
+            owner_user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            supplier_id INTEGER,
+            detail TEXT NOT NULL DEFAULT ''
+        );
+        """)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_owner_ts ON {table} (owner_user_id, ts)")
+        self._partitions.add(table)
+
+    def flush(self):
+        """
+        Write every buffered event, one executemany per monthly partition,
+        in a single transaction. On failure the events go back to the
+        buffer for the next attempt; after MAX_FLUSH_ATTEMPTS failures in a
+        row they are written one by one and those still rejected are
+        dead-lettered. Returns the number written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+            try:
+                self._insert(events)
+            except Exception as e:
+                print(f"Error writing audit log: {e}")
+                self._partitions.clear()
+                self._failures += 1
+                if self._failures >= MAX_FLUSH_ATTEMPTS:
+                    return self._salvage(events)
+                with self._lock:
+                    self._buffer[:0] = events
+                    self._trim()
+                    self._stats["errors"] += 1
+                return 0
+            self._failures = 0
+            with self._lock:
+                self._stats["flushed"] += len(events)
+                self._stats["flushes"] += 1
+            return len(events)
+
+    def _insert(self, events, one_by_one=False):
+        """
+        Insert events in one transaction. With one_by_one, each event gets
+        its own savepoint and those that fail are left out. Returns the
+        events left out.
+        """
+        by_partition = {}
+        for event in events:
+            by_partition.setdefault(partition_for(event[0]), []).append(event)
+        rejected = []
+        with self._get_pool().connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table, rows in by_partition.items():
+                self._ensure_partition(conn, table)
+                sql = (f"INSERT INTO {table} (ts, owner_user_id, action, supplier_id, detail) "
+                       f"VALUES (?, ?, ?, ?, ?)")
+                if not one_by_one:
+                    conn.executemany(sql, rows)
+                    continue
+                for row in rows:
+                    conn.execute("SAVEPOINT audit_event")
+                    try:
+                        conn.execute(sql, row)
+                    except sqlite3.Error:
+                        conn.execute("ROLLBACK TO audit_event")
+                        rejected.append(row)
+                    conn.execute("RELEASE audit_event")
+        return rejected
+
+    def _salvage(self, events):
+        # Caller holds self._flush_lock; the batch keeps failing as a whole
+        try:
+            rejected = self._insert(events, one_by_one=True)
+        except Exception as e:
+            print(f"Error writing audit log: {e}")
+            self._partitions.clear()
+            rejected = events
+        self._failures = 0
+        written = len(events) - len(rejected)
+        dead = self._dead_letter(rejected)
+        with self._lock:
+            self._stats["errors"] += 1
+            self._stats["flushed"] += written
+            self._stats["dead_lettered"] += dead
+            self._stats["dropped"] += len(rejected) - dead
+        return written
+
+    def _dead_letter(self, events):
+        """
+        Append events to the dead-letter file as JSON lines. Returns how
+        many were saved (0 if the file can't be written).
+        """
+        if not events:
+            return 0
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as out:
+                for ts, owner_user_id, action, supplier_id, detail in events:
+                    out.write(json.dumps({"ts": ts, "owner_user_id": owner_user_id, "action": action,
+                                          "supplier_id": supplier_id, "detail": detail}, default=repr) + "\n")
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing audit dead-letter file: {e}")
+            return 0
+        print(f"Moved {len(events)} audit events to {self.dead_letter_path}.")
+        return len(events)
+
+    # -- reading ----------------------------------------------------------
+
+    def partitions(self):
+        """
+        Existing partition tables, oldest first.
+        """
+        with self._get_pool().connection() as conn:
+            names = [row[0] for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'audit_log_%'"
+            )]
+        return sorted(name for name in names if PARTITION_PATTERN.match(name))
+
+    def events(self, owner_user_id, start=None, end=None, action=None, limit=500):
+        """
+        The owner's events with start <= ts < end (unix seconds), newest
+        first. Only the partitions overlapping the range are read, each
+        through its (owner_user_id, ts) index.
+        Returns [(ts, action, supplier_id, detail), ...].
+        """
+        self.flush()
+        start = 0.0 if start is None else start
+        end = time.time() + 1 if end is None else end
+        first, last = partition_for(start), partition_for(end)
+        tables = [t for t in self.partitions() if first <= t <= last]
+        if not tables:
+            return []
+
+        action_filter = " AND action = ?" if action else ""
+        params = []
+        selects = []
+        for table in tables:
+            selects.append(
+                f"SELECT ts, action, supplier_id, detail FROM {table} "
+                f"WHERE owner_user_id = ? AND ts >= ? AND ts < ?{action_filter}"
+            )
+            params += [owner_user_id, start, end] + ([action] if action else [])
+        sql = " UNION ALL ".join(selects) + " ORDER BY ts DESC LIMIT ?"
+        with self._get_pool().connection() as conn:
+            return conn.execute(sql, params + [limit]).fetchall()
+
+    # -- retention --------------------------------------------------------
+
+    def apply_retention(self, months=DEFAULT_RETENTION_MONTHS, archive_dir=None, now=None):
+        """
+        Drop partitions of months more than `months` before the current
+        one. With archive_dir, each is first written to
+        <archive_dir>/<table>.jsonl.gz. Each drop is its own short
+        transaction on the audit database, so flushes carry on between
+        them. Returns the names of the dropped partitions.
+        """
+        now = datetime.fromtimestamp(time.time() if now is None else now, timezone.utc)
+        month_index = now.year * 12 + now.month - 1 - months
+        cutoff = f"audit_log_{month_index // 12:04d}{month_index % 12 + 1:02d}"
+
+        dropped = []
+        pool = self._get_pool()
+        for table in self.partitions():
+            if table >= cutoff:
+                break
+            if archive_dir:
+                self._archive(table, archive_dir)
+            with pool.connection() as conn:
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            self._partitions.discard(table)
+            dropped.append(table)
+
+        if dropped:
+            # Return freed pages a little at a time instead of one long VACUUM
+            while True:
+                with pool.connection() as conn:
+                    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                    if not free:
+                        break
+                    conn.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+                    if conn.execute("PRAGMA freelist_count").fetchone()[0] >= free:
+                        break   # auto_vacuum is off for this file
+        return dropped
+
+    def _archive(self, table, archive_dir):
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, f"{table}.jsonl.gz")
+        with self._get_pool().connection() as conn, gzip.open(path, "wt", encoding="utf-8") as out:
+            cursor = conn.execute(f"SELECT ts, owner_user_id, action, supplier_id, detail FROM {table} ORDER BY ts")
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for ts, owner_user_id, action, supplier_id, detail in rows:
+                    out.write(json.dumps({"ts": ts, "owner_user_id": owner_user_id, "action": action,
+                                          "supplier_id": supplier_id, "detail": detail}) + "\n")
+        return path
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["buffered"] = len(self._buffer)
+        return snapshot
+
+    def close(self):
+        self.flush()
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+
+_audit_log = None
+_audit_lock = threading.Lock()
+
+
+def get_audit_log():
+    global _audit_log
+    if _audit_log is None:
+        with _audit_lock:
+            if _audit_log is None:
+                _audit_log = AuditLog(
+                    _audit_db_path(),
+                    flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", DEFAULT_FLUSH_INTERVAL)),
+                    flush_size=int(os.getenv("AUDIT_FLUSH_SIZE", DEFAULT_FLUSH_SIZE)),
+                )
+    return _audit_log
+
+
+def record(owner_user_id, action, supplier_id=None, detail=""):
+    """
+    Queue an audit event (see AuditLog.record).
+    """
+    get_audit_log().record(owner_user_id, action, supplier_id, detail)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vault audit log tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("show", help="list a user's recent events")
+    p.add_argument("username")
+    p.add_argument("--days", type=float, default=30)
+    p.add_argument("--action")
+    p.add_argument("--limit", type=int, default=500)
+    p = commands.add_parser("retention", help="drop (and optionally archive) old months")
+    p.add_argument("--months", type=int,
+                   default=int(os.getenv("AUDIT_RETENTION_MONTHS", DEFAULT_RETENTION_MONTHS)))
+    p.add_argument("--archive-dir")
+    args = parser.parse_args()
+
+    audit_log = get_audit_log()
+    if args.command == "retention":
+        dropped = audit_log.apply_retention(args.months, args.archive_dir)
+        print(f"Dropped {len(dropped)} partitions" + (f": {', '.join(dropped)}" if dropped else "."))
+        return 0
+
+    from database import init_db
+    from services import auth_service
+    init_db()
+    user = auth_service.get_user(args.username)
+    if user is None:
+        print(f"Error: no such user '{args.username}'.", file=sys.stderr)
+        return 1
+    events = audit_log.events(user[0], start=time.time() - args.days * 86400, action=args.action,
+                              limit=args.limit)
+    for ts, action, supplier_id, detail in events:
+        when = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        print(f"{when} UTC  {action:<12} {'' if supplier_id is None else supplier_id:<8} {detail}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,862 @@
+# backup.py
+"""
+Online backups and point-in-time restore.
+
+    python backup.py snapshot [--label NAME]      # one snapshot now (e.g. from cron), then rotate
+    python backup.py run [--interval S] [--wal-archive]
+    python backup.py list
+    python backup.py verify [<snapshot>]
+    python backup.py restore [<snapshot>] [--at "YYYY-MM-DD HH:MM:SS"] [--target DIR]
+    python backup.py prune
+
+A snapshot copies DB_PATH, every shard (STORAGE_MODE=sharded) and the
+audit log database into BACKUP_DIR/<UTC time>/ with sqlite3's backup API,
+BACKUP_STEP_PAGES pages at a time with a pause in between, so the app
+keeps reading and writing throughout. Each source is held in one read
+transaction for the whole copy; under WAL that blocks nobody and keeps
+writers from restarting the copy. Every file is checked with
+PRAGMA integrity_check before the snapshot's manifest is written, and
+rotation keeps the newest BACKUP_KEEP unlabelled snapshots.
+
+With --wal-archive, `run` also ships the database's committed WAL frames
+into the newest snapshot every WAL_ARCHIVE_INTERVAL seconds, so a
+restore can roll that snapshot forward to any archive pass (single-file
+storage only). The archiver keeps a read transaction open so SQLite
+can't recycle frames before they're copied, and restarts the WAL itself
+once it grows past WAL_ARCHIVE_MAX_MB. If frames are lost anyway, the
+archiver starts over with a fresh snapshot.
+
+restore rebuilds the files in a staging directory, checks them and then
+copies them over the live databases (or into --target). Stop the app
+and the scheduler first. Backups don't include the vault master key
+(VAULT_KEY_FILE); keep it with them, or they can't be decrypted.
+
+Settings:
+    BACKUP_DIR=<db>_backups     where snapshots go
+    BACKUP_KEEP=7               unlabelled snapshots kept by rotation
+    BACKUP_INTERVAL=86400       seconds between snapshots in `run`
+    BACKUP_STEP_PAGES=256       pages copied per backup step
+    BACKUP_STEP_SLEEP_MS=5      pause between steps
+    WAL_ARCHIVE_INTERVAL=10     seconds between WAL archive passes
+    WAL_ARCHIVE_MAX_MB=64       WAL size at which the archiver restarts it
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from database import _db_settings, create_connection, get_router, init_db, SHARDED
+
+DEFAULT_KEEP = 7
+DEFAULT_INTERVAL = 86400
+DEFAULT_STEP_PAGES = 256
+DEFAULT_STEP_SLEEP_MS = 5
+DEFAULT_ARCHIVE_INTERVAL = 10
+DEFAULT_ARCHIVE_MAX_MB = 64
+
+MANIFEST = "manifest.json"
+WAL_DIR = "wal"
+WAL_INDEX = "index.jsonl"
+PARTIAL_PREFIX = "."
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+NAME_FORMAT = "%Y%m%dT%H%M%SZ"
+# scheduler_state row the archiver commits before pinning the WAL
+WAL_MARKER = "backup.wal_marker"
+RESTART_BUSY_TIMEOUT_MS = 100
+
+# WAL file layout, see https://www.sqlite.org/fileformat2.html#walformat
+WAL_HEADER = struct.Struct(">IIIIIIII")    # magic, version, page size, checkpoint seq, salt-1, salt-2, checksum
+FRAME_HEADER = struct.Struct(">IIIIII")    # page number, db pages after commit (0 = not a commit), salts, checksum
+WAL_MAGIC = (0x377F0682, 0x377F0683)
+
+
+class WalGap(Exception):
+    """
+    WAL frames were recycled before they could be archived.
+    """
+
+
+def _utc_now():
+    return datetime.now(timezone.utc)
+
+
+def _backup_dir():
+    path = os.getenv("BACKUP_DIR")
+    if path:
+        return path
+    return f"{os.path.splitext(_db_settings()['path'])[0]}_backups"
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Copying and checking database files
+# ---------------------------------------------------------------------------
+
+def copy_database(source, target_path, pages=None, sleep=None):
+    """
+    Copy the database behind `source` (a connection) to target_path in
+    steps of `pages` pages with `sleep` seconds in between. If `source`
+    isn't already in a transaction, the copy runs inside a read
+    transaction so it is one consistent snapshot. The copy is switched to
+    rollback journaling so it is a single self-contained file.
+    Returns the number of pages copied.
+    """
+    if pages is None:
+        pages = int(os.getenv("BACKUP_STEP_PAGES", DEFAULT_STEP_PAGES))
+    if sleep is None:
+        sleep = float(os.getenv("BACKUP_STEP_SLEEP_MS", DEFAULT_STEP_SLEEP_MS)) / 1000.0
+    total = [0]
+
+    def progress(status, remaining, count):
+        total[0] = count
+
+    pinned = not source.in_transaction
+    if pinned:
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, sleep=sleep, progress=progress)
+        target.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        target.close()
+        if pinned:
+            source.execute("COMMIT")
+    return total[0]
+
+
+def integrity_check(path):
+    """
+    PRAGMA integrity_check on a database file. Returns the problems
+    reported (an empty list when the file is sound).
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    finally:
+        conn.close()
+    return [] if rows == ["ok"] else rows
+
+
+def _live_files():
+    """
+    The files a snapshot covers: [(role, owner, name in the snapshot, live path)].
+    """
+    from audit_log import _audit_db_path
+
+    settings = _db_settings()
+    files = [("main", None, os.path.basename(settings["path"]), settings["path"])]
+    router = get_router()
+    if router is not None:
+        shard_base = os.path.basename(os.path.normpath(settings["shard_dir"]))
+        for owner in router.owners():
+            path = router.shard_path(owner)
+            files.append(("shard", owner, f"{shard_base}/{os.path.basename(path)}", path))
+    audit_path = _audit_db_path()
+    if os.path.exists(audit_path):
+        files.append(("audit", None, os.path.basename(audit_path), audit_path))
+    return files
+
+
+def _open_source(path, role):
+    conn = create_connection(path, foreign_keys=role == "main")
+    if conn is None:
+        raise RuntimeError(f"Could not open {path}.")
+    conn.isolation_level = None
+    return conn
+
+
+# ---------------------------------------------------------------------------
+# Snapshots
+# ---------------------------------------------------------------------------
+
+def snapshot(backup_dir=None, label=None, archiver=None, log=print):
+    """
+    Take a snapshot of every live database file into a new directory
+    under backup_dir. With an `archiver` (WalArchiver), the main database
+    is copied from the archiver's pinned read transaction and the
+    archiver starts shipping WAL into the snapshot. Returns its path.
+    """
+    backup_dir = backup_dir or _backup_dir()
+    created = _utc_now()
+    name = created.strftime(NAME_FORMAT) + (f"-{label}" if label else "")
+    if os.path.exists(os.path.join(backup_dir, name)):
+        # A second snapshot within the same second (e.g. after a WAL gap)
+        name = next(f"{name}.{n}" for n in range(2, 1000)
+                    if not os.path.exists(os.path.join(backup_dir, f"{name}.{n}")))
+    final_dir = os.path.join(backup_dir, name)
+    partial_dir = os.path.join(backup_dir, PARTIAL_PREFIX + name)
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.makedirs(partial_dir)
+
+    entries = []
+    started = time.monotonic()
+    try:
+        for role, owner, rel_name, live_path in _live_files():
+            target = os.path.join(partial_dir, rel_name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if role == "main" and archiver is not None:
+                pages = archiver.start(lambda conn: copy_database(conn, target))
+            else:
+                source = _open_source(live_path, role)
+                try:
+                    pages = copy_database(source, target)
+                finally:
+                    source.close()
+            problems = integrity_check(target)
+            if problems:
+                raise RuntimeError(f"Snapshot of {live_path} failed integrity_check: {problems[0]}")
+            entries.append({
+                "role": role,
+                "owner": owner,
+                "name": rel_name,
+                "pages": pages,
+                "bytes": os.path.getsize(target),
+                "sha256": _sha256(target),
+            })
+
+        manifest = {
+            "name": name,
+            "created_at": created.strftime(TIME_FORMAT),
+            "label": label,
+            "storage_mode": _db_settings()["storage_mode"],
+            "wal_archive": archiver is not None,
+            "files": entries,
+        }
+        with open(os.path.join(partial_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    _fsync_dir(backup_dir)
+    if archiver is not None:
+        archiver.wal_dir = os.path.join(final_dir, WAL_DIR)
+    log(f"Snapshot {name}: {len(entries)} files, "
+        f"{sum(e['bytes'] for e in entries) / 1024 / 1024:.1f} MB in {time.monotonic() - started:.1f}s")
+    return final_dir
+
+
+def list_snapshots(backup_dir=None):
+    """
+    Manifests of the complete snapshots in backup_dir, oldest first.
+    """
+    backup_dir = backup_dir or _backup_dir()
+    if not os.path.isdir(backup_dir):
+        return []
+    manifests = []
+    for name in sorted(os.listdir(backup_dir)):
+        path = os.path.join(backup_dir, name, MANIFEST)
+        if name.startswith(PARTIAL_PREFIX) or not os.path.exists(path):
+            continue
+        with open(path) as f:
+            manifest = json.load(f)
+        manifest["path"] = os.path.join(backup_dir, name)
+        manifests.append(manifest)
+    manifests.sort(key=lambda m: m["created_at"])
+    return manifests
+
+
+def rotate(backup_dir=None, keep=None):
+    """
+    Delete all but the newest `keep` (at least one) unlabelled snapshots.
+    Labelled snapshots are only removed by hand. Returns the names removed.
+    """
+    backup_dir = backup_dir or _backup_dir()
+    if keep is None:
+        keep = int(os.getenv("BACKUP_KEEP", DEFAULT_KEEP))
+    scheduled = [m for m in list_snapshots(backup_dir) if not m["label"]]
+    removed = []
+    for manifest in scheduled[:max(len(scheduled) - max(keep, 1), 0)]:
+        shutil.rmtree(manifest["path"])
+        removed.append(manifest["name"])
+    return removed
+
+
+def verify(snapshot_dir):
+    """
+    Check a snapshot against its manifest: every file present with the
+    recorded checksum and passing integrity_check, and every archived WAL
+    segment intact. Returns a list of problems.
+    """
+    with open(os.path.join(snapshot_dir, MANIFEST)) as f:
+        manifest = json.load(f)
+    problems = []
+    for entry in manifest["files"]:
+        path = os.path.join(snapshot_dir, entry["name"])
+        if not os.path.exists(path):
+            problems.append(f"{entry['name']}: missing")
+        elif _sha256(path) != entry["sha256"]:
+            problems.append(f"{entry['name']}: checksum mismatch")
+        else:
+            problems.extend(f"{entry['name']}: {problem}" for problem in integrity_check(path))
+    for segment in _wal_segments(snapshot_dir):
+        path = os.path.join(snapshot_dir, WAL_DIR, segment["file"])
+        if not os.path.exists(path) or _sha256(path) != segment["sha256"]:
+            problems.append(f"{WAL_DIR}/{segment['file']}: missing or corrupt")
+    return problems
+
+
+# ---------------------------------------------------------------------------
+# WAL archiving
+# ---------------------------------------------------------------------------
+
+def _read_wal_header(wal_path):
+    """
+    (page size, salt-1, salt-2) of the WAL file, or None while it is empty.
+    """
+    try:
+        with open(wal_path, "rb") as f:
+            data = f.read(WAL_HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(data) < WAL_HEADER.size:
+        return None
+    magic, _, page_size, _, salt1, salt2, _, _ = WAL_HEADER.unpack(data)
+    if magic not in WAL_MAGIC:
+        raise RuntimeError(f"{wal_path} is not a WAL file.")
+    return page_size, salt1, salt2
+
+
+def _committed_end(wal_path, header, start):
+    """
+    Scan frame headers after frame `start` and return the number of the
+    last commit frame of the current WAL cycle (start if there is none).
+    Frames left over from an earlier cycle carry other salts and end the
+    scan. Only call this while holding the write lock, so no frame is
+    half-written.
+    """
+    page_size, salt1, salt2 = header
+    frame_size = FRAME_HEADER.size + page_size
+    end = start
+    frame = start
+    with open(wal_path, "rb") as f:
+        while True:
+            f.seek(WAL_HEADER.size + frame * frame_size)
+            data = f.read(FRAME_HEADER.size)
+            if len(data) < FRAME_HEADER.size:
+                break
+            _, commit_pages, frame_salt1, frame_salt2, _, _ = FRAME_HEADER.unpack(data)
+            if (frame_salt1, frame_salt2) != (salt1, salt2):
+                break
+            frame += 1
+            if commit_pages:
+                end = frame
+    return end
+
+
+def _read_frames(wal_path, page_size, start, end):
+    frame_size = FRAME_HEADER.size + page_size
+    with open(wal_path, "rb") as f:
+        f.seek(WAL_HEADER.size + start * frame_size)
+        return f.read((end - start) * frame_size)
+
+
+def _wal_segments(snapshot_dir):
+    path = os.path.join(snapshot_dir, WAL_DIR, WAL_INDEX)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class WalArchiver:
+    """
+    Ships the committed WAL frames of one database into a snapshot's wal/
+    directory, one gzipped segment per pass.
+
+    SQLite recycles the WAL from the start once every frame has been
+    checkpointed and no reader is using it. The archiver holds one read
+    transaction per WAL cycle, begun under the write lock right after it
+    committed a marker row, so the reader is at a frame no checkpoint has
+    copied yet and really keeps the WAL in place (a reader that begins on
+    a fully checkpointed WAL doesn't). Each pass takes the write lock just
+    long enough to find the last commit frame and read the new frames.
+    Checkpoints can't get past the pinned frame, so once the WAL is bigger
+    than max_wal_bytes the archiver lets go and restarts it with a RESTART
+    checkpoint. salt-1 in the WAL header goes up by one on every restart;
+    a restart the archiver didn't make itself means frames may have been
+    lost and raises WalGap.
+    """
+
+    def __init__(self, db_path, max_wal_bytes):
+        self.db_path = db_path
+        self.wal_path = f"{db_path}-wal"
+        self.max_wal_bytes = max_wal_bytes
+        self.wal_dir = None
+        self.page_size = None
+        self.salts = None
+        self.position = 0           # last archived frame of the current WAL cycle
+        self.segment = 0
+        self._pin_conn = None
+        self._lock_conn = None
+
+    def _connect(self, busy_timeout_ms=None):
+        conn = create_connection(self.db_path)
+        if conn is None:
+            raise RuntimeError(f"Could not open {self.db_path}.")
+        conn.isolation_level = None
+        if busy_timeout_ms is not None:
+            conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+        return conn
+
+    def _lock(self):
+        if self._lock_conn is None:
+            self._lock_conn = self._connect()
+            # The marker frames it commits must stay uncheckpointed until pinned
+            self._lock_conn.execute("PRAGMA wal_autocheckpoint = 0")
+        self._lock_conn.execute("BEGIN IMMEDIATE")
+
+    def _unlock(self):
+        if self._lock_conn.in_transaction:
+            self._lock_conn.execute("ROLLBACK")
+
+    def _commit_marker(self):
+        """
+        Write the marker row in the locked transaction and commit it.
+        """
+        self._lock_conn.execute("INSERT OR REPLACE INTO scheduler_state (name, value) VALUES (?, ?)",
+                                (WAL_MARKER, _utc_now().strftime(TIME_FORMAT)))
+        self._lock_conn.execute("COMMIT")
+
+    def _pin(self):
+        """
+        Begin the read transaction that holds the WAL. Call it under the
+        write lock after _commit_marker.
+        """
+        self._unpin()
+        conn = self._connect()
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        self._pin_conn = conn
+
+    def _unpin(self):
+        if self._pin_conn is not None:
+            self._pin_conn.close()
+            self._pin_conn = None
+
+    def _header(self):
+        header = _read_wal_header(self.wal_path)
+        if header is None:
+            raise WalGap("the WAL was truncated")
+        return header
+
+    def _check_salts(self, header):
+        if header[1:] != self.salts:
+            raise WalGap("the WAL was restarted before its frames were archived")
+
+    def start(self, copy_base):
+        """
+        Begin a new generation: pin the WAL and call copy_base(conn) on the
+        pinned connection, so the base copy matches the archive position
+        exactly. Returns what copy_base returned.
+        """
+        self._unpin()
+        self.wal_dir = None
+        self.segment = 0
+        self._lock()
+        try:
+            self._commit_marker()
+            self._lock()
+            self._pin()
+            header = self._header()
+            self.page_size, self.salts = header[0], header[1:]
+            self.position = _committed_end(self.wal_path, header, 0)
+        finally:
+            self._unlock()
+        return copy_base(self._pin_conn)
+
+    def archive(self):
+        """
+        One pass: append the frames committed since the previous pass to
+        the archive. Returns the number of frames archived.
+        """
+        if self.wal_dir is None:
+            raise WalGap("no snapshot to archive into")
+        self._lock()
+        try:
+            header = self._header()
+            self._check_salts(header)
+            end = _committed_end(self.wal_path, header, self.position)
+            data = _read_frames(self.wal_path, self.page_size, self.position, end)
+        finally:
+            self._unlock()
+        archived = end - self.position
+        if archived:
+            self._write_segment(data, self.position, end)
+        self.position = end
+        if os.path.getsize(self.wal_path) > self.max_wal_bytes:
+            archived += self._restart_wal()
+        return archived
+
+    def _write_segment(self, data, start, end):
+        frame_size = FRAME_HEADER.size + self.page_size
+        last = data[-frame_size:]
+        db_pages = FRAME_HEADER.unpack(last[:FRAME_HEADER.size])[1]
+        self.segment += 1
+        name = f"{self.segment:08d}.frames.gz"
+        os.makedirs(self.wal_dir, exist_ok=True)
+        path = os.path.join(self.wal_dir, name)
+        with gzip.open(f"{path}.tmp", "wb", compresslevel=1) as f:
+            f.write(data)
+        with open(f"{path}.tmp", "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        entry = {
+            "segment": self.segment,
+            "file": name,
+            "archived_at": _utc_now().strftime(TIME_FORMAT),
+            "salt1": self.salts[0],
+            "first_frame": start + 1,
+            "last_frame": end,
+            "page_size": self.page_size,
+            "db_pages": db_pages,
+            "sha256": _sha256(path),
+        }
+        with open(os.path.join(self.wal_dir, WAL_INDEX), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _restart_wal(self):
+        """
+        Let go of the WAL and checkpoint it with RESTART, so writers start
+        over at frame 1 instead of growing it forever. Until the next write
+        the old frames are still in the file, so the ones committed after
+        the last pass are archived under the write lock; the marker then
+        committed is what starts the new cycle. Returns the number of
+        frames archived.
+        """
+        self._unpin()
+        conn = self._connect(RESTART_BUSY_TIMEOUT_MS)
+        try:
+            # Stalls writers for at most the short busy timeout if readers are behind
+            conn.execute("PRAGMA wal_checkpoint(RESTART)").fetchone()
+        finally:
+            conn.close()
+        self._lock()
+        try:
+            header = self._header()
+            self._check_salts(header)
+            end = _committed_end(self.wal_path, header, self.position)
+            data = _read_frames(self.wal_path, self.page_size, self.position, end)
+            self._commit_marker()
+        finally:
+            self._unlock()
+        archived = end - self.position
+        if archived:
+            self._write_segment(data, self.position, end)
+        self.position = end
+        header = self._header()
+        if header[1:] != self.salts:
+            # No other writer got in between the checkpoint and the marker
+            if header[1] != (self.salts[0] + 1) & 0xFFFFFFFF:
+                raise WalGap("the WAL was restarted more than once")
+            self.salts = header[1:]
+            self.position = 0
+        # Otherwise readers kept the checkpoint from finishing; keep going and retry next pass
+        self._lock()
+        try:
+            self._pin()
+            self._check_salts(self._header())
+        finally:
+            self._unlock()
+        return archived
+
+    def close(self):
+        self._unpin()
+        if self._lock_conn is not None:
+            self._lock_conn.close()
+            self._lock_conn = None
+
+
+def _apply_segments(db_file, snapshot_dir, until=None):
+    """
+    Roll a copy of a snapshot's main database forward by writing the page
+    images of its archived WAL frames into it, segment by segment, up to
+    the last segment archived at or before `until` ("YYYY-MM-DD HH:MM:SS",
+    None = all). Returns (segments applied, archived_at of the last one).
+    """
+    applied, reached = 0, None
+    with open(db_file, "r+b") as db:
+        for segment in _wal_segments(snapshot_dir):
+            if until is not None and segment["archived_at"] > until:
+                break
+            path = os.path.join(snapshot_dir, WAL_DIR, segment["file"])
+            if _sha256(path) != segment["sha256"]:
+                raise RuntimeError(f"WAL segment {segment['file']} is corrupt.")
+            page_size = segment["page_size"]
+            frame_size = FRAME_HEADER.size + page_size
+            with gzip.open(path, "rb") as f:
+                data = f.read()
+            for offset in range(0, len(data), frame_size):
+                page_number, commit_pages = FRAME_HEADER.unpack_from(data, offset)[:2]
+                db.seek((page_number - 1) * page_size)
+                db.write(data[offset + FRAME_HEADER.size:offset + frame_size])
+                if commit_pages:
+                    db.truncate(commit_pages * page_size)
+            applied, reached = applied + 1, segment["archived_at"]
+        db.flush()
+        os.fsync(db.fileno())
+    return applied, reached
+
+
+# ---------------------------------------------------------------------------
+# Restore
+# ---------------------------------------------------------------------------
+
+def find_snapshot(name=None, at=None, backup_dir=None):
+    """
+    The manifest of snapshot `name`, or of the newest one taken at or
+    before `at`, or of the newest one.
+    """
+    snapshots = list_snapshots(backup_dir)
+    if name is not None:
+        matches = [m for m in snapshots
+                   if m["name"] == name or os.path.abspath(m["path"]) == os.path.abspath(name)]
+        if not matches:
+            raise RuntimeError(f"No snapshot named {name}.")
+        return matches[0]
+    if at is not None:
+        snapshots = [m for m in snapshots if m["created_at"] <= at]
+    if not snapshots:
+        raise RuntimeError("No snapshot to restore from.")
+    return snapshots[-1]
+
+
+def restore(manifest, at=None, target_dir=None, log=print):
+    """
+    Rebuild the snapshot's files in a staging directory, roll the main
+    database forward through its WAL archive (up to `at`), run
+    integrity_check on every file and only then copy them into place:
+    into target_dir laid out like the snapshot, or over the live
+    databases. Before overwriting live files, a "pre-restore" snapshot of
+    them is taken. Returns the point in time restored to.
+    """
+    settings = _db_settings()
+    if target_dir is None and manifest["storage_mode"] != settings["storage_mode"]:
+        raise RuntimeError(f"The snapshot was taken with STORAGE_MODE={manifest['storage_mode']}.")
+    snapshot_dir = manifest["path"]
+    staging = os.path.join(target_dir or os.path.dirname(os.path.abspath(settings["path"])),
+                           f"{PARTIAL_PREFIX}restore-{manifest['name']}")
+    shutil.rmtree(staging, ignore_errors=True)
+    restored_to = manifest["created_at"]
+    try:
+        for entry in manifest["files"]:
+            staged = os.path.join(staging, entry["name"])
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            shutil.copyfile(os.path.join(snapshot_dir, entry["name"]), staged)
+            if _sha256(staged) != entry["sha256"]:
+                raise RuntimeError(f"{entry['name']} doesn't match the snapshot's checksum.")
+            if entry["role"] == "main":
+                applied, reached = _apply_segments(staged, snapshot_dir, at)
+                if applied:
+                    restored_to = reached
+                    log(f"Rolled {entry['name']} forward through {applied} WAL segments.")
+                    # Page 1 from the WAL switched it back to WAL mode
+                    conn = sqlite3.connect(staged)
+                    conn.execute("PRAGMA journal_mode = DELETE")
+                    conn.close()
+            problems = integrity_check(staged)
+            if problems:
+                raise RuntimeError(f"Restored {entry['name']} failed integrity_check: {problems[0]}")
+
+        if target_dir is not None:
+            for entry in manifest["files"]:
+                path = os.path.join(target_dir, entry["name"])
+                if os.path.exists(path):
+                    raise RuntimeError(f"{path} already exists.")
+            for entry in manifest["files"]:
+                path = os.path.join(target_dir, entry["name"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(os.path.join(staging, entry["name"]), path)
+            return restored_to
+
+        if os.path.exists(settings["path"]):
+            snapshot(label="pre-restore", log=log)
+        live = {(role, owner): path for role, owner, _, path in _live_files()}
+        router = get_router()
+        for entry in manifest["files"]:
+            if entry["role"] == "shard":
+                path = live.pop(("shard", entry["owner"]), None) or router.shard_path(entry["owner"])
+            elif entry["role"] == "audit":
+                from audit_log import _audit_db_path
+                path = live.pop(("audit", None), None) or _audit_db_path()
+            else:
+                path = live.pop(("main", None))
+            source = sqlite3.connect(os.path.join(staging, entry["name"]))
+            target = create_connection(path, foreign_keys=False)
+            if target is None:
+                source.close()
+                raise RuntimeError(f"Could not open {path}.")
+            try:
+                # Copying into the open database (rather than replacing the
+                # file) keeps its WAL and other connections consistent
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+        for (role, owner), path in live.items():
+            if role == "shard":
+                # Shards created after the snapshot; the pre-restore snapshot has them
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+        return restored_to
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------------
+# Scheduled runs
+# ---------------------------------------------------------------------------
+
+def run_forever(interval, stop_event, wal_archive=False, log=print):
+    """
+    Take a snapshot (and rotate) every `interval` seconds; with
+    wal_archive, ship WAL into the newest snapshot in between.
+    """
+    archiver = None
+    if wal_archive:
+        settings = _db_settings()
+        if settings["storage_mode"] == SHARDED:
+            raise RuntimeError("WAL archiving needs STORAGE_MODE=single.")
+        archiver = WalArchiver(settings["path"],
+                               float(os.getenv("WAL_ARCHIVE_MAX_MB", DEFAULT_ARCHIVE_MAX_MB)) * 1024 * 1024)
+    archive_interval = float(os.getenv("WAL_ARCHIVE_INTERVAL", DEFAULT_ARCHIVE_INTERVAL))
+    next_snapshot = 0.0
+    try:
+        while not stop_event.is_set():
+            try:
+                if time.monotonic() >= next_snapshot:
+                    next_snapshot = time.monotonic() + interval
+                    snapshot(archiver=archiver, log=log)
+                    removed = rotate()
+                    if removed:
+                        log(f"Rotated out {len(removed)} snapshots: {', '.join(removed)}")
+                elif archiver is not None:
+                    archiver.archive()
+            except WalGap as e:
+                # A failed snapshot also ends up here on the next pass, so retries are spaced out
+                log(f"WAL archive has a gap ({e}); starting over with a new snapshot.")
+                next_snapshot = 0.0
+                continue
+            except Exception as e:
+                log(f"Error running backup: {e}")
+            wait = next_snapshot - time.monotonic()
+            if archiver is not None:
+                wait = min(wait, archive_interval)
+            stop_event.wait(max(wait, 0.0))
+        if archiver is not None:
+            try:
+                archiver.archive()
+            except Exception as e:
+                log(f"Error archiving the last WAL frames: {e}")
+    finally:
+        if archiver is not None:
+            archiver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Online backups and point-in-time restore.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("snapshot", help="take a snapshot now, then rotate")
+    p.add_argument("--label", help="name suffix; labelled snapshots are never rotated out")
+    p = commands.add_parser("run", help="take snapshots on a schedule")
+    p.add_argument("--interval", type=float,
+                   default=float(os.getenv("BACKUP_INTERVAL", DEFAULT_INTERVAL)),
+                   help="seconds between snapshots (default BACKUP_INTERVAL or 86400)")
+    p.add_argument("--wal-archive", action="store_true",
+                   help="ship WAL between snapshots for point-in-time restore")
+    commands.add_parser("list", help="list snapshots")
+    p = commands.add_parser("verify", help="check a snapshot (default: all)")
+    p.add_argument("snapshot", nargs="?")
+    p = commands.add_parser("restore", help="restore a snapshot over the live databases")
+    p.add_argument("snapshot", nargs="?", help="snapshot name (default: newest, or newest before --at)")
+    p.add_argument("--at", help="UTC time 'YYYY-MM-DD HH:MM:SS' to roll the WAL archive forward to")
+    p.add_argument("--target", help="restore into this directory instead of over the live files")
+    commands.add_parser("prune", help="apply rotation (BACKUP_KEEP)")
+    args = parser.parse_args()
+
+    if args.command == "snapshot" and args.label and not re.fullmatch(r"[\w.-]+", args.label):
+        parser.error("--label may only contain letters, digits, '_', '.' and '-'")
+    if args.command == "restore" and args.at is not None:
+        try:
+            datetime.strptime(args.at, TIME_FORMAT)
+        except ValueError:
+            parser.error(f"--at must look like {_utc_now().strftime(TIME_FORMAT)}")
+
+    try:
+        if args.command == "snapshot":
+            init_db()
+            path = snapshot(label=args.label)
+            removed = rotate()
+            print(f"Snapshot written to {path}." + (f" Rotated out {len(removed)}." if removed else ""))
+        elif args.command == "run":
+            init_db()
+            stop_event = threading.Event()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(sig, lambda *_: stop_event.set())
+            run_forever(args.interval, stop_event, args.wal_archive)
+        elif args.command == "list":
+            for manifest in list_snapshots():
+                segments = _wal_segments(manifest["path"])
+                size = sum(entry["bytes"] for entry in manifest["files"])
+                line = f"{manifest['name']:40} {manifest['created_at']} UTC  {size / 1024 / 1024:8.1f} MB"
+                if segments:
+                    line += f"  WAL to {segments[-1]['archived_at']} ({len(segments)} segments)"
+                print(line)
+        elif args.command == "verify":
+            manifests = [find_snapshot(args.snapshot)] if args.snapshot else list_snapshots()
+            failed = 0
+            for manifest in manifests:
+                problems = verify(manifest["path"])
+                print(f"{manifest['name']}: " + ("ok" if not problems else "; ".join(problems)))
+                failed += bool(problems)
+            return 1 if failed else 0
+        elif args.command == "restore":
+            manifest = find_snapshot(args.snapshot, args.at)
+            restored_to = restore(manifest, args.at, args.target)
+            where = args.target or "the live databases"
+            print(f"Restored {manifest['name']} to {where}, as of {restored_to} UTC.")
+            if args.target is None:
+                print("Restart the app so it doesn't serve cached data from before the restore.")
+        else:
+            removed = rotate()
+            print(f"Removed {len(removed)} snapshots.")
+    except (RuntimeError, OSError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+"""
+Reproducible benchmarks for the auth and supplier paths.
+
+    python -m benchmarks.generate --db bench.db --users 50 --suppliers-per-user 2000
+    python -m benchmarks --db bench.db --output results.json
+    python -m benchmarks.compare baseline.json results.json
+    python -m benchmarks.loadtest --db bench.db --sessions 1 2 4 8 16
+
+The Streamlit pages run against a stub `streamlit` module (st_shim) and
+email goes to an in-process SMTP server (smtp_stub), so timings cover
+only our code, SQLite and the mail handoff. The load test instead drives
+the real app.py through Streamlit's AppTest from concurrent sessions.
+"""
@@ -0,0 +1,82 @@
+# benchmarks/compare.py
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare baseline.json results.json --threshold 0.15
+
+Prints the change of every latency percentile and of rows/sec per
+scenario, and exits with status 1 if any scenario's p95 got slower (or
+its rows/sec lower) by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+LATENCY_KEYS = ("p50_ms", "p95_ms", "p99_ms")
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def compare(baseline, current, threshold):
+    """
+    Returns (rows, regressions) where rows are printable comparison lines.
+    """
+    lines = []
+    regressions = []
+    for name in sorted(set(baseline["results"]) | set(current["results"])):
+        old = baseline["results"].get(name)
+        new = current["results"].get(name)
+        if old is None or new is None:
+            lines.append(f"{name:45} {'only in baseline' if new is None else 'new scenario'}")
+            continue
+        parts = []
+        for key in LATENCY_KEYS:
+            change = _change(old[key], new[key])
+            parts.append(f"{key[:3]} {new[key]:9.2f}ms ({change:+.0%})")
+        if old.get("rows_per_sec") and new.get("rows_per_sec"):
+            change = _change(old["rows_per_sec"], new["rows_per_sec"])
+            parts.append(f"rows/s {new['rows_per_sec']:10.0f} ({change:+.0%})")
+            if change < -threshold:
+                regressions.append(f"{name}: rows/sec {change:+.0%}")
+        lines.append(f"{name:45} " + "  ".join(parts))
+
+        p95_change = _change(old["p95_ms"], new["p95_ms"])
+        if p95_change is not None and p95_change > threshold:
+            regressions.append(f"{name}: p95 {p95_change:+.0%}")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.15,
+                        help="relative slowdown that counts as a regression (default 0.15)")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    if baseline.get("dataset", {}).get("suppliers") != current.get("dataset", {}).get("suppliers"):
+        print("Warning: the runs used different datasets; the comparison may be meaningless.")
+
+    lines, regressions = compare(baseline, current, args.threshold)
+    for line in lines:
+        print(line)
+    if regressions:
+        print(f"\nRegressions over {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"- {regression}")
+        return 1
+    print("\nNo regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
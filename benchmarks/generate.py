@@ -0,0 +1,133 @@
+# benchmarks/generate.py
+"""
+Build a synthetic password_manager.db.
+
+    python -m benchmarks.generate --db bench.db --users 50 --suppliers-per-user 2000
+
+Every user is called user<N> with email user<N>@bench.invalid and the
+password BENCH_PASSWORD. last_reset values are spread over the last
+BENCH_RESET_SPREAD_DAYS days so a realistic share of suppliers is due for
+a reminder. The same seed always produces the same data.
+"""
+import argparse
+import os
+import random
+import time
+
+BENCH_PASSWORD = "bench-password"
+BENCH_RESET_SPREAD_DAYS = 45
+INSERT_BATCH = 5000
+
+
+def _configure(db_path):
+    """
+    Point the app's database layer at db_path.
+    """
+    os.environ["DB_PATH"] = db_path
+    import database
+    database.close_pool()
+    database._schema_ready = False
+    return database
+
+
+def generate_vault(db_path, users=10, suppliers_per_user=1000, seed=1234,
+                   encrypt=True, progress=None):
+    """
+    Create (or extend) a database at db_path with synthetic users and
+    suppliers. Returns the list of generated user ids.
+    """
+    database = _configure(db_path)
+    database.init_db()
+
+    from passwords import hash_password
+    from vault_crypto import get_data_key
+
+    rng = random.Random(seed)
+    # One hash for everyone keeps generation fast; sign-in still pays the full KDF
+    password_hash = hash_password(BENCH_PASSWORD)
+    now = time.time()
+    user_ids = []
+
+    with database.get_connection() as conn:
+        start = conn.execute("SELECT COALESCE(MAX(user_id), 0) FROM users").fetchone()[0]
+        conn.executemany(
+            "INSERT INTO users (username, email, password) VALUES (?, ?, ?)",
+            [(f"user{start + i + 1}", f"user{start + i + 1}@bench.invalid", password_hash)
+             for i in range(users)]
+        )
+        user_ids = [row[0] for row in conn.execute(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id", (start,)
+        )]
+
+    for done, owner in enumerate(user_ids, 1):
+        data_key = get_data_key(owner)
+        rows = []
+        for n in range(suppliers_per_user):
+            password = f"pw-{rng.getrandbits(48):012x}"
+            reset_at = now - rng.uniform(0, BENCH_RESET_SPREAD_DAYS * 86400)
+            rows.append((
+                f"Supplier {n:06d} {rng.choice(['Air', 'Rail', 'Hotel', 'Car', 'Cruise'])}",
+                f"OFF{rng.randint(100, 999)}",
+                f"agent{n}",
+                password,
+                len(password),
+                f"https://portal{n % 97}.example.com/login",
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(reset_at)),
+                owner,
+            ))
+            if len(rows) >= INSERT_BATCH:
+                _insert(database, owner, rows, data_key if encrypt else None)
+                rows = []
+        if rows:
+            _insert(database, owner, rows, data_key if encrypt else None)
+        if progress:
+            progress(done, len(user_ids))
+    return user_ids
+
+
+def _insert(database, owner, rows, data_key=None):
+    """
+    Insert rows of plaintext passwords, encrypted under data_key if given.
+    Ids are assigned here because each ciphertext is bound to its row's id.
+    """
+    from vault_crypto import encrypt_secret
+
+    with database.get_connection(owner) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        first_id = database.next_supplier_id(conn)
+        params = []
+        for supplier_id, row in enumerate(rows, first_id):
+            password = row[3]
+            if data_key is not None:
+                password = encrypt_secret(owner, supplier_id, password, data_key)
+            params.append((supplier_id,) + row[:3] + (password,) + row[4:])
+        conn.executemany("""
+            INSERT INTO suppliers
+              (supplier_id, supplier_name, office_id, user_id, password, password_length, url, last_reset,
+               owner_user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic password_manager.db.")
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--suppliers-per-user", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--plaintext", action="store_true", help="store supplier passwords unencrypted")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    user_ids = generate_vault(
+        args.db, args.users, args.suppliers_per_user, args.seed,
+        encrypt=not args.plaintext,
+        progress=lambda done, total: print(f"\r{done}/{total} users", end=""),
+    )
+    elapsed = time.perf_counter() - start
+    print(f"\nGenerated {len(user_ids)} users x {args.suppliers_per_user} suppliers "
+          f"in {elapsed:.1f}s -> {args.db}")
+
+
+if __name__ == "__main__":
+    main()
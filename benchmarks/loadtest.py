@@ -0,0 +1,431 @@
+# benchmarks/loadtest.py
+"""
+Load test: drive app.py through Streamlit's AppTest from a rising number
+of concurrent sessions, to see when reruns start slowing down.
+
+    python -m benchmarks.loadtest --db bench.db --sessions 1 2 4 8 16 --output load.json
+
+Every session repeats the same journey, each time in a fresh browser
+session: register a new account, sign in as one of the generated users,
+view supplier details, modify a supplier URL with an emailed OTP and
+import a CSV from a server path. Each stage starts from its own copy of
+the seeded database (generated like `python -m benchmarks` does if it is
+missing) and reports journeys/sec plus p50/p99 and throughput per step,
+the SQLite write-lock waits and lock timeouts (see metrics.LOCK_WAIT_MS)
+and connection pool waits.
+
+AppTest swaps process-wide Streamlit state (the runtime singleton, config
+options) on every run, so sessions can't share a process: each runs in a
+worker process of its own, with its own SMTP stand-in. They contend on
+the shared database file, but group commit and the read cache only ever
+see one session's traffic, so write-lock waits come out higher than in a
+single app.py process serving the same sessions.
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import re
+import sqlite3
+import sys
+import tempfile
+import time
+import traceback
+from datetime import datetime, timezone
+from benchmarks.generate import BENCH_PASSWORD, generate_vault
+from benchmarks.runner import _configure_environment, _copy_database, _copy_shards, percentiles
+
+RESULTS_FORMAT = 1
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+STEPS = ("register", "sign_in", "view_suppliers", "modify_send_otp", "modify_confirm", "import_csv")
+# How long a session waits for its OTP email before the step counts as failed
+OTP_WAIT_SECONDS = 10.0
+# How long the stage waits for every worker to import Streamlit and the app
+READY_TIMEOUT = 120.0
+
+
+class StepFailed(Exception):
+    pass
+
+
+def _find(elements, label):
+    for element in elements:
+        if element.label == label:
+            return element
+    raise StepFailed(f"no widget labelled {label!r}")
+
+
+def _expect(at, text):
+    """
+    Fail unless one of the page's text elements contains `text`.
+    """
+    for group in (at.markdown, at.success, at.info, at.error):
+        for element in group:
+            if text in str(element.value):
+                return
+    errors = [str(e.value) for e in at.error]
+    raise StepFailed(f"expected {text!r}" + (f", got error {errors[0]!r}" if errors else ""))
+
+
+class LoadSession:
+    """
+    One simulated user. Times every step of its journeys; a failed step
+    ends that journey and is counted against the step.
+    """
+
+    def __init__(self, index, settings, smtp):
+        self.index = index
+        self.settings = settings
+        self.smtp = smtp
+        self.samples = {step: [] for step in STEPS}
+        self.errors = {}
+        self.first_errors = {}
+        self.journeys = 0
+
+    def _run(self, at):
+        at.run(timeout=self.settings["timeout"])
+        if at.exception:
+            raise StepFailed(f"app raised: {at.exception[0].value}")
+
+    def _fail(self, name, error):
+        self.errors[name] = self.errors.get(name, 0) + 1
+        self.first_errors.setdefault(name, f"{type(error).__name__}: {error}")
+
+    def _step(self, name, action):
+        start = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self._fail(name, e)
+            raise
+        self.samples[name].append(time.perf_counter() - start)
+
+    def _read_otp(self, sent, email):
+        if not self.smtp.wait_for(sent + 1, OTP_WAIT_SECONDS):
+            raise StepFailed("OTP email never arrived")
+        message = self.smtp.last_message_to(email)
+        return re.search(r"\b(\d{6})\b", message["body"]).group(1)
+
+    def _write_csv(self, journey):
+        path = os.path.join(self.settings["workdir"], f"import_{self.index}_{journey}.csv")
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Supplier Name", "Office ID", "User ID", "Password", "URL"])
+            for i in range(self.settings["import_rows"]):
+                writer.writerow([f"Load {self.index} {journey} {i}", "OFF1", f"load{i}",
+                                 f"pw-{self.index}-{journey}-{i}", "https://load.example.com"])
+        return path
+
+    def journey(self, number):
+        from streamlit.testing.v1 import AppTest
+
+        at = AppTest.from_file(APP_PATH, default_timeout=self.settings["timeout"])
+        self._run(at)
+        username, email = self.settings["username"], self.settings["email"]
+        new_user = f"load_{self.index}_{number}"
+
+        def register():
+            _find(at.text_input, "Enter a unique username:").input(new_user)
+            _find(at.text_input, "Enter your email:").input(f"{new_user}@load.invalid")
+            _find(at.text_input, "Enter your password:").input(BENCH_PASSWORD)
+            _find(at.button, "Register").click()
+            self._run(at)
+            _expect(at, "Registration successful!")
+
+        def sign_in():
+            _find(at.radio, "Choose an option:").set_value("Sign In")
+            self._run(at)
+            _find(at.text_input, "Username:").input(username)
+            _find(at.text_input, "Password:").input(BENCH_PASSWORD)
+            _find(at.button, "Sign In").click()
+            self._run(at)
+            _find(at.selectbox, "Choose an action:")
+
+        def view_suppliers():
+            _find(at.selectbox, "Choose an action:").set_value("View Supplier Details")
+            self._run(at)
+            _find(at.button, "Send OTP to Unmask Password")
+
+        def modify_send_otp():
+            _find(at.selectbox, "Choose an action:").set_value("Modify Supplier Details")
+            self._run(at)
+            _find(at.selectbox, "Which field do you want to modify?").set_value("url")
+            _find(at.text_input, "Enter new value:").input(f"https://load.example.com/{self.index}/{number}")
+            _find(at.button, "Send OTP to Modify").click()
+            self._run(at)
+            _expect(at, "OTP is on its way!")
+
+        def modify_confirm():
+            _find(at.text_input, "Enter OTP for modifying supplier:").input(code)
+            _find(at.button, "Confirm Modification").click()
+            self._run(at)
+            _expect(at, "url updated successfully.")
+
+        def import_csv():
+            _find(at.selectbox, "Choose an action:").set_value("Add New Suppliers")
+            self._run(at)
+            _find(at.text_input, "Or enter the full path of a CSV file on the server:").input(path)
+            _find(at.button, "Import CSV").click()
+            self._run(at)
+            _expect(at, "Suppliers imported from CSV")
+
+        self._step("register", register)
+        self._step("sign_in", sign_in)
+        self._step("view_suppliers", view_suppliers)
+        sent = len(self.smtp.messages)
+        self._step("modify_send_otp", modify_send_otp)
+        # Mail delivery isn't timed, only the reruns around it
+        try:
+            code = self._read_otp(sent, email)
+        except Exception as e:
+            self._fail("modify_confirm", e)
+            raise
+        self._step("modify_confirm", modify_confirm)
+        path = self._write_csv(number)
+        try:
+            self._step("import_csv", import_csv)
+        finally:
+            os.remove(path)
+        self.journeys += 1
+
+    def report(self):
+        import database
+        import metrics
+
+        waits, wait_seconds, timeouts = metrics.lock_wait_counts()
+        pool = database.pool_stats()
+        return {
+            "journeys": self.journeys,
+            "samples": self.samples,
+            "errors": self.errors,
+            "first_errors": self.first_errors,
+            "lock_waits": waits,
+            "lock_wait_seconds": wait_seconds,
+            "lock_timeouts": timeouts,
+            "pool_waits": pool["waits"],
+            "pool_timeouts": pool["timeouts"],
+        }
+
+
+def _session_worker(index, settings, start, results):
+    """
+    Worker process body: set up, say "ready", wait for `start`, run the
+    journeys and put the session's report on `results`.
+    """
+    try:
+        # Each worker collects its own metrics and reports them through `results`
+        os.environ["METRICS_ENABLED"] = "1"
+        os.environ.pop("METRICS_PORT", None)
+        os.environ.pop("METRICS_FILE", None)
+        # AppTest outside `streamlit run` warns about the missing script context on every run
+        os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+        # Slow reruns show in the step percentiles; set SLOW_QUERY_MS to log statements too
+        os.environ.setdefault("SLOW_QUERY_MS", "60000")
+        from smtp_stub import LocalSMTPServer
+
+        with LocalSMTPServer() as smtp:
+            _configure_environment(smtp, settings["db_path"])
+            # Import Streamlit and the app once, outside the timings
+            from streamlit.testing.v1 import AppTest
+            AppTest.from_file(APP_PATH, default_timeout=settings["timeout"]).run()
+
+            session = LoadSession(index, settings, smtp)
+            results.put(("ready", index, None))
+            start.wait()
+            for number in range(settings["journeys"]):
+                try:
+                    session.journey(number)
+                except Exception:
+                    pass
+
+            import audit_log
+            audit_log.get_audit_log().close()
+            results.put(("done", index, session.report()))
+    except Exception:
+        results.put(("failed", index, traceback.format_exc()))
+
+
+def _collect(results, workers, kind):
+    """
+    Wait for one `kind` message from every worker. Returns {index: payload};
+    workers that failed or died are reported and left out.
+    """
+    pending = set(range(len(workers)))
+    payloads = {}
+    deadline = time.monotonic() + READY_TIMEOUT if kind == "ready" else None
+    while pending:
+        try:
+            status, index, payload = results.get(timeout=1.0)
+        except queue.Empty:
+            for index in [i for i in pending if not workers[i].is_alive()]:
+                print(f"Error: session {index} exited without a report.", file=sys.stderr)
+                pending.discard(index)
+            if deadline is not None and time.monotonic() > deadline:
+                print(f"Error: {len(pending)} sessions never got ready.", file=sys.stderr)
+                break
+            continue
+        pending.discard(index)
+        if status == "failed":
+            print(f"Error in session {index}:\n{payload}", file=sys.stderr)
+        else:
+            payloads[index] = payload
+    return payloads
+
+
+def run_stage(source_db, sessions, users, args, workdir):
+    """
+    Run `sessions` concurrent sessions against a fresh copy of source_db.
+    """
+    stage_dir = os.path.join(workdir, f"stage_{sessions}")
+    os.makedirs(stage_dir)
+    db_path = os.path.join(stage_dir, "password_manager.db")
+    _copy_database(source_db, db_path)
+    _copy_shards(os.getenv("SHARD_DIR") or f"{os.path.splitext(source_db)[0]}_shards",
+                 os.path.join(stage_dir, "password_manager_shards"))
+
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    workers = []
+    for index in range(sessions):
+        username, email = users[index % len(users)]
+        settings = {
+            "db_path": db_path,
+            "workdir": stage_dir,
+            "username": username,
+            "email": email,
+            "journeys": args.journeys,
+            "import_rows": args.import_rows,
+            "timeout": args.timeout,
+        }
+        worker = context.Process(target=_session_worker, args=(index, settings, start, results), daemon=True)
+        worker.start()
+        workers.append(worker)
+
+    _collect(results, workers, "ready")
+    began = time.monotonic()
+    start.set()
+    reports = _collect(results, workers, "done")
+    elapsed = time.monotonic() - began
+    for worker in workers:
+        worker.join(timeout=10)
+
+    steps = {}
+    for step in STEPS:
+        samples = [s for report in reports.values() for s in report["samples"][step]]
+        errors = sum(report["errors"].get(step, 0) for report in reports.values())
+        result = {"count": len(samples), "errors": errors, "ops_per_sec": len(samples) / elapsed}
+        if samples:
+            result["mean_ms"] = sum(samples) / len(samples) * 1000
+            result["max_ms"] = max(samples) * 1000
+            result.update(percentiles(samples))
+        first_error = next((r["first_errors"][step] for r in reports.values() if step in r["first_errors"]), None)
+        if first_error:
+            result["first_error"] = first_error
+        steps[step] = result
+
+    journeys = sum(report["journeys"] for report in reports.values())
+    return {
+        "sessions": sessions,
+        "sessions_reporting": len(reports),
+        "journeys": journeys,
+        "elapsed_s": elapsed,
+        "journeys_per_sec": journeys / elapsed if elapsed else None,
+        "steps": steps,
+        "sqlite": {
+            key: sum(report[key] for report in reports.values())
+            for key in ("lock_waits", "lock_wait_seconds", "lock_timeouts", "pool_waits", "pool_timeouts")
+        },
+    }
+
+
+def format_stage(stage):
+    sqlite = stage["sqlite"]
+    lines = [
+        f"{stage['sessions']:4} sessions: {stage['journeys']} journeys in {stage['elapsed_s']:.1f}s "
+        f"({stage['journeys_per_sec']:.2f}/s), lock waits {sqlite['lock_waits']:.0f} "
+        f"({sqlite['lock_wait_seconds']:.2f}s), lock timeouts {sqlite['lock_timeouts']:.0f}, "
+        f"pool waits {sqlite['pool_waits']}"
+    ]
+    for step, result in stage["steps"].items():
+        if result["count"]:
+            timing = f"p50 {result['p50_ms']:9.1f}ms  p99 {result['p99_ms']:9.1f}ms"
+        else:
+            timing = f"{'-':>14}  {'-':>15}"
+        lines.append(f"       {step:16} {timing}  {result['ops_per_sec']:7.2f}/s  {result['errors']} errors")
+        if result.get("first_error"):
+            lines.append(f"         first error: {result['first_error']}")
+    return "\n".join(lines)
+
+
+parser = argparse.ArgumentParser(description="Concurrent-session load test of app.py.")
+parser.add_argument("--db", default="bench.db", help="seeded source database (generated if missing)")
+parser.add_argument("--users", type=int, default=10)
+parser.add_argument("--suppliers-per-user", type=int, default=1000)
+parser.add_argument("--seed", type=int, default=1234)
+parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8],
+                    help="concurrent session counts, one stage each")
+parser.add_argument("--journeys", type=int, default=3, help="journeys per session per stage")
+parser.add_argument("--import-rows", type=int, default=100, help="rows per CSV import")
+parser.add_argument("--timeout", type=float, default=60.0, help="seconds one script run may take")
+parser.add_argument("--output", help="write JSON results here (default: stdout)")
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"Generating {args.db} ({args.users} users x {args.suppliers_per_user} suppliers)...",
+              file=sys.stderr)
+        generate_vault(args.db, args.users, args.suppliers_per_user, args.seed)
+
+    source = sqlite3.connect(args.db)
+    users = source.execute(
+        "SELECT username, email FROM users WHERE username LIKE 'user%' ORDER BY user_id"
+    ).fetchall()
+    source.close()
+    if not users:
+        print(f"Error: {args.db} has no generated users.", file=sys.stderr)
+        return 1
+
+    stages = []
+    with tempfile.TemporaryDirectory(prefix="loadtest_") as workdir:
+        for sessions in args.sessions:
+            print(f"{sessions} sessions x {args.journeys} journeys...", file=sys.stderr)
+            stage = run_stage(args.db, sessions, users, args, workdir)
+            print(format_stage(stage), file=sys.stderr)
+            stages.append(stage)
+
+    report = {
+        "format": RESULTS_FORMAT,
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "dataset": {
+            "source": os.path.abspath(args.db),
+            "users": len(users),
+            "seed": args.seed,
+            "journeys_per_session": args.journeys,
+            "import_rows": args.import_rows,
+        },
+        "stages": stages,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+# benchmarks/runner.py
+"""
+Run the timing scenarios and write the results as JSON.
+
+    python -m benchmarks --db bench.db --output results.json
+    python -m benchmarks --db bench.db --scenario auth.sign_in --iterations 20
+
+The source database is copied to a scratch directory first, so every run
+starts from the same data. If it does not exist it is generated with
+--users / --suppliers-per-user / --seed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from benchmarks import st_shim
+from benchmarks.generate import generate_vault
+from benchmarks.scenarios import SCENARIOS, BenchContext
+
+RESULTS_FORMAT = 1
+DEFAULT_WARMUP = 3
+
+
+def percentiles(samples):
+    """
+    p50/p95/p99 of a list of seconds, in milliseconds.
+    """
+    if len(samples) == 1:
+        return {"p50_ms": samples[0] * 1000, "p95_ms": samples[0] * 1000, "p99_ms": samples[0] * 1000}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50_ms": cuts[49] * 1000, "p95_ms": cuts[94] * 1000, "p99_ms": cuts[98] * 1000}
+
+
+def run_scenario(bench, ctx, iterations, warmup, seed, cold_cache=False):
+    """
+    Time `iterations` calls of one scenario after `warmup` untimed ones.
+    """
+    from cache import vault_cache
+
+    rng = random.Random(seed)
+    for _ in range(warmup):
+        bench.func(ctx, rng)
+
+    samples = []
+    rows = 0
+    for _ in range(iterations):
+        if cold_cache:
+            vault_cache.clear()
+        start = time.perf_counter()
+        rows += bench.func(ctx, rng)
+        samples.append(time.perf_counter() - start)
+
+    total = sum(samples)
+    result = {
+        "iterations": iterations,
+        "rows": rows,
+        "total_s": total,
+        "mean_ms": total / iterations * 1000,
+        "max_ms": max(samples) * 1000,
+        "ops_per_sec": iterations / total if total else None,
+        "rows_per_sec": rows / total if total and rows else None,
+    }
+    result.update(percentiles(samples))
+    return result
+
+
+def _copy_database(source, target):
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def _copy_shards(source_dir, target_dir):
+    """
+    Copy the shard files of a STORAGE_MODE=sharded database, if any.
+    """
+    if not os.path.isdir(source_dir):
+        return
+    os.makedirs(target_dir, exist_ok=True)
+    for name in os.listdir(source_dir):
+        if name.endswith(".db"):
+            _copy_database(os.path.join(source_dir, name), os.path.join(target_dir, name))
+
+
+def _configure_environment(smtp, db_path):
+    # Must happen before the app modules are imported: they read it at import time
+    os.environ["DB_PATH"] = db_path
+    # Shards of the copy go next to it (see database.SHARD_DIR)
+    os.environ.pop("SHARD_DIR", None)
+    # ...and so does its audit log, so runs never write to the real one
+    os.environ.pop("AUDIT_DB_PATH", None)
+    os.environ["EMAIL_HOST"] = smtp.host
+    os.environ["EMAIL_PORT"] = str(smtp.port)
+    os.environ["EMAIL_USE_TLS"] = "0"
+    os.environ["EMAIL_USER"] = "bench@bench.invalid"
+    os.environ["EMAIL_PASSWORD"] = "bench"
+    # Scenarios repeat OTP actions far faster than a person would
+    os.environ.setdefault("OTP_SEND_LIMIT", "1000000/1")
+    os.environ.setdefault("OTP_VERIFY_LIMIT", "1000000/1")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the auth and supplier paths.")
+    parser.add_argument("--db", default="bench.db", help="source database (generated if missing)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--suppliers-per-user", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="run only this scenario (repeatable)")
+    parser.add_argument("--iterations", type=int, help="override every scenario's iteration count")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--import-rows", type=int, default=500, help="rows per CSV import")
+    parser.add_argument("--cold-cache", action="store_true", help="clear the read cache before every call")
+    parser.add_argument("--output", help="write JSON results here (default: stdout)")
+    parser.add_argument("--list", action="store_true", help="list scenarios and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, bench in sorted(SCENARIOS.items()):
+            print(f"{name:45} {bench.description}")
+        return 0
+
+    st_shim.install()
+    from smtp_stub import LocalSMTPServer
+
+    if not os.path.exists(args.db):
+        print(f"Generating {args.db} ({args.users} users x {args.suppliers_per_user} suppliers)...",
+              file=sys.stderr)
+        generate_vault(args.db, args.users, args.suppliers_per_user, args.seed)
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir, LocalSMTPServer() as smtp:
+        db_path = os.path.join(workdir, "password_manager.db")
+        _copy_database(args.db, db_path)
+        _copy_shards(os.getenv("SHARD_DIR") or f"{os.path.splitext(args.db)[0]}_shards",
+                     os.path.join(workdir, "password_manager_shards"))
+        _configure_environment(smtp, db_path)
+
+        import database
+        database.close_pool()
+        database._schema_ready = False
+        database.init_db()
+
+        with database.get_connection() as conn:
+            users = conn.execute(
+                "SELECT user_id, username, email, password FROM users WHERE username LIKE 'user%'"
+            ).fetchall()
+        supplier_count = 0
+        for partition in database.storage_partitions():
+            with database.get_connection(partition) as conn:
+                supplier_count += conn.execute("SELECT COUNT(*) FROM suppliers").fetchone()[0]
+        if not users:
+            print(f"Error: {args.db} has no generated users.", file=sys.stderr)
+            return 1
+        ctx = BenchContext(users, smtp, workdir, args.import_rows)
+
+        results = {}
+        for name in args.scenario or sorted(SCENARIOS):
+            bench = SCENARIOS[name]
+            iterations = args.iterations or bench.iterations
+            print(f"{name} x{iterations}...", file=sys.stderr)
+            results[name] = run_scenario(bench, ctx, iterations, args.warmup, args.seed, args.cold_cache)
+
+        # Write out buffered audit events while the scratch copy still exists
+        import audit_log
+        audit_log.get_audit_log().close()
+        database.close_pool()
+
+    from passwords import current_params
+    algorithm, params = current_params()
+    report = {
+        "format": RESULTS_FORMAT,
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "kdf": f"{algorithm} {params}",
+        },
+        "dataset": {
+            "source": os.path.abspath(args.db),
+            "users": len(users),
+            "suppliers": supplier_count,
+            "seed": args.seed,
+            "cold_cache": args.cold_cache,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
@@ -0,0 +1,181 @@
+# benchmarks/scenarios.py
+"""
+Timing scenarios, one per public auth/supplier entry point.
+
+Each scenario is a function (ctx, rng) -> rows, where rows is the number
+of supplier rows the call produced or rendered (0 when that isn't
+meaningful). The runner times every call and derives rows/sec from it.
+Pages are driven through st_shim by scripting widget answers.
+"""
+import csv
+import os
+import re
+from benchmarks import st_shim
+from benchmarks.generate import BENCH_PASSWORD
+
+SCENARIOS = {}
+
+
+class Scenario:
+
+    def __init__(self, name, func, iterations, description):
+        self.name = name
+        self.func = func
+        self.iterations = iterations
+        self.description = description
+
+
+def scenario(name, iterations=100):
+    def register(func):
+        SCENARIOS[name] = Scenario(name, func, iterations, (func.__doc__ or "").strip())
+        return func
+    return register
+
+
+class BenchContext:
+    """
+    State shared by scenarios: the users of the synthetic vault, the SMTP
+    stand-in and a scratch directory.
+    """
+
+    def __init__(self, users, smtp, workdir, import_rows=500):
+        self.users = users            # list of (user_id, username, email, password_hash)
+        self.smtp = smtp
+        self.workdir = workdir
+        self.import_rows = import_rows
+        self.counter = 0
+
+    def next_id(self):
+        self.counter += 1
+        return self.counter
+
+    def random_user(self, rng):
+        return rng.choice(self.users)
+
+
+def _render(page, current_user, **answers):
+    """
+    Run a page once, signed in as current_user (a users row), with fresh
+    widget answers; returns the shim counters. The session stays open
+    until the next render, so a scenario can inspect what the page kept.
+    """
+    import sessions
+    sessions.end_session()
+    st_shim.reset()
+    st_shim.answers.update(answers)
+    principal = sessions.start_session(current_user)
+    try:
+        page(principal)
+    except st_shim.RerunRequested:
+        pass
+    return st_shim.stats
+
+
+@scenario("auth.sign_in", iterations=50)
+def bench_sign_in(ctx, rng):
+    """Sign in an existing user (lookup + KDF verify)."""
+    from auth import sign_in
+    ok, message, _ = sign_in(ctx.random_user(rng)[1], BENCH_PASSWORD)
+    if not ok:
+        raise RuntimeError(message)
+    return 0
+
+
+@scenario("auth.register", iterations=50)
+def bench_register(ctx, rng):
+    """Register a new user (uniqueness check + KDF hash + insert)."""
+    from auth import register
+    n = ctx.next_id()
+    ok, message = register(f"bench_new_{os.getpid()}_{n}", f"bench_new_{os.getpid()}_{n}@bench.invalid",
+                           BENCH_PASSWORD)
+    if not ok:
+        raise RuntimeError(message)
+    return 0
+
+
+@scenario("suppliers.add_new_suppliers.csv", iterations=10)
+def bench_add_new_suppliers_csv(ctx, rng):
+    """Import a fresh CSV of ctx.import_rows suppliers through the page."""
+    from suppliers import add_new_suppliers
+    n = ctx.next_id()
+    path = os.path.join(ctx.workdir, f"import_{n}.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Supplier Name", "Office ID", "User ID", "Password", "URL"])
+        for i in range(ctx.import_rows):
+            writer.writerow([f"Imported {n} {i}", "OFF1", f"imp{i}", f"pw-{rng.getrandbits(40):x}",
+                             "https://import.example.com"])
+    _render(add_new_suppliers, ctx.random_user(rng), **{
+        "Import Method": "CSV",
+        "Or enter the full path of a CSV file on the server:": path,
+        "Import CSV": True,
+    })
+    os.remove(path)
+    return ctx.import_rows
+
+
+@scenario("suppliers.add_new_suppliers.manual", iterations=100)
+def bench_add_new_suppliers_manual(ctx, rng):
+    """Add one supplier through the manual form."""
+    from suppliers import add_new_suppliers
+    n = ctx.next_id()
+    _render(add_new_suppliers, ctx.random_user(rng), **{
+        "Import Method": "Manual",
+        "Supplier Name:": f"Manual {n}",
+        "User ID:": f"manual{n}",
+        "Password:": "manual-password",
+        "URL:": "https://manual.example.com",
+        "Add Supplier": True,
+    })
+    return 1
+
+
+@scenario("suppliers.view_supplier_details", iterations=200)
+def bench_view_supplier_details(ctx, rng):
+    """Render the details page: first picker page plus one supplier."""
+    from suppliers import PICKER_PAGE_SIZE, view_supplier_details
+    _render(view_supplier_details, ctx.random_user(rng))
+    return PICKER_PAGE_SIZE
+
+
+@scenario("suppliers.view_supplier_details.search", iterations=200)
+def bench_view_supplier_details_search(ctx, rng):
+    """Render the details page with a search-as-you-type query."""
+    from suppliers import PICKER_PAGE_SIZE, view_supplier_details
+    term = rng.choice(["Air", "Rail", "Hot", "Cru", "portal1", "agent12"])
+    _render(view_supplier_details, ctx.random_user(rng), view_picker_query=term)
+    return PICKER_PAGE_SIZE
+
+
+@scenario("suppliers.view_supplier_details.unmask", iterations=30)
+def bench_unmask(ctx, rng):
+    """Send an unmask OTP, read it from the SMTP stand-in, confirm it."""
+    import sessions
+    from suppliers import UNMASKED_PASSWORD, view_supplier_details
+    user = ctx.random_user(rng)
+    sent = len(ctx.smtp.messages)
+    _render(view_supplier_details, user, **{"Send OTP to Unmask Password": True})
+    ctx.smtp.wait_for(sent + 1)
+    message = ctx.smtp.last_message_to(user[2])
+    code = re.search(r"\b(\d{6})\b", message["body"]).group(1) if message else ""
+    _render(view_supplier_details, user, **{"Enter OTP:": code, "Confirm Unmask": True})
+    if not sessions.get_value(UNMASKED_PASSWORD):
+        raise RuntimeError("Unmask failed.")
+    return 1
+
+
+@scenario("suppliers.view_password_reset_reminders", iterations=200)
+def bench_view_password_reset_reminders(ctx, rng):
+    """Render the reminders page."""
+    from suppliers import view_password_reset_reminders
+    stats = _render(view_password_reset_reminders, ctx.random_user(rng))
+    # One write per reminder plus the heading line
+    return max(stats["write"] - 1, 0)
+
+
+@scenario("exporter.write_export", iterations=10)
+def bench_write_export(ctx, rng):
+    """Stream one user's vault to gzipped CSV."""
+    from exporter import write_export
+    with open(os.devnull, "wb") as sink:
+        return write_export(ctx.random_user(rng)[0], sink, compress=True)
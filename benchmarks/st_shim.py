@@ -0,0 +1,163 @@
+# benchmarks/st_shim.py
+"""
+A stand-in for the `streamlit` module so page functions can be timed
+without the Streamlit runtime.
+
+Widgets return scripted answers: set `answers[label_or_key] = value`
+before calling a page. Unscripted widgets return their natural default
+(empty text, unpressed button, first option). Output calls are counted
+in `stats` and otherwise discarded.
+
+Call install() before importing app modules.
+"""
+import sys
+import types
+from collections import Counter
+
+answers = {}
+stats = Counter()
+
+
+class SessionState(dict):
+    """
+    Attribute and item access, like st.session_state.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        del self[name]
+
+
+class _Block:
+    """
+    Returned by columns()/form()/progress(); usable as a context manager.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def progress(self, *args, **kwargs):
+        stats["progress"] += 1
+
+
+class RerunRequested(Exception):
+    pass
+
+
+def _answer(label, key, default):
+    if key is not None and key in answers:
+        return answers[key]
+    return answers.get(label, default)
+
+
+def _output(kind):
+    def render(*args, **kwargs):
+        stats[kind] += 1
+    return render
+
+
+def text_input(label, value="", key=None, **kwargs):
+    stats["text_input"] += 1
+    return _answer(label, key, value)
+
+
+def button(label, key=None, **kwargs):
+    stats["button"] += 1
+    return bool(_answer(label, key, False))
+
+
+def form_submit_button(label="Submit", key=None, **kwargs):
+    return button(label, key=key)
+
+
+def download_button(label, data=None, key=None, **kwargs):
+    stats["download_button"] += 1
+    return bool(_answer(label, key, False))
+
+
+def checkbox(label, value=False, key=None, **kwargs):
+    return bool(_answer(label, key, value))
+
+
+def radio(label, options, index=0, key=None, **kwargs):
+    options = list(options)
+    return _answer(label, key, options[index] if options else None)
+
+
+def selectbox(label, options, index=0, key=None, format_func=str, **kwargs):
+    stats["selectbox"] += 1
+    options = list(options)
+    return _answer(label, key, options[index] if options else None)
+
+
+def multiselect(label, options, default=None, key=None, **kwargs):
+    return list(_answer(label, key, default or []))
+
+
+def number_input(label, value=0, key=None, **kwargs):
+    return _answer(label, key, value)
+
+
+def file_uploader(label, key=None, **kwargs):
+    return _answer(label, key, None)
+
+
+def columns(spec, **kwargs):
+    count = spec if isinstance(spec, int) else len(spec)
+    return [_Block() for _ in range(count)]
+
+
+def form(key, **kwargs):
+    return _Block()
+
+
+def progress(value=0.0, text=None, **kwargs):
+    stats["progress"] += 1
+    return _Block()
+
+
+def rerun():
+    raise RerunRequested()
+
+
+def reset():
+    """
+    Clear scripted answers, counters and session state.
+    """
+    answers.clear()
+    stats.clear()
+    module.session_state.clear()
+
+
+module = types.ModuleType("streamlit")
+module.session_state = SessionState()
+module.RerunRequested = RerunRequested
+for _name, _value in list(globals().items()):
+    if _name in {
+        "text_input", "button", "form_submit_button", "download_button", "checkbox",
+        "radio", "selectbox", "multiselect", "number_input", "file_uploader",
+        "columns", "form", "progress", "rerun",
+    }:
+        setattr(module, _name, _value)
+for _name in ("write", "markdown", "subheader", "success", "error", "info", "warning",
+              "caption", "dataframe", "table", "code", "metric"):
+    setattr(module, _name, _output(_name))
+
+
+def install():
+    """
+    Register the shim as `streamlit` in sys.modules.
+    """
+    sys.modules["streamlit"] = module
+    return module
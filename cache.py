@@ -0,0 +1,174 @@
+# cache.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from database import get_connection
+
+DEFAULT_MAX_ENTRIES = 2048
+# Upper bound on staleness for writes made by other processes (CLI jobs),
+# which cannot bump this process's version counters.
+DEFAULT_TTL = 300.0
+
+# Columns that must never be stored in the shared cache
+SECRET_COLUMNS = {"password"}
+
+
+class SecretColumnError(ValueError):
+    """
+    Raised when a cached query reads a secret column.
+    """
+
+
+class VaultCache:
+    """
+    Bounded LRU cache for per-user read queries.
+
+    Entries are keyed by (owner_user_id, version, sql, params). Every write
+    path calls invalidate_user(), which bumps the owner's version and drops
+    their entries, so a reader never sees data older than the last write
+    made through this process.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        # None: read CACHE_MAX_ENTRIES / CACHE_TTL on first use, after .env
+        # has been loaded, rather than when this module is imported
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._owner_keys = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expired": 0,
+            "invalidations": 0,
+        }
+
+    @property
+    def max_entries(self):
+        if self._max_entries is None:
+            self._max_entries = int(os.getenv("CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        return self._max_entries
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            self._ttl = float(os.getenv("CACHE_TTL", DEFAULT_TTL))
+        return self._ttl
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        keys = self._owner_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._owner_keys[key[0]]
+
+    def get(self, owner_user_id, sql, params):
+        """
+        Return (key, found, value).
+        """
+        with self._lock:
+            key = (owner_user_id, self._versions.get(owner_user_id, 0), sql, params)
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return key, False, None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self._forget(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return key, False, None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return key, True, value
+
+    def put(self, key, value):
+        with self._lock:
+            owner_user_id, version = key[0], key[1]
+            # A write may have happened while the query ran
+            if version != self._versions.get(owner_user_id, 0):
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            self._owner_keys.setdefault(owner_user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._forget(oldest)
+                self._stats["evictions"] += 1
+
+    def invalidate_user(self, owner_user_id):
+        with self._lock:
+            self._versions[owner_user_id] = self._versions.get(owner_user_id, 0) + 1
+            for key in list(self._owner_keys.get(owner_user_id, ())):
+                self._forget(key)
+            self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._owner_keys.clear()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["entries"] = len(self._entries)
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_ratio"] = snapshot["hits"] / lookups if lookups else 0.0
+        snapshot["max_entries"] = self.max_entries
+        return snapshot
+
+
+vault_cache = VaultCache()
+
+
+def cached_query(owner_user_id, sql, params=(), one=False):
+    """
+    Run a read-only query for one owner through the cache.
+    Returns a tuple of rows, or a single row (or None) when one=True.
+    Raises SecretColumnError if the query reads a secret column (even
+    under another name), so passwords can never end up in the shared cache.
+    """
+    params = tuple(params)
+    key, found, value = vault_cache.get(owner_user_id, sql, params)
+    if found:
+        return value
+
+    secret = set()
+
+    def authorizer(action, table, column, database, trigger):
+        # Sees the table columns a statement reads, whatever they are renamed to
+        if action == sqlite3.SQLITE_READ and column and column.lower() in SECRET_COLUMNS:
+            secret.add(column.lower())
+        return sqlite3.SQLITE_OK
+
+    with get_connection(owner_user_id) as conn:
+        conn.set_authorizer(authorizer)
+        try:
+            cursor = conn.execute(sql, params)
+        finally:
+            conn.set_authorizer(None)
+        secret.update(column[0].lower() for column in cursor.description or ()
+                      if column[0].lower() in SECRET_COLUMNS)
+        if secret:
+            raise SecretColumnError(f"Refusing to cache secret column(s): {', '.join(sorted(secret))}")
+        value = cursor.fetchone() if one else tuple(cursor.fetchall())
+
+    vault_cache.put(key, value)
+    return value
+
+
+def invalidate_user(owner_user_id):
+    """
+    Call after every write to an owner's suppliers.
+    """
+    vault_cache.invalidate_user(owner_user_id)
+
+
+def cache_stats():
+    return vault_cache.stats()
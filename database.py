@@ -1,28 +1,553 @@
+import os
+import queue
+import re
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import metrics
 
-def create_connection():
+# Connection settings. Read lazily (on first pool use) so values from .env,
+# which email_otp loads at import time, are picked up as well.
+DEFAULT_DB_PATH = "password_manager.db"
+DEFAULT_POOL_SIZE = 8
+DEFAULT_POOL_TIMEOUT = 30.0     # seconds to wait for a free pooled connection
+DEFAULT_BUSY_TIMEOUT = 5000     # milliseconds SQLite waits on a locked database
+DEFAULT_CACHE_SIZE = -16000     # negative = KiB, so roughly 16 MB of page cache
+DEFAULT_MMAP_SIZE = 64 * 1024 * 1024
+
+# STORAGE_MODE=sharded keeps users, OTPs and scheduler state in the DB_PATH
+# "directory" database and every owner's suppliers in a shard file of its
+# own under SHARD_DIR, so one user's big import doesn't hold the write lock
+# for everyone else.
+SINGLE = "single"
+SHARDED = "sharded"
+DEFAULT_SHARD_MAX_OPEN = 64     # shard files kept open (LRU)
+DEFAULT_SHARD_POOL_SIZE = 2     # connections per open shard
+SHARD_FILE_PATTERN = re.compile(r"^owner_(\d+)\.db$")
+
+# Supplier password rotation: a password expires rotation_days after its
+# last reset (0 = never) and is reported as due warning_days before that.
+# Both come from the supplier's own policy if set, else from the owner's
+# defaults (rotation_defaults), else from these.
+# Timestamps are stored as UTC 'YYYY-MM-DD HH:MM:SS' text, i.e. what
+# SQLite's DATETIME('now') produces, so they compare correctly as strings.
+PASSWORD_EXPIRY_DAYS = 30
+REMINDER_WINDOW_DAYS = 7
+# reminders_due also holds suppliers whose warning opens within this many
+# days, so the sweep that extends it only has to run about once a day.
+REMINDERS_DUE_LOOKAHEAD_DAYS = 1
+REMINDERS_DUE_COVERED = "reminders_due.covered_until"
+
+
+def _db_settings():
+    """
+    Collect connection settings from the environment.
+    """
+    path = os.getenv("DB_PATH", DEFAULT_DB_PATH)
+    return {
+        "path": path,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", DEFAULT_POOL_SIZE)),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT)),
+        "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", DEFAULT_BUSY_TIMEOUT)),
+        "cache_size": int(os.getenv("DB_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+        "mmap_size": int(os.getenv("DB_MMAP_SIZE", DEFAULT_MMAP_SIZE)),
+        "storage_mode": os.getenv("STORAGE_MODE", SINGLE).lower(),
+        "shard_dir": os.getenv("SHARD_DIR") or f"{os.path.splitext(path)[0]}_shards",
+        "shard_max_open": int(os.getenv("SHARD_MAX_OPEN", DEFAULT_SHARD_MAX_OPEN)),
+        "shard_pool_size": int(os.getenv("SHARD_POOL_SIZE", DEFAULT_SHARD_POOL_SIZE)),
+    }
+
+
+def _apply_pragmas(conn, busy_timeout, cache_size, mmap_size, foreign_keys=True):
+    """
+    Tune a freshly opened connection: WAL journaling so readers never block
+    the writer, NORMAL sync (safe under WAL), page cache / mmap sizing and a
+    busy timeout instead of failing straight away with 'database is locked'.
     """
-    Create a database connection to the SQLite database
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)};")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA cache_size = {int(cache_size)};")
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    # Enforce foreign key constraints. Shards turn them off: the users
+    # their suppliers refer to live in the directory database.
+    conn.execute(f"PRAGMA foreign_keys = {1 if foreign_keys else 0};")
+
+
+def create_connection(db_path=None, foreign_keys=True):
     """
+    Create a database connection to the SQLite database.
+    Prefer get_connection(), which hands out pooled connections.
+    """
+    settings = _db_settings()
     conn = None
     try:
-        conn = sqlite3.connect("password_manager.db")
-        # Enforce foreign key constraints
-        conn.execute("PRAGMA foreign_keys = 1;")
+        # check_same_thread=False: pooled connections move between Streamlit
+        # script threads, but only one thread uses a connection at a time.
+        conn = sqlite3.connect(
+            db_path or settings["path"],
+            timeout=settings["busy_timeout"] / 1000.0,
+            check_same_thread=False,
+            factory=metrics.connection_factory(),
+        )
+        _apply_pragmas(
+            conn,
+            settings["busy_timeout"],
+            settings["cache_size"],
+            settings["mmap_size"],
+            foreign_keys,
+        )
         return conn
     except sqlite3.Error as e:
         print(f"Error creating DB connection: {e}")
     return conn
 
-def create_tables():
+
+class ConnectionPool:
     """
-    Create the necessary tables in the SQLite database if not present
+    A bounded pool of long-lived SQLite connections.
+
+    Connections are created on demand up to max_size and reused afterwards.
+    When every connection is checked out, callers wait up to `timeout`
+    seconds for one to be returned.
     """
-    conn = create_connection()
-    cursor = conn.cursor()
 
-    # Create users table
-    cursor.execute("""
+    def __init__(self, db_path, max_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT, foreign_keys=True):
+        self.db_path = db_path
+        self.foreign_keys = foreign_keys
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "created": 0,
+            "checkouts": 0,
+            "reused": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "discarded": 0,
+            "in_use": 0,
+        }
+
+    def _open(self):
+        conn = create_connection(self.db_path, self.foreign_keys)
+        if conn is None:
+            raise sqlite3.OperationalError(f"Could not open database {self.db_path}")
+        return conn
+
+    def acquire(self):
+        """
+        Check a connection out of the pool.
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed.")
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats["reused"] += 1
+        except queue.Empty:
+            conn = None
+            with self._lock:
+                total = self._stats["created"] - self._stats["discarded"]
+                can_create = total < self.max_size
+                if can_create:
+                    self._stats["created"] += 1
+                else:
+                    self._stats["waits"] += 1
+            if can_create:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self._lock:
+                        self._stats["discarded"] += 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._stats["timeouts"] += 1
+                    raise sqlite3.OperationalError(
+                        f"Timed out after {self.timeout}s waiting for a database connection."
+                    )
+                with self._lock:
+                    self._stats["reused"] += 1
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        """
+        Return a connection to the pool. Any transaction left open is rolled back.
+        """
+        with self._lock:
+            self._stats["in_use"] -= 1
+
+        if not discard:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+
+        if discard or self._closed:
+            with self._lock:
+                self._stats["discarded"] += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager: check out a connection, commit on success,
+        roll back on error and always hand the connection back.
+        """
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+            if conn.in_transaction:
+                conn.commit()
+        except BaseException:
+            try:
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def stats(self):
+        """
+        Return a snapshot of the pool usage counters.
+        """
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["idle"] = self._idle.qsize()
+        snapshot["max_size"] = self.max_size
+        return snapshot
+
+    def close(self):
+        """
+        Close every idle connection; connections still checked out are
+        closed when they are released.
+        """
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._stats["discarded"] += 1
+            conn.close()
+
+
+class ShardRouter:
+    """
+    Maps an owner_user_id to the connection pool of that owner's shard
+    file, <shard_dir>/owner_<id>.db, opening (and migrating) it on first
+    use. At most `max_open` shard pools stay open; the least recently used
+    idle one is closed when another is needed.
+    """
+
+    def __init__(self, shard_dir, max_open=DEFAULT_SHARD_MAX_OPEN,
+                 pool_size=DEFAULT_SHARD_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT):
+        self.shard_dir = shard_dir
+        self.max_open = max_open
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pools = OrderedDict()     # owner -> ConnectionPool, least recent first
+        self._in_use = {}               # owner -> connections checked out
+        self._migrated = set()
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
+        self._stats = {"opened": 0, "evicted": 0}
+        os.makedirs(shard_dir, exist_ok=True)
+
+    def shard_path(self, owner_user_id):
+        return os.path.join(self.shard_dir, f"owner_{int(owner_user_id)}.db")
+
+    def owners(self):
+        """
+        Owner ids that have a shard file, in ascending order.
+        """
+        owners = []
+        for name in os.listdir(self.shard_dir):
+            match = SHARD_FILE_PATTERN.match(name)
+            if match:
+                owners.append(int(match.group(1)))
+        return sorted(owners)
+
+    def _checkout_pool(self, owner_user_id):
+        with self._lock:
+            pool = self._pools.get(owner_user_id)
+            if pool is None:
+                pool = ConnectionPool(self.shard_path(owner_user_id), max_size=self.pool_size,
+                                      timeout=self.timeout, foreign_keys=False)
+                self._pools[owner_user_id] = pool
+                self._stats["opened"] += 1
+            else:
+                self._pools.move_to_end(owner_user_id)
+            self._in_use[owner_user_id] = self._in_use.get(owner_user_id, 0) + 1
+            self._evict()
+        return pool
+
+    def _return_pool(self, owner_user_id):
+        with self._lock:
+            self._in_use[owner_user_id] -= 1
+            if not self._in_use[owner_user_id]:
+                del self._in_use[owner_user_id]
+            self._evict()
+
+    def _evict(self):
+        # Caller holds self._lock. Pools with connections checked out are
+        # skipped, so the limit can be exceeded briefly under load.
+        for owner in list(self._pools):
+            if len(self._pools) <= self.max_open:
+                break
+            if owner not in self._in_use:
+                self._pools.pop(owner).close()
+                self._stats["evicted"] += 1
+
+    def _ensure_schema(self, owner_user_id, conn):
+        if owner_user_id in self._migrated:
+            return
+        with self._migrate_lock:
+            if owner_user_id not in self._migrated:
+                migrate(conn, self.shard_path(owner_user_id))
+                self._migrated.add(owner_user_id)
+
+    @contextmanager
+    def connection(self, owner_user_id):
+        """
+        Like ConnectionPool.connection(), on the owner's shard.
+        """
+        owner_user_id = int(owner_user_id)
+        pool = self._checkout_pool(owner_user_id)
+        try:
+            with pool.connection() as conn:
+                self._ensure_schema(owner_user_id, conn)
+                yield conn
+        finally:
+            self._return_pool(owner_user_id)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["open"] = len(self._pools)
+            snapshot["in_use"] = sum(self._in_use.values())
+        snapshot["max_open"] = self.max_open
+        return snapshot
+
+    def close(self):
+        with self._lock:
+            while self._pools:
+                self._pools.popitem()[1].close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_router = None
+_router_ready = False
+
+
+def get_pool():
+    """
+    Return the process-wide connection pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                settings = _db_settings()
+                _pool = ConnectionPool(
+                    settings["path"],
+                    max_size=settings["pool_size"],
+                    timeout=settings["pool_timeout"],
+                )
+    return _pool
+
+
+def close_pool():
+    """
+    Close the process-wide pool. The next get_connection() opens a new one,
+    so this also applies changed DB_* environment settings.
+    """
+    global _pool, _router, _router_ready
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        if _router is not None:
+            _router.close()
+        _router = None
+        _router_ready = False
+        _reminders_due_until.clear()
+
+
+def get_router():
+    """
+    The process-wide ShardRouter, or None unless STORAGE_MODE=sharded.
+    """
+    global _router, _router_ready
+    if not _router_ready:
+        with _pool_lock:
+            if not _router_ready:
+                settings = _db_settings()
+                if settings["storage_mode"] == SHARDED:
+                    _router = ShardRouter(
+                        settings["shard_dir"],
+                        max_open=settings["shard_max_open"],
+                        pool_size=settings["shard_pool_size"],
+                        timeout=settings["pool_timeout"],
+                    )
+                elif settings["storage_mode"] != SINGLE:
+                    raise ValueError(f"Unknown STORAGE_MODE: {settings['storage_mode']}")
+                _router_ready = True
+    return _router
+
+
+def get_connection(owner_user_id=None):
+    """
+    Borrow a pooled connection:
+
+        with get_connection() as conn:
+            conn.execute(...)
+
+    The transaction is committed when the block exits normally and rolled
+    back if it raises.
+
+    Pass owner_user_id for queries on that owner's suppliers: in sharded
+    mode they go to the owner's shard. Without it (users, OTPs, scheduler
+    state) the connection is to the main / directory database.
+    """
+    if owner_user_id is not None:
+        router = get_router()
+        if router is not None:
+            return router.connection(owner_user_id)
+    return get_pool().connection()
+
+
+def storage_partitions():
+    """
+    Where suppliers live: [None] (the main database) in single mode, the
+    owner ids of every shard in sharded mode. Jobs that walk all suppliers
+    loop over these with get_connection(partition).
+    """
+    router = get_router()
+    return [None] if router is None else router.owners()
+
+
+_reminders_due_until = {}
+
+
+def sweep_reminders_due(partition=None):
+    """
+    Bring reminders_due of one storage partition up to date (see
+    _migration_reminders_due and _migration_rotation_policies). Cheap: a
+    range scan over the suppliers whose warning opens in the time since
+    the last sweep. Returns the owners that
+    gained rows, so callers can drop their cached reminders.
+    """
+    with get_connection(partition) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT value FROM scheduler_state WHERE name = ?", (REMINDERS_DUE_COVERED,)
+        ).fetchone()
+        owners = _fill_reminders_due(conn, row[0] if row else "")
+        covered_until = conn.execute(
+            "SELECT value FROM scheduler_state WHERE name = ?", (REMINDERS_DUE_COVERED,)
+        ).fetchone()[0]
+    _reminders_due_until[partition] = covered_until
+    return owners
+
+
+def ensure_reminders_due(owner_user_id):
+    """
+    Make sure reminders_due holds every supplier of the owner whose warning
+    has opened, sweeping their partition first if this process hasn't seen
+    it cover the current time.
+    Usually just a string compare. Returns the owners that gained rows.
+    """
+    partition = owner_user_id if get_router() is not None else None
+    needed = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    covered_until = _reminders_due_until.get(partition)
+    if covered_until is None:
+        with get_connection(partition) as conn:
+            row = conn.execute(
+                "SELECT value FROM scheduler_state WHERE name = ?", (REMINDERS_DUE_COVERED,)
+            ).fetchone()
+        covered_until = _reminders_due_until[partition] = row[0] if row else ""
+    if covered_until >= needed:
+        return set()
+    return sweep_reminders_due(partition)
+
+
+def has_table(conn, name):
+    """
+    True if a table (or virtual table) called `name` exists.
+    """
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def next_supplier_id(conn):
+    """
+    The supplier_id the next insert should use. Inserts that need the id
+    before the row exists (a password's encryption is bound to it) call
+    this inside their write transaction, once it holds the write lock, and
+    insert consecutive explicit ids starting here.
+    """
+    return conn.execute("""
+        SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'suppliers'), 0),
+                   COALESCE((SELECT MAX(supplier_id) FROM suppliers), 0)) + 1
+    """).fetchone()[0]
+
+
+def pool_stats():
+    """
+    Usage counters of the process-wide pool.
+    """
+    return get_pool().stats()
+
+
+def shard_stats():
+    """
+    Open/evicted counters of the shard router (None in single mode).
+    """
+    router = get_router()
+    return router.stats() if router is not None else None
+
+
+# ---------------------------------------------------------------------------
+# Schema migrations
+# ---------------------------------------------------------------------------
+# Each migration runs exactly once, in its own transaction, and records its
+# version in schema_version. Append new migrations to MIGRATIONS; never edit
+# or reorder ones that have shipped.
+
+def _migration_initial_schema(conn):
+    """
+    Base users / suppliers tables. Uses IF NOT EXISTS so databases created
+    before versioning was introduced are adopted as-is.
+    """
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE NOT NULL,
@@ -30,9 +555,7 @@ def create_tables():
         password TEXT NOT NULL
     );
     """)
-
-    # Create suppliers table
-    cursor.execute("""
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS suppliers (
         supplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
         supplier_name TEXT NOT NULL,
@@ -47,5 +570,554 @@ def create_tables():
     );
     """)
 
-    conn.commit()
-    conn.close()
+
+def _migration_supplier_owner_dedup_index(conn):
+    """
+    Unique (owner_user_id, supplier_name, user_id) index. It backs the
+    duplicate checks and, through its leading column, every
+    WHERE owner_user_id = ? lookup.
+    Older databases may already hold duplicates. No row is deleted: all
+    but the earliest row of each group get " (duplicate #<supplier_id>)"
+    appended to supplier_name, and each rename is reported. Rows with a
+    NULL user_id never clash in a unique index and are left alone.
+    """
+    duplicates = conn.execute("""
+        SELECT s.supplier_id, s.owner_user_id, s.supplier_name, s.user_id
+        FROM suppliers s
+        JOIN (
+            SELECT owner_user_id, supplier_name, user_id, MIN(supplier_id) AS keep_id
+            FROM suppliers
+            WHERE user_id IS NOT NULL
+            GROUP BY owner_user_id, supplier_name, user_id
+            HAVING COUNT(*) > 1
+        ) d ON d.owner_user_id = s.owner_user_id
+           AND d.supplier_name = s.supplier_name
+           AND d.user_id = s.user_id
+        WHERE s.supplier_id <> d.keep_id
+        ORDER BY s.supplier_id
+    """).fetchall()
+    for supplier_id, owner_user_id, supplier_name, user_id in duplicates:
+        new_name = f"{supplier_name} (duplicate #{supplier_id})"
+        while conn.execute(
+            "SELECT 1 FROM suppliers WHERE owner_user_id = ? AND supplier_name = ? AND user_id = ?",
+            (owner_user_id, new_name, user_id)
+        ).fetchone():
+            new_name += f" #{supplier_id}"
+        conn.execute("UPDATE suppliers SET supplier_name = ? WHERE supplier_id = ?", (new_name, supplier_id))
+        print(f"Renamed duplicate supplier {supplier_id} (owner {owner_user_id}, "
+              f"'{supplier_name}' / '{user_id}') to '{new_name}'.")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_suppliers_owner_name_user
+        ON suppliers (owner_user_id, supplier_name, user_id)
+    """)
+
+
+def _migration_supplier_expiry(conn):
+    """
+    Normalize last_reset and add a derived expires_at column, kept in sync
+    by triggers and indexed per owner so "due soon" is a range scan.
+    Older rows were written either by DATETIME('now') (UTC, no fraction) or
+    by str(datetime.now()) (local time with microseconds); the latter are
+    converted to UTC. Values SQLite cannot parse are left untouched.
+    """
+    conn.execute("ALTER TABLE suppliers ADD COLUMN expires_at TEXT")
+    conn.execute("""
+        UPDATE suppliers
+        SET last_reset = CASE
+            WHEN last_reset LIKE '%.%' THEN DATETIME(last_reset, 'utc')
+            ELSE DATETIME(last_reset)
+        END
+        WHERE DATETIME(last_reset) IS NOT NULL
+    """)
+    conn.execute(f"""
+        UPDATE suppliers
+        SET expires_at = DATETIME(last_reset, '+{PASSWORD_EXPIRY_DAYS} days')
+        WHERE last_reset IS NOT NULL
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS suppliers_expiry_after_insert
+        AFTER INSERT ON suppliers
+        WHEN NEW.last_reset IS NOT NULL
+        BEGIN
+            UPDATE suppliers
+            SET expires_at = DATETIME(NEW.last_reset, '+{PASSWORD_EXPIRY_DAYS} days')
+            WHERE supplier_id = NEW.supplier_id;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS suppliers_expiry_after_reset
+        AFTER UPDATE OF last_reset ON suppliers
+        BEGIN
+            UPDATE suppliers
+            SET expires_at = DATETIME(NEW.last_reset, '+{PASSWORD_EXPIRY_DAYS} days')
+            WHERE supplier_id = NEW.supplier_id;
+        END
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS ix_suppliers_owner_expires
+        ON suppliers (owner_user_id, expires_at)
+    """)
+
+
+def _migration_supplier_search_index(conn):
+    """
+    FTS5 index over the searchable supplier fields, stored as an external
+    content table (no second copy of the data) and kept in sync by triggers.
+    owner_user_id is indexed too so a search only walks the owner's postings.
+    Builds of SQLite without FTS5 skip this step; search then falls back to LIKE.
+    """
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS suppliers_fts USING fts5(
+                supplier_name, office_id, user_id, url, owner_user_id,
+                content='suppliers', content_rowid='supplier_id',
+                prefix='2 3'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 not available, supplier search will use LIKE: {e}")
+        return
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS suppliers_fts_after_insert
+        AFTER INSERT ON suppliers
+        BEGIN
+            INSERT INTO suppliers_fts (rowid, supplier_name, office_id, user_id, url, owner_user_id)
+            VALUES (NEW.supplier_id, NEW.supplier_name, NEW.office_id, NEW.user_id, NEW.url, NEW.owner_user_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS suppliers_fts_after_delete
+        AFTER DELETE ON suppliers
+        BEGIN
+            INSERT INTO suppliers_fts (suppliers_fts, rowid, supplier_name, office_id, user_id, url, owner_user_id)
+            VALUES ('delete', OLD.supplier_id, OLD.supplier_name, OLD.office_id, OLD.user_id, OLD.url, OLD.owner_user_id);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS suppliers_fts_after_update
+        AFTER UPDATE OF supplier_name, office_id, user_id, url, owner_user_id ON suppliers
+        BEGIN
+            INSERT INTO suppliers_fts (suppliers_fts, rowid, supplier_name, office_id, user_id, url, owner_user_id)
+            VALUES ('delete', OLD.supplier_id, OLD.supplier_name, OLD.office_id, OLD.user_id, OLD.url, OLD.owner_user_id);
+            INSERT INTO suppliers_fts (rowid, supplier_name, office_id, user_id, url, owner_user_id)
+            VALUES (NEW.supplier_id, NEW.supplier_name, NEW.office_id, NEW.user_id, NEW.url, NEW.owner_user_id);
+        END
+    """)
+    # Index the rows that already exist
+    conn.execute("INSERT INTO suppliers_fts (suppliers_fts) VALUES ('rebuild')")
+
+
+def _migration_supplier_encryption(conn):
+    """
+    Columns for encrypting supplier passwords at rest (see vault_crypto):
+    a wrapped per-user data key and the plaintext length, so list views can
+    draw the mask without decrypting anything.
+    """
+    conn.execute("ALTER TABLE users ADD COLUMN data_key BLOB")
+    conn.execute("ALTER TABLE suppliers ADD COLUMN password_length INTEGER")
+    conn.execute("UPDATE suppliers SET password_length = LENGTH(password)")
+
+
+def _migration_otp_codes(conn):
+    """
+    Pending one-time passwords for OTP_STORE=sqlite (see otp_service).
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS otp_codes (
+        user_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        code_hash TEXT NOT NULL,
+        expires_at REAL NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, action)
+    );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_otp_codes_expires ON otp_codes (expires_at)")
+
+
+def _migration_reminder_scheduler(conn):
+    """
+    State for the reminder digest scheduler (see scheduler.py): a global
+    index on expires_at so "entering the reminder window" is one range
+    scan across all users, a key/value table for its watermark and the
+    owners already notified in the window being processed.
+    """
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_suppliers_expires ON suppliers (expires_at)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scheduler_state (
+        name TEXT PRIMARY KEY,
+        value TEXT
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminder_deliveries (
+        window_end TEXT NOT NULL,
+        owner_user_id INTEGER NOT NULL,
+        suppliers INTEGER NOT NULL,
+        sent_at TEXT NOT NULL DEFAULT (DATETIME('now')),
+        PRIMARY KEY (window_end, owner_user_id)
+    );
+    """)
+
+
+def _migration_password_audit(conn):
+    """
+    Password audit support (see password_audit.py): a keyed fingerprint of
+    every supplier password, indexed per owner so reuse is one GROUP BY
+    over the index, and strength scores cached per fingerprint.
+    Existing rows get their fingerprint on the owner's first audit.
+    """
+    conn.execute("ALTER TABLE suppliers ADD COLUMN password_fp TEXT")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS ix_suppliers_owner_fp
+        ON suppliers (owner_user_id, password_fp)
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS password_strength (
+        fingerprint TEXT PRIMARY KEY,
+        score INTEGER NOT NULL,
+        reasons TEXT NOT NULL DEFAULT ''
+    ) WITHOUT ROWID;
+    """)
+
+
+def _migration_reminders_due(conn):
+    """
+    reminders_due: the suppliers expiring within the next
+    REMINDER_WINDOW_DAYS + 1 days, so reading a user's reminders costs in
+    proportion to what is due rather than to the size of the vault.
+    Triggers keep it in step with inserts, deletes, renames and password
+    resets (which move expires_at); sweep_reminders_due() adds rows as time
+    brings them into range and drops expired ones. scheduler_state records
+    the expires_at bound up to which the table is complete.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminders_due (
+        supplier_id INTEGER PRIMARY KEY,
+        owner_user_id INTEGER NOT NULL,
+        supplier_name TEXT NOT NULL,
+        expires_at TEXT NOT NULL
+    );
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS ix_reminders_due_owner_expires
+        ON reminders_due (owner_user_id, expires_at, supplier_name)
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_reminders_due_expires ON reminders_due (expires_at)")
+
+    lookahead = f"DATETIME('now', '+{REMINDER_WINDOW_DAYS + 1} days')"
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reminders_due_after_insert
+        AFTER INSERT ON suppliers
+        WHEN NEW.expires_at > DATETIME('now') AND NEW.expires_at <= {lookahead}
+        BEGIN
+            INSERT OR REPLACE INTO reminders_due (supplier_id, owner_user_id, supplier_name, expires_at)
+            VALUES (NEW.supplier_id, NEW.owner_user_id, NEW.supplier_name, NEW.expires_at);
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reminders_due_after_update
+        AFTER UPDATE OF expires_at, supplier_name, owner_user_id ON suppliers
+        BEGIN
+            DELETE FROM reminders_due WHERE supplier_id = OLD.supplier_id;
+            INSERT INTO reminders_due (supplier_id, owner_user_id, supplier_name, expires_at)
+            SELECT NEW.supplier_id, NEW.owner_user_id, NEW.supplier_name, NEW.expires_at
+            WHERE NEW.expires_at > DATETIME('now') AND NEW.expires_at <= {lookahead};
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS reminders_due_after_delete
+        AFTER DELETE ON suppliers
+        BEGIN
+            DELETE FROM reminders_due WHERE supplier_id = OLD.supplier_id;
+        END
+    """)
+    horizon = conn.execute(f"SELECT {lookahead}").fetchone()[0]
+    conn.execute("""
+        INSERT OR REPLACE INTO reminders_due (supplier_id, owner_user_id, supplier_name, expires_at)
+        SELECT supplier_id, owner_user_id, supplier_name, expires_at
+        FROM suppliers
+        WHERE expires_at > DATETIME('now') AND expires_at <= ?
+    """, (horizon,))
+    conn.execute(
+        "INSERT OR REPLACE INTO scheduler_state (name, value) VALUES (?, ?)", (REMINDERS_DUE_COVERED, horizon)
+    )
+
+
+def _migration_rotation_policies(conn):
+    """
+    Per-supplier rotation policies. rotation_days / warning_days override
+    the owner's defaults (NULL = inherit, rotation_days 0 = never expires).
+    The owner's defaults live in rotation_defaults, next to the suppliers
+    (so in the owner's shard in sharded mode), and are copied onto every
+    supplier row as default_rotation_days / default_warning_days, because
+    generated columns can only read their own row.
+    expires_at and warn_at become VIRTUAL generated columns computed from
+    last_reset and the policy, replacing the trigger-maintained expires_at,
+    and are indexed per owner and globally.
+    reminders_due and the scheduler now work on warn_at, so each supplier's
+    own warning period decides when it shows up.
+    """
+    for trigger in ("suppliers_expiry_after_insert", "suppliers_expiry_after_reset",
+                    "reminders_due_after_insert", "reminders_due_after_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    for index in ("ix_suppliers_owner_expires", "ix_suppliers_expires", "ix_reminders_due_owner_expires"):
+        conn.execute(f"DROP INDEX IF EXISTS {index}")
+    conn.execute("ALTER TABLE suppliers DROP COLUMN expires_at")
+
+    conn.execute("ALTER TABLE suppliers ADD COLUMN rotation_days INTEGER")
+    conn.execute("ALTER TABLE suppliers ADD COLUMN warning_days INTEGER")
+    conn.execute(f"ALTER TABLE suppliers ADD COLUMN default_rotation_days INTEGER NOT NULL "
+                 f"DEFAULT {PASSWORD_EXPIRY_DAYS}")
+    conn.execute(f"ALTER TABLE suppliers ADD COLUMN default_warning_days INTEGER NOT NULL "
+                 f"DEFAULT {REMINDER_WINDOW_DAYS}")
+    conn.execute("""
+        ALTER TABLE suppliers ADD COLUMN expires_at TEXT GENERATED ALWAYS AS (
+            CASE WHEN COALESCE(rotation_days, default_rotation_days) > 0
+                 THEN DATETIME(last_reset, '+' || COALESCE(rotation_days, default_rotation_days) || ' days')
+            END
+        ) VIRTUAL
+    """)
+    conn.execute("""
+        ALTER TABLE suppliers ADD COLUMN warn_at TEXT GENERATED ALWAYS AS (
+            DATETIME(expires_at, '-' || COALESCE(warning_days, default_warning_days) || ' days')
+        ) VIRTUAL
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_suppliers_owner_expires ON suppliers (owner_user_id, expires_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_suppliers_warn ON suppliers (warn_at)")
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rotation_defaults (
+        owner_user_id INTEGER PRIMARY KEY,
+        rotation_days INTEGER NOT NULL,
+        warning_days INTEGER NOT NULL
+    );
+    """)
+    # Only owners with their own defaults pay for the extra update
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS suppliers_policy_after_insert
+        AFTER INSERT ON suppliers
+        WHEN EXISTS (SELECT 1 FROM rotation_defaults WHERE owner_user_id = NEW.owner_user_id)
+        BEGIN
+            UPDATE suppliers
+            SET (default_rotation_days, default_warning_days) = (
+                SELECT rotation_days, warning_days FROM rotation_defaults
+                WHERE owner_user_id = NEW.owner_user_id
+            )
+            WHERE supplier_id = NEW.supplier_id;
+        END
+    """)
+
+    conn.execute("ALTER TABLE reminders_due ADD COLUMN warn_at TEXT")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS ix_reminders_due_owner_expires
+        ON reminders_due (owner_user_id, expires_at, supplier_name, warn_at)
+    """)
+    in_range = (f"warn_at <= DATETIME('now', '+{REMINDERS_DUE_LOOKAHEAD_DAYS} days') "
+                f"AND expires_at > DATETIME('now')")
+    # Reads the row back instead of using NEW, so it is right whichever of
+    # the insert triggers runs first
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reminders_due_after_insert
+        AFTER INSERT ON suppliers
+        BEGIN
+            INSERT OR REPLACE INTO reminders_due
+              (supplier_id, owner_user_id, supplier_name, expires_at, warn_at)
+            SELECT supplier_id, owner_user_id, supplier_name, expires_at, warn_at
+            FROM suppliers
+            WHERE supplier_id = NEW.supplier_id AND {in_range};
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS reminders_due_after_update
+        AFTER UPDATE OF last_reset, rotation_days, warning_days, default_rotation_days,
+                        default_warning_days, supplier_name, owner_user_id ON suppliers
+        BEGIN
+            DELETE FROM reminders_due WHERE supplier_id = OLD.supplier_id;
+            INSERT INTO reminders_due (supplier_id, owner_user_id, supplier_name, expires_at, warn_at)
+            SELECT NEW.supplier_id, NEW.owner_user_id, NEW.supplier_name, NEW.expires_at, NEW.warn_at
+            WHERE NEW.warn_at <= DATETIME('now', '+{REMINDERS_DUE_LOOKAHEAD_DAYS} days')
+              AND NEW.expires_at > DATETIME('now');
+        END
+    """)
+    conn.execute("DELETE FROM reminders_due")
+    _fill_reminders_due(conn, "")
+
+    # The scheduler's watermark and window tracked expires_at, which ran
+    # REMINDER_WINDOW_DAYS ahead of what is now tracked, warn_at
+    shift = f"-{REMINDER_WINDOW_DAYS} days"
+    conn.execute("""
+        UPDATE scheduler_state SET value = DATETIME(value, ?)
+        WHERE name IN ('reminders.watermark', 'reminders.window_start', 'reminders.window_end')
+    """, (shift,))
+    conn.execute("UPDATE reminder_deliveries SET window_end = DATETIME(window_end, ?)", (shift,))
+
+
+def _migration_reminder_catchup(conn):
+    """
+    Suppliers whose warn_at a policy change moved behind the scheduler's
+    watermark. The scheduler's range scan would never reach them again,
+    so it reads them from here on its next pass (see scheduler.py). Kept
+    next to the suppliers, i.e. in the owner's shard in sharded mode.
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS reminder_catchup (
+        supplier_id INTEGER PRIMARY KEY,
+        owner_user_id INTEGER NOT NULL
+    );
+    """)
+
+
+def _fill_reminders_due(conn, covered_until):
+    """
+    Add the suppliers whose warning opened after covered_until or opens
+    within the lookahead, drop expired rows and record the new bound.
+    Runs inside the caller's transaction. Returns the owners that gained rows.
+    """
+    now, horizon = conn.execute(
+        "SELECT DATETIME('now'), DATETIME('now', ?)", (f"+{REMINDERS_DUE_LOOKAHEAD_DAYS} days",)
+    ).fetchone()
+    params = (covered_until, horizon, now)
+    owners = {row[0] for row in conn.execute(
+        "SELECT DISTINCT owner_user_id FROM suppliers WHERE warn_at > ? AND warn_at <= ? AND expires_at > ?",
+        params
+    )}
+    if owners:
+        # Range scan on ix_suppliers_warn
+        conn.execute("""
+            INSERT OR REPLACE INTO reminders_due
+              (supplier_id, owner_user_id, supplier_name, expires_at, warn_at)
+            SELECT supplier_id, owner_user_id, supplier_name, expires_at, warn_at
+            FROM suppliers
+            WHERE warn_at > ? AND warn_at <= ? AND expires_at > ?
+        """, params)
+    conn.execute("DELETE FROM reminders_due WHERE expires_at <= ?", (now,))
+    conn.execute(
+        "INSERT OR REPLACE INTO scheduler_state (name, value) VALUES (?, ?)", (REMINDERS_DUE_COVERED, horizon)
+    )
+    return owners
+
+
+MIGRATIONS = [
+    (1, "initial schema", _migration_initial_schema),
+    (2, "unique owner/supplier/user index on suppliers", _migration_supplier_owner_dedup_index),
+    (3, "normalized last_reset and indexed expires_at", _migration_supplier_expiry),
+    (4, "full-text search index on suppliers", _migration_supplier_search_index),
+    (5, "supplier password encryption columns", _migration_supplier_encryption),
+    (6, "server-side OTP store", _migration_otp_codes),
+    (7, "reminder scheduler state", _migration_reminder_scheduler),
+    (8, "password fingerprints and strength cache", _migration_password_audit),
+    (9, "materialized due-soon reminders", _migration_reminders_due),
+    (10, "per-supplier rotation policies with generated expiry columns", _migration_rotation_policies),
+    (11, "reminders missed after rotation policy changes", _migration_reminder_catchup),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """
+    Return the highest applied migration version (0 for a fresh database).
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def _backup_before_upgrade(conn, db_path, from_version):
+    """
+    Take an online copy of an existing database before upgrading it, so a
+    failed or unwanted upgrade can be rolled back by restoring the file.
+    """
+    if db_path == ":memory:" or not os.path.exists(db_path):
+        return None
+    has_data = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'"
+    ).fetchone()
+    if not has_data:
+        return None
+
+    backup_path = f"{db_path}.v{from_version}.bak"
+    target = sqlite3.connect(backup_path)
+    try:
+        conn.backup(target)
+    finally:
+        target.close()
+    return backup_path
+
+
+def migrate(conn, db_path=None):
+    """
+    Apply every pending migration in order. Safe to call from several
+    processes at once: each step takes the write lock and re-checks the
+    version before running.
+    Returns the list of versions that were applied.
+    """
+    applied = []
+    current = get_schema_version(conn)
+    if conn.in_transaction:
+        conn.commit()
+    if current >= SCHEMA_VERSION:
+        return applied
+
+    if db_path is not None:
+        backup_path = _backup_before_upgrade(conn, db_path, current)
+        if backup_path:
+            print(f"Backed up database to {backup_path} before upgrading schema.")
+
+    for version, description, step in MIGRATIONS:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def init_db():
+    """
+    Bring the database schema up to date. Runs the migrations once per
+    process; later calls (e.g. on every Streamlit rerun) return immediately.
+    In sharded mode this migrates the directory database; each shard runs
+    the same migrations when it is first opened.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        get_router()
+        pool = get_pool()
+        with pool.connection() as conn:
+            migrate(conn, pool.db_path)
+        _schema_ready = True
+
+
+def create_tables():
+    """
+    Create the necessary tables in the SQLite database if not present.
+    Kept for older callers; the schema is now managed by init_db().
+    """
+    init_db()
@@ -1,11 +1,8 @@
 # email_otp.py
 import os
-import random
-import string
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import threading
 from dotenv import load_dotenv
+from mailer import MailDispatcher, DeliveryHandle
 
 load_dotenv()
 
@@ -13,34 +10,62 @@ EMAIL_HOST = os.getenv("EMAIL_HOST")
 EMAIL_PORT = os.getenv("EMAIL_PORT")
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD")
+# Set to 0 for relays (or the local smtp_stub) that don't offer STARTTLS
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "1") != "0"
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "2"))
 
+# How long the blocking send_otp_via_email() waits for delivery
+SEND_TIMEOUT = 30.0
 
-def generate_otp(length=6):
-    """Generate a numeric OTP code."""
-    digits = string.digits
-    return ''.join(random.choice(digits) for _ in range(length))
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
 
 
-def send_otp_via_email(to_email, otp_code):
+def get_mail_dispatcher():
+    """
+    Return the shared background mail dispatcher, or None if email is not configured.
+    """
+    global _dispatcher
+    if _dispatcher is None:
+        if not EMAIL_HOST or not EMAIL_PORT:
+            return None
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = MailDispatcher(
+                    EMAIL_HOST,
+                    EMAIL_PORT,
+                    user=EMAIL_USER,
+                    password=EMAIL_PASSWORD,
+                    use_tls=EMAIL_USE_TLS,
+                    workers=EMAIL_WORKERS,
+                )
+    return _dispatcher
+
+
+def send_email_async(to_email, subject, body):
     """
-    Sends the OTP code via Email. 
+    Queue an email and return a DeliveryHandle without waiting for SMTP.
     """
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = to_email
-        msg['Subject'] = "Your OTP Code"
+    dispatcher = get_mail_dispatcher()
+    if dispatcher is None:
+        handle = DeliveryHandle(to_email, subject)
+        handle._resolve(False, RuntimeError("EMAIL_HOST / EMAIL_PORT are not configured."))
+        print("Error sending email: EMAIL_HOST / EMAIL_PORT are not configured.")
+        return handle
+    return dispatcher.send(to_email, subject, body)
 
-        body = f"Your OTP code is: {otp_code}\nIt will expire soon."
-        msg.attach(MIMEText(body, 'plain'))
 
-        with smtplib.SMTP(EMAIL_HOST, int(EMAIL_PORT)) as server:
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASSWORD)
-            server.sendmail(EMAIL_USER, to_email, msg.as_string())
+def send_otp_async(to_email, otp_code):
+    """
+    Queue the OTP email; returns a DeliveryHandle immediately.
+    """
+    body = f"Your OTP code is: {otp_code}\nIt will expire soon."
+    return send_email_async(to_email, "Your OTP Code", body)
 
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
 
+def send_otp_via_email(to_email, otp_code):
+    """
+    Sends the OTP code via Email and waits for the result.
+    Prefer send_otp_async() in request handlers.
+    """
+    return bool(send_otp_async(to_email, otp_code).wait(SEND_TIMEOUT))
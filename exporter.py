@@ -0,0 +1,89 @@
+# exporter.py
+"""
+Streaming export of a user's suppliers to CSV or JSON Lines, optionally
+gzipped. CSV files use the importer's column names, so an export can be
+imported again as-is.
+
+Rows come from SupplierRepository.iter_suppliers (one fetchmany cursor)
+and are written straight to the output, so memory use does not grow
+with the size of the vault.
+"""
+import csv
+import gzip
+import io
+import json
+import audit_log
+from services import supplier_repository
+
+CSV = "csv"
+JSONL = "jsonl"
+FORMATS = (CSV, JSONL)
+EXPORT_COLUMNS = ("Supplier Name", "Office ID", "User ID", "Password", "URL", "Last Reset")
+PROGRESS_EVERY = 1000
+
+
+def export_file_name(username, fmt=CSV, compress=False):
+    return f"{username}_suppliers.{fmt}" + (".gz" if compress else "")
+
+
+def format_for_path(path):
+    """
+    Guess (format, compress) from a file name such as vault.jsonl.gz.
+    """
+    compress = path.endswith(".gz")
+    base = path[:-3] if compress else path
+    return (JSONL if base.endswith(".jsonl") or base.endswith(".ndjson") else CSV), compress
+
+
+def write_export(owner_user_id, binary_out, fmt=CSV, compress=False, progress=None):
+    """
+    Write the owner's suppliers (with decrypted passwords) to a binary
+    stream. `progress`, if given, is called as progress(rows_written)
+    every PROGRESS_EVERY rows. Returns the number of rows written.
+    The caller's stream is flushed but left open.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    raw = gzip.GzipFile(fileobj=binary_out, mode="wb") if compress else binary_out
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    count = 0
+    try:
+        if fmt == CSV:
+            writer = csv.writer(text)
+            writer.writerow(EXPORT_COLUMNS)
+            write_row = writer.writerow
+        else:
+            def write_row(row):
+                text.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n")
+
+        for row in supplier_repository.iter_suppliers(owner_user_id):
+            write_row(row)
+            count += 1
+            if progress and count % PROGRESS_EVERY == 0:
+                progress(count)
+        text.flush()
+    finally:
+        # Leave the caller's stream open; finish the gzip trailer if we added one
+        text.detach()
+        if compress:
+            raw.close()
+    binary_out.flush()
+    audit_log.record(owner_user_id, audit_log.EXPORT,
+                     detail=f"{count} suppliers, {fmt}{' gzip' if compress else ''}")
+    return count
+
+
+def export_to_path(owner_user_id, path, fmt=None, compress=None, progress=None):
+    """
+    Export to a file; format and compression default to what the file
+    name suggests. Returns the number of rows written.
+    """
+    guessed_fmt, guessed_compress = format_for_path(path)
+    with open(path, "wb") as f:
+        return write_export(
+            owner_user_id, f,
+            fmt or guessed_fmt,
+            guessed_compress if compress is None else compress,
+            progress,
+        )
@@ -0,0 +1,177 @@
+# importer.py
+import csv
+import io
+import os
+from database import get_connection, next_supplier_id
+from cache import invalidate_user
+from vault_crypto import encrypt_secret, get_data_key
+from password_audit import audit_fields, remember_strength
+from utils import remove_invisible_chars
+
+DEFAULT_BATCH_SIZE = 1000
+MAX_REPORTED_INVALID = 10
+
+
+def _clean(value):
+    if value is None:
+        return ""
+    return remove_invisible_chars(value).strip()
+
+
+def iter_supplier_rows(reader):
+    """
+    Stream normalized rows out of a csv.DictReader.
+    Yields (line_number, row) where row is a
+    (supplier_name, office_id, user_id, password, url) tuple,
+    or None when the line lacks a supplier name or password.
+    """
+    for row in reader:
+        supplier_name = _clean(row.get("Supplier Name"))
+        office_id = _clean(row.get("Office ID"))
+        supplier_user_id = _clean(row.get("User ID"))
+        password = _clean(row.get("Password"))
+        url = _clean(row.get("URL"))
+
+        if not supplier_name or not password:
+            # Minimal check - must have at least name & password
+            yield reader.line_num, None
+            continue
+
+        yield reader.line_num, (supplier_name, office_id, supplier_user_id, password, url)
+
+
+def _existing_keys(cursor, owner_user_id):
+    """
+    Load the (supplier_name, user_id) pairs the owner already has.
+    Served from the unique owner/name/user index without touching the table.
+    """
+    cursor.execute("""
+        SELECT supplier_name, user_id FROM suppliers
+        WHERE owner_user_id = ?
+    """, (owner_user_id,))
+    return {(name, user_id or "") for name, user_id in cursor}
+
+
+def _insert_batch(cursor, owner_user_id, data_key, batch):
+    audits = [audit_fields(owner_user_id, row[3]) for row in batch]
+    remember_strength(cursor, {audit[0]: audit for audit in audits}.values())
+    # Holds the write lock now; each ciphertext is bound to its row's id
+    first_id = next_supplier_id(cursor)
+    rows = []
+    for supplier_id, (name, office_id, user_id, password, url), audit in zip(
+            range(first_id, first_id + len(batch)), batch, audits):
+        rows.append((supplier_id, name, office_id, user_id,
+                     encrypt_secret(owner_user_id, supplier_id, password, data_key),
+                     len(password), audit[0], url, owner_user_id))
+    cursor.executemany("""
+        INSERT OR IGNORE INTO suppliers
+          (supplier_id, supplier_name, office_id, user_id, password, password_length, password_fp, url,
+           last_reset, owner_user_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, DATETIME('now'), ?)
+    """, rows)
+    return cursor.rowcount
+
+
+def _commit_batch(owner_user_id, data_key, batch, summary):
+    """
+    Insert one batch in its own IMMEDIATE transaction, so the write lock
+    is only held for as long as one batch takes.
+    """
+    with get_connection(owner_user_id) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        inserted = _insert_batch(conn.cursor(), owner_user_id, data_key, batch)
+    summary["inserted"] += inserted
+    # Rows a concurrent writer added in the meantime are ignored
+    summary["skipped"] += len(batch) - inserted
+    if inserted:
+        invalidate_user(owner_user_id)
+
+
+def import_suppliers(owner_user_id, binary_file, total_bytes=None,
+                     batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Import suppliers from a CSV opened in binary mode.
+
+    Rows are streamed, deduplicated against the file itself and the
+    owner's existing suppliers, and written with executemany in batches of
+    `batch_size`. Each batch is committed in its own short transaction, so
+    a big import doesn't hold the write lock (and stall every other
+    session) from start to end. A batch is written whole or not at all; if
+    the import fails partway, the batches committed before stay, and
+    importing the file again skips them as duplicates.
+
+    `progress`, if given, is called after every batch as
+    progress(fraction_done, summary); fraction_done is None when the size
+    of the input is unknown.
+
+    Returns a summary dict with rows / inserted / skipped / invalid counts
+    and the first few invalid line numbers.
+    """
+    summary = {
+        "rows": 0,
+        "inserted": 0,
+        "skipped": 0,
+        "invalid": 0,
+        "invalid_lines": [],
+    }
+
+    def report():
+        if progress is None:
+            return
+        fraction = None
+        if total_bytes:
+            try:
+                fraction = min(binary_file.tell() / total_bytes, 1.0)
+            except (OSError, ValueError):
+                fraction = None
+        progress(fraction, summary)
+
+    data_key = get_data_key(owner_user_id, fresh=True)
+    with get_connection(owner_user_id) as conn:
+        seen = _existing_keys(conn.cursor(), owner_user_id)
+    text_file = io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.DictReader(text_file)
+        batch = []
+        for line_num, row in iter_supplier_rows(reader):
+            summary["rows"] += 1
+            if row is None:
+                summary["invalid"] += 1
+                if len(summary["invalid_lines"]) < MAX_REPORTED_INVALID:
+                    summary["invalid_lines"].append(line_num)
+                continue
+
+            key = (row[0], row[2])
+            if key in seen:
+                summary["skipped"] += 1
+                continue
+            seen.add(key)
+            batch.append(row)
+
+            if len(batch) >= batch_size:
+                _commit_batch(owner_user_id, data_key, batch, summary)
+                batch = []
+                report()
+
+        if batch:
+            _commit_batch(owner_user_id, data_key, batch, summary)
+    finally:
+        # Don't let the wrapper close a caller-owned stream (e.g. an upload)
+        text_file.detach()
+
+    report()
+    return summary
+
+
+def import_suppliers_from_path(owner_user_id, csv_path, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Import suppliers from a CSV file on the server.
+    """
+    with open(csv_path, "rb") as binary_file:
+        return import_suppliers(
+            owner_user_id,
+            binary_file,
+            total_bytes=os.path.getsize(csv_path),
+            batch_size=batch_size,
+            progress=progress,
+        )
@@ -0,0 +1,245 @@
+# mailer.py
+import queue
+import smtplib
+import threading
+import time
+import metrics
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 4
+DEFAULT_BACKOFF = 1.0         # seconds before the first retry, doubled each time
+DEFAULT_MAX_BACKOFF = 30.0
+DEFAULT_IDLE_TIMEOUT = 60.0   # close an unused SMTP connection after this long
+DEFAULT_SMTP_TIMEOUT = 30.0
+
+
+class DeliveryHandle:
+    """
+    Returned immediately by MailDispatcher.send(); resolves once the message
+    has been handed to the SMTP server or every attempt has failed.
+    """
+
+    def __init__(self, to_email, subject):
+        self.to_email = to_email
+        self.subject = subject
+        self.ok = None
+        self.error = None
+        self.attempts = 0
+        self._done = threading.Event()
+
+    def _resolve(self, ok, error=None):
+        self.ok = ok
+        self.error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def failed(self):
+        """
+        True only when delivery has finished unsuccessfully.
+        """
+        return self.done() and not self.ok
+
+    def wait(self, timeout=None):
+        """
+        Block until delivery finishes (or timeout). Returns True/False for
+        delivered/failed, or None if still pending.
+        """
+        if not self._done.wait(timeout):
+            return None
+        return self.ok
+
+
+def _is_permanent(error):
+    """
+    5xx replies and refused recipients will fail again on retry.
+    """
+    if isinstance(error, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)):
+        return True
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return False
+
+
+class MailDispatcher:
+    """
+    Sends mail from background worker threads.
+
+    Each worker keeps one authenticated SMTP connection open and reuses it
+    for consecutive messages, reconnecting when the server drops it and
+    closing it after `idle_timeout` seconds without traffic. Transient
+    failures are retried with exponential backoff.
+    """
+
+    def __init__(self, host, port, user=None, password=None, sender=None, use_tls=True,
+                 workers=DEFAULT_WORKERS, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, smtp_timeout=DEFAULT_SMTP_TIMEOUT,
+                 smtp_factory=smtplib.SMTP):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.sender = sender or user
+        self.use_tls = use_tls
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.smtp_timeout = smtp_timeout
+        self.smtp_factory = smtp_factory
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            "queued": 0,
+            "sent": 0,
+            "failed": 0,
+            "retries": 0,
+            "connections": 0,
+        }
+
+    # -- public API -------------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"mail-dispatcher-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """
+        Finish the queued messages, then stop the workers.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            self._stopping = True
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout)
+
+    def send(self, to_email, subject, body):
+        """
+        Queue a plain-text message and return its DeliveryHandle at once.
+        """
+        handle = DeliveryHandle(to_email, subject)
+        if self._stopping:
+            handle._resolve(False, RuntimeError("Mail dispatcher is stopped."))
+            return handle
+        self.start()
+        with self._lock:
+            self._stats["queued"] += 1
+        self._queue.put((handle, body))
+        return handle
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot["pending"] = self._queue.qsize()
+        return snapshot
+
+    # -- worker -----------------------------------------------------------
+
+    def _connect(self):
+        server = self.smtp_factory(self.host, self.port, timeout=self.smtp_timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.user:
+                server.login(self.user, self.password)
+        except Exception:
+            self._close(server)
+            raise
+        with self._lock:
+            self._stats["connections"] += 1
+        return server
+
+    @staticmethod
+    def _close(server):
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    def _build_message(self, handle, body):
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = handle.to_email
+        msg['Subject'] = handle.subject
+        msg.attach(MIMEText(body, 'plain'))
+        return msg.as_string()
+
+    def _deliver(self, server, handle, body):
+        """
+        Try to send one message, retrying transient errors.
+        Returns the (possibly new) open connection, or None.
+        """
+        message = self._build_message(handle, body)
+        delay = self.backoff
+        started = time.perf_counter()
+        while True:
+            reused = server is not None
+            handle.attempts += 1
+            try:
+                if server is None:
+                    server = self._connect()
+                server.sendmail(self.sender, handle.to_email, message)
+                with self._lock:
+                    self._stats["sent"] += 1
+                metrics.observe_mail(time.perf_counter() - started, True)
+                handle._resolve(True)
+                return server
+            except Exception as e:
+                # The connection may be half-closed; start fresh next time
+                self._close(server)
+                server = None
+                if reused and isinstance(e, smtplib.SMTPServerDisconnected):
+                    # The server dropped an idle connection: reconnect at once
+                    handle.attempts -= 1
+                    continue
+                if _is_permanent(e) or handle.attempts >= self.max_attempts:
+                    print(f"Error sending email: {e}")
+                    with self._lock:
+                        self._stats["failed"] += 1
+                    metrics.observe_mail(time.perf_counter() - started, False)
+                    handle._resolve(False, e)
+                    return None
+                with self._lock:
+                    self._stats["retries"] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def _worker(self):
+        server = None
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._close(server)
+                server = None
+                continue
+            if item is None:
+                self._close(server)
+                return
+            handle, body = item
+            server = self._deliver(server, handle, body)
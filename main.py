@@ -1,91 +1,382 @@
 # main.py
-from database import create_tables
-from auth import sign_in, register
-from suppliers import (
-    view_supplier_details,
-    modify_supplier_details,
-    add_new_suppliers,
-    view_password_reset_reminders
-)
-
-def main_menu():
-    st.subheader("Main Menu")
-    st.sidebar.write(f"Logged in as: {st.session_state['current_user']['username']}")
-
-    menu_choice = st.sidebar.radio(
-        "Menu Options", ["Option 1", "Option 2", "Logout"]
-    )
-
-    if menu_choice == "Logout":
-        st.session_state["current_user"] = None
-        st.session_state["page"] = "sign_in"  # Return to login
-        st.experimental_rerun()  # Ensure the app reruns after logout
-
-
-def main():
-    st.markdown(
-        "<h2 style='text-align: center;'>"
-        "Password Manager - Streamlit Version"
-        "</h2>"
-        "<p style='text-align: center;'>"
-        "Developed by Usama Thakur"
-        "</p>",
-        unsafe_allow_html=True
-    )
-
-    # Initialize session state variables
-    if "current_user" not in st.session_state:
-        st.session_state["current_user"] = None
-    if "page" not in st.session_state:
-        st.session_state["page"] = "sign_in"
-
-    # Debugging: Display current state
-    st.write("Debug: Current page:", st.session_state["page"])
-    st.write("Debug: Current user:", st.session_state["current_user"])
-
-    # If no user is logged in, allow toggling between Sign In and Register
-    if not st.session_state["current_user"]:
-        page_choice = st.radio("Choose an Action:", ["Sign In", "Register"])
-
-        if page_choice == "Sign In":
-            st.session_state["page"] = "sign_in"
-        elif page_choice == "Register":
-            st.session_state["page"] = "register"
-
-    # Route based on the current page state
-    if st.session_state["page"] == "sign_in":
-        streamlit_sign_in()
-    elif st.session_state["page"] == "register":
-        streamlit_register()
-    elif st.session_state["page"] == "main_menu":
-        main_menu()
-
-
-
-def welcome_screen():
+"""
+Command line tools for bulk vault jobs (no Streamlit):
+
+    python main.py import <username> suppliers.csv
+    python main.py export <username> [--output suppliers.csv.gz] [--format jsonl]
+    python main.py rotate <username>... | --all
+    python main.py report [<username>]
+    python main.py audit <username> | --backfill
+    python main.py policy <username> [--rotation-days N|default] [--warning-days N|default]
+                          [--match TEXT | --user-default]
+    python main.py backup [--label NAME]
+    python main.py verify [<snapshot>]
+    python main.py restore [<snapshot>] [--at "YYYY-MM-DD HH:MM:SS"] [--target DIR]
+    python main.py prune
+
+backup, verify, restore and prune work like the same commands of
+backup.py (snapshots in BACKUP_DIR, single-file or sharded storage).
+
+Each command imports only the modules it needs, so start-up stays fast.
+"""
+import argparse
+import re
+import sys
+from datetime import datetime
+
+
+def _open_db():
+    from database import init_db
+    init_db()
+
+
+def _lookup_user(username):
+    from services import auth_service
+    user = auth_service.get_user(username)
+    if user is None:
+        print(f"Error: no such user '{username}'.", file=sys.stderr)
+    return user
+
+
+def cmd_import(args):
+    _open_db()
+    from services import supplier_repository
+
+    user = _lookup_user(args.username)
+    if user is None:
+        return 1
+
+    def progress(fraction, summary):
+        if fraction is not None:
+            print(f"\r{fraction:.0%} - {summary['inserted']} inserted", end="", file=sys.stderr)
+
+    try:
+        summary = supplier_repository.import_csv_path(user[0], args.csv_path, progress=progress)
+    except Exception as e:
+        print(f"\nError importing from CSV: {e}. Suppliers imported before the error were kept; "
+              f"importing the file again skips them.", file=sys.stderr)
+        return 1
+    print(f"\n{summary['inserted']} added, {summary['skipped']} duplicates skipped, "
+          f"{summary['invalid']} invalid rows.")
+    if summary["invalid_lines"]:
+        print("Invalid rows on lines: " + ", ".join(str(n) for n in summary["invalid_lines"]))
+    return 0
+
+
+def _confirm_otp(user, action):
     """
-    Display the welcome screen and prompt user to sign in, register or exit.
+    Email the user an OTP for `action` and ask for it on the terminal.
     """
-    while True:
-        print("\nWelcome to the Password Manager developed by Usama Thakur")
-        print("1. Sign In")
-        print("2. Register")
-        print("3. Exit")
-        choice = input("Enter your choice: ").strip()
-
-        if choice == '1':
-            user_data = sign_in()
-            if user_data:
-                main_menu(user_data)
-        elif choice == '2':
-            register()
-        elif choice == '3':
-            print("Exiting the program. Goodbye!")
-            break
-        else:
-            print("Invalid choice. Please try again.")
+    import getpass
+    from services import auth_service
+    from otp_service import VERIFIED
+
+    user_id, username, email, _ = user
+    sent, error = auth_service.send_action_otp(user_id, email, action)
+    if not sent:
+        print(f"Error: {error}", file=sys.stderr)
+        return False
+    code = getpass.getpass(f"OTP sent to {username}'s email. Enter OTP: ")
+    result, error = auth_service.check_action_otp(user_id, action, code)
+    if result != VERIFIED:
+        print(f"Error: {error or 'OTP mismatch or expired.'}", file=sys.stderr)
+        return False
+    return True
+
+
+def cmd_export(args):
+    _open_db()
+    from exporter import export_to_path, format_for_path, write_export
+    from otp_service import EXPORT
+
+    user = _lookup_user(args.username)
+    if user is None or not _confirm_otp(user, EXPORT):
+        return 1
+
+    def progress(count):
+        print(f"\r{count} rows", end="", file=sys.stderr)
+
+    if args.output:
+        fmt, compress = format_for_path(args.output)
+        count = export_to_path(user[0], args.output, args.format or fmt,
+                               compress or args.gzip, progress=progress)
+    else:
+        count = write_export(user[0], sys.stdout.buffer, args.format or "csv", args.gzip, progress=progress)
+    print(f"\rExported {count} suppliers.", file=sys.stderr)
+    return 0
+
+
+def cmd_rotate(args):
+    _open_db()
+    from services import supplier_repository
+
+    if args.all:
+        from database import get_connection
+        with get_connection() as conn:
+            users = conn.execute("SELECT user_id, username FROM users ORDER BY user_id").fetchall()
+    else:
+        users = []
+        for username in args.usernames:
+            user = _lookup_user(username)
+            if user is None:
+                return 1
+            users.append(user[:2])
+
+    for user_id, username in users:
+        count = supplier_repository.rotate_data_key(user_id)
+        print(f"{username}: {count} passwords re-encrypted under a new data key.")
+    return 0
+
+
+def cmd_report(args):
+    _open_db()
+    from services import supplier_repository
+
+    if args.username:
+        user = _lookup_user(args.username)
+        if user is None:
+            return 1
+        rows = [(user[1], user[2], name, expires_at)
+                for name, expires_at in supplier_repository.due_reminders(user[0])]
+    else:
+        rows = supplier_repository.all_due_reminders()
+
+    if not rows:
+        print("No supplier passwords are due for reset.")
+        return 0
+    current = None
+    for username, email, supplier_name, expires_at in rows:
+        if username != current:
+            print(f"{username} <{email}>")
+            current = username
+        print(f"  - {supplier_name}, Expiry Date: {expires_at} UTC")
+    return 0
+
+
+def cmd_audit(args):
+    _open_db()
+    from password_audit import backfill_all, format_report
+    from services import supplier_repository
+
+    if args.backfill:
+        total, owners = backfill_all(
+            progress=lambda done, count: print(f"\r{done}/{count} users", end="", file=sys.stderr)
+        )
+        print(f"\n{total} supplier passwords fingerprinted for {owners} users.")
+        if not args.username:
+            return 0
+
+    user = _lookup_user(args.username)
+    if user is None:
+        return 1
+    print(format_report(user[1], supplier_repository.password_audit(user[0])))
+    return 0
+
+
+# Distinguishes "option not given" from "default" (None) for cmd_policy
+_UNCHANGED = object()
+
+
+def _policy_days(value):
+    if value == "default":
+        return None
+    try:
+        days = int(value)
+    except ValueError:
+        days = -1
+    if days < 0:
+        raise argparse.ArgumentTypeError("expected a number of days (0 or more) or 'default'")
+    return days
+
+
+def cmd_policy(args):
+    _open_db()
+    from services import supplier_repository
+
+    user = _lookup_user(args.username)
+    if user is None:
+        return 1
+    changes = {field: value for field, value in (("rotation_days", args.rotation_days),
+                                                 ("warning_days", args.warning_days))
+               if value is not _UNCHANGED}
+
+    if args.user_default:
+        rotation_days, warning_days = supplier_repository.default_rotation_policy(user[0])
+        rotation_days = changes.get("rotation_days", rotation_days)
+        warning_days = changes.get("warning_days", warning_days)
+        if rotation_days is None or warning_days is None:
+            print("Error: a user default can't itself be 'default'.", file=sys.stderr)
+            return 1
+        count = supplier_repository.set_default_rotation_policy(user[0], rotation_days, warning_days)
+        print(f"{user[1]}: default policy is now {rotation_days or 'never'} / {warning_days} days; "
+              f"{count} suppliers inherit it.")
+        return 0
+
+    supplier_ids = None
+    if args.match is not None:
+        supplier_ids = supplier_repository.match_ids(user[0], args.match, limit=sys.maxsize)
+        if not supplier_ids:
+            print("No suppliers match.")
+            return 0
+    count = supplier_repository.set_rotation_policy(user[0], changes, supplier_ids)
+    print(f"{user[1]}: rotation policy updated on {count} suppliers.")
+    return 0
+
+
+def _backup_errors():
+    import sqlite3
+    return (RuntimeError, OSError, sqlite3.Error)
+
+
+def cmd_backup(args):
+    _open_db()
+    from backup import rotate, snapshot
+
+    try:
+        path = snapshot(label=args.label)
+        removed = rotate()
+    except _backup_errors() as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Snapshot written to {path}." + (f" Rotated out {len(removed)}." if removed else ""))
+    return 0
+
+
+def cmd_verify(args):
+    from backup import find_snapshot, list_snapshots, verify
+
+    try:
+        manifests = [find_snapshot(args.snapshot)] if args.snapshot else list_snapshots()
+        failed = 0
+        for manifest in manifests:
+            problems = verify(manifest["path"])
+            print(f"{manifest['name']}: " + ("ok" if not problems else "; ".join(problems)))
+            failed += bool(problems)
+    except _backup_errors() as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if not manifests:
+        print("No snapshots.")
+    return 1 if failed else 0
+
+
+def cmd_restore(args):
+    from backup import find_snapshot, restore
+
+    try:
+        manifest = find_snapshot(args.snapshot, args.at)
+        restored_to = restore(manifest, args.at, args.target)
+    except _backup_errors() as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Restored {manifest['name']} to {args.target or 'the live databases'}, as of {restored_to} UTC.")
+    if args.target is None:
+        print("Restart the app so it doesn't serve cached data from before the restore.")
+    return 0
+
+
+def cmd_prune(args):
+    from backup import rotate
+
+    try:
+        removed = rotate()
+    except _backup_errors() as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(f"Removed {len(removed)} snapshots.")
+    return 0
+
+
+def _snapshot_label(value):
+    if not re.fullmatch(r"[\w.-]+", value):
+        raise argparse.ArgumentTypeError("may only contain letters, digits, '_', '.' and '-'")
+    return value
+
+
+def _point_in_time(value):
+    from backup import TIME_FORMAT
+    try:
+        datetime.strptime(value, TIME_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a UTC time like '2024-01-31 23:59:00'")
+    return value
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Password Manager command line tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("import", help="import suppliers from a CSV file")
+    p.add_argument("username")
+    p.add_argument("csv_path")
+    p.set_defaults(func=cmd_import)
+
+    p = commands.add_parser("export", help="export a user's suppliers (decrypted); asks for an OTP")
+    p.add_argument("username")
+    p.add_argument("--output", help="file to write; .jsonl / .gz pick the format (default: stdout)")
+    p.add_argument("--format", choices=["csv", "jsonl"])
+    p.add_argument("--gzip", action="store_true", help="gzip the output")
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser("rotate", help="re-encrypt vaults under fresh data keys")
+    p.add_argument("usernames", nargs="*")
+    p.add_argument("--all", action="store_true", help="rotate every user's data key")
+    p.set_defaults(func=cmd_rotate)
+
+    p = commands.add_parser("report", help="list supplier passwords due for reset")
+    p.add_argument("username", nargs="?")
+    p.set_defaults(func=cmd_report)
+
+    p = commands.add_parser("audit", help="list reused and weak supplier passwords")
+    p.add_argument("username", nargs="?")
+    p.add_argument("--backfill", action="store_true",
+                   help="first fingerprint every password stored before audits existed")
+    p.set_defaults(func=cmd_audit)
+
+    p = commands.add_parser("policy", help="set password rotation policies in bulk")
+    p.add_argument("username")
+    p.add_argument("--rotation-days", type=_policy_days, default=_UNCHANGED,
+                   help="days until a password expires; 0 = never, 'default' = the user's default")
+    p.add_argument("--warning-days", type=_policy_days, default=_UNCHANGED,
+                   help="days before expiry to remind; 'default' = the user's default")
+    target = p.add_mutually_exclusive_group()
+    target.add_argument("--match", help="only suppliers matching this search (default: all)")
+    target.add_argument("--user-default", action="store_true",
+                        help="change the user's default instead of per-supplier policies")
+    p.set_defaults(func=cmd_policy)
+
+    p = commands.add_parser("backup", help="snapshot the databases into BACKUP_DIR, then rotate")
+    p.add_argument("--label", type=_snapshot_label,
+                   help="name suffix; labelled snapshots are never rotated out")
+    p.set_defaults(func=cmd_backup)
+
+    p = commands.add_parser("verify", help="check a snapshot and its WAL archive (default: all)")
+    p.add_argument("snapshot", nargs="?")
+    p.set_defaults(func=cmd_verify)
+
+    p = commands.add_parser("restore", help="restore a snapshot over the live databases")
+    p.add_argument("snapshot", nargs="?", help="snapshot name (default: newest, or newest before --at)")
+    p.add_argument("--at", type=_point_in_time,
+                   help="UTC time 'YYYY-MM-DD HH:MM:SS' to roll the WAL archive forward to")
+    p.add_argument("--target", help="restore into this directory instead of over the live files")
+    p.set_defaults(func=cmd_restore)
+
+    p = commands.add_parser("prune", help="delete snapshots beyond BACKUP_KEEP")
+    p.set_defaults(func=cmd_prune)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "rotate" and not args.all and not args.usernames:
+        parser.error("rotate needs usernames or --all")
+    if args.command == "audit" and not args.backfill and not args.username:
+        parser.error("audit needs a username or --backfill")
+    if args.command == "policy" and args.rotation_days is _UNCHANGED and args.warning_days is _UNCHANGED:
+        parser.error("policy needs --rotation-days and/or --warning-days")
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    create_tables()
-    welcome_screen()
+    sys.exit(main())
@@ -0,0 +1,440 @@
+# metrics.py
+"""
+Optional instrumentation: SQLite statement timing with a slow-query log
+and write-lock wait counts, mail send timing and per-menu-action script
+run latency, exported in Prometheus text format.
+
+Everything is off unless METRICS_ENABLED=1. When off, connections are
+plain sqlite3 connections and the timing hooks are one environment lookup.
+
+Settings:
+    METRICS_ENABLED=1         turn instrumentation on
+    METRICS_PORT=9464         serve /metrics on 127.0.0.1:<port>
+    METRICS_FILE=path.prom    or write the metrics to a file ...
+    METRICS_FILE_INTERVAL=15  ... every N seconds
+    SLOW_QUERY_MS=100         log statements slower than this
+    LOCK_WAIT_MS=2            count BEGIN IMMEDIATE slower than this as a lock wait
+"""
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+DEFAULT_SLOW_QUERY_MS = 100
+SLOW_LOG_SIZE = 100
+# An uncontended BEGIN IMMEDIATE takes microseconds; one this slow sat in
+# the busy handler waiting for another connection's write lock
+DEFAULT_LOCK_WAIT_MS = 2
+DEFAULT_FILE_INTERVAL = 15.0
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def enabled():
+    """
+    Whether METRICS_ENABLED=1. Read on every call, like the database
+    settings, so a .env loaded after this module is imported still counts.
+    """
+    return os.getenv("METRICS_ENABLED", "0") == "1"
+
+
+def _thresholds():
+    """
+    (slow query seconds, lock wait seconds) from SLOW_QUERY_MS / LOCK_WAIT_MS.
+    """
+    return (float(os.getenv("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)) / 1000.0,
+            float(os.getenv("LOCK_WAIT_MS", DEFAULT_LOCK_WAIT_MS)) / 1000.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(labelnames, values):
+    if not labelnames:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)) + "}"
+
+
+class Counter:
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}      # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _label_text(self.labelnames + ("le",), labels + (bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _label_text(self.labelnames + ("le",), labels + ("+Inf",))
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+sql_duration = Histogram(
+    "pm_sqlite_statement_seconds", "Time spent in execute/executemany per normalized statement.", ("statement",)
+)
+sql_fetch = Counter(
+    "pm_sqlite_fetch_seconds_total", "Time spent fetching rows per normalized statement.", ("statement",)
+)
+sql_errors = Counter("pm_sqlite_errors_total", "Statements that raised, per normalized statement.", ("statement",))
+sql_slow = Counter("pm_sqlite_slow_statements_total", "Statements slower than SLOW_QUERY_MS.", ("statement",))
+sql_lock_waits = Counter(
+    "pm_sqlite_lock_waits_total", "Write transactions that waited LOCK_WAIT_MS or more for the write lock."
+)
+sql_lock_wait_seconds = Counter(
+    "pm_sqlite_lock_wait_seconds_total", "Time write transactions spent waiting for the write lock."
+)
+sql_lock_timeouts = Counter(
+    "pm_sqlite_lock_timeouts_total", "Statements that gave up with 'database is locked'.", ("statement",)
+)
+mail_duration = Histogram("pm_mail_send_seconds", "SMTP delivery time per message, including retries.", ("result",))
+rerun_duration = Histogram("pm_script_run_seconds", "Streamlit script run time per menu action.", ("action",))
+
+METRICS = [sql_duration, sql_fetch, sql_errors, sql_slow, sql_lock_waits, sql_lock_wait_seconds, sql_lock_timeouts,
+           mail_duration, rerun_duration]
+
+slow_queries = deque(maxlen=SLOW_LOG_SIZE)    # (unix time, seconds, normalized sql)
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_COMMENT = re.compile(r"--[^\n]*")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """
+    Collapse a statement to its shape: literals become ?, IN (?, ?, ...)
+    lists become (?+), comments and whitespace runs are dropped.
+    """
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?+)", sql)
+    return _SPACE.sub(" ", sql).strip()
+
+
+def _record_statement(sql, elapsed, error=None):
+    statement = normalize_sql(sql)
+    slow_query_seconds, lock_wait_seconds = _thresholds()
+    sql_duration.observe(elapsed, statement)
+    if error is not None:
+        sql_errors.inc(1.0, statement)
+        if isinstance(error, sqlite3.OperationalError) and "locked" in str(error):
+            sql_lock_timeouts.inc(1.0, statement)
+    elif elapsed >= lock_wait_seconds and statement.upper().startswith(("BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")):
+        sql_lock_waits.inc()
+        sql_lock_wait_seconds.inc(elapsed)
+    if elapsed >= slow_query_seconds:
+        sql_slow.inc(1.0, statement)
+        slow_queries.append((time.time(), elapsed, statement))
+        print(f"Slow query ({elapsed * 1000:.1f} ms): {statement}", file=sys.stderr)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that times execute/executemany and the fetches that follow.
+    """
+
+    _statement = None
+
+    def execute(self, sql, parameters=()):
+        self._statement = sql
+        start = time.perf_counter()
+        try:
+            result = super().execute(sql, parameters)
+        except Exception as e:
+            _record_statement(sql, time.perf_counter() - start, error=e)
+            raise
+        _record_statement(sql, time.perf_counter() - start)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        self._statement = sql
+        start = time.perf_counter()
+        try:
+            result = super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            _record_statement(sql, time.perf_counter() - start, error=e)
+            raise
+        _record_statement(sql, time.perf_counter() - start)
+        return result
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._statement is not None:
+                sql_fetch.inc(time.perf_counter() - start, normalize_sql(self._statement))
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size if size is not None else self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors (including those behind conn.execute) are
+    TimedCursors. Passed as `factory` to sqlite3.connect when enabled.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """
+    The sqlite3.connect factory to use: TimedConnection when enabled.
+    """
+    return TimedConnection if enabled() else sqlite3.Connection
+
+
+def lock_wait_counts():
+    """
+    Totals of the write-lock counters: (waits, seconds waited, timeouts).
+    """
+    return sql_lock_waits.total(), sql_lock_wait_seconds.total(), sql_lock_timeouts.total()
+
+
+def observe_mail(elapsed, ok):
+    if enabled():
+        mail_duration.observe(elapsed, "sent" if ok else "failed")
+
+
+class _ScriptRun:
+
+    def __init__(self):
+        self.action = "unknown"
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        rerun_duration.observe(time.perf_counter() - self._start, self.action)
+        return False
+
+
+class _NullScriptRun:
+
+    action = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SCRIPT_RUN = _NullScriptRun()
+
+
+def time_script_run():
+    """
+    Time one Streamlit script run. The menu action is only known part way
+    through, so the caller sets it:
+
+        with metrics.time_script_run() as run:
+            ...
+            run.action = menu_choice
+    """
+    if not enabled():
+        return _NULL_SCRIPT_RUN
+    return _ScriptRun()
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def _gauges():
+    """
+    Point-in-time gauges from the pool, the read cache, the mail dispatcher,
+    the write coordinator, the audit log buffer and the session store.
+    """
+    lines = []
+
+    def gauge(name, help_text, values):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, value in sorted(values.items()):
+            if isinstance(value, (int, float)):
+                lines.append(f'{name}{{stat="{_escape(key)}"}} {value}')
+
+    import database
+    if database._pool is not None:
+        gauge("pm_db_pool", "Connection pool counters.", database.pool_stats())
+    if database._router is not None:
+        gauge("pm_db_shards", "Shard router counters.", database.shard_stats())
+    cache = sys.modules.get("cache")
+    if cache is not None:
+        gauge("pm_read_cache", "Read cache counters.", cache.cache_stats())
+    email_otp = sys.modules.get("email_otp")
+    if email_otp is not None and email_otp._dispatcher is not None:
+        gauge("pm_mail_dispatcher", "Mail dispatcher counters.", email_otp._dispatcher.stats())
+    writer = sys.modules.get("writer")
+    if writer is not None and writer._coordinator is not None:
+        stats = writer._coordinator.stats()
+        stats.update({f"batch_size{label}": count for label, count in stats.pop("batch_sizes").items()})
+        gauge("pm_write_coordinator", "Group-commit writer counters.", stats)
+    audit_log = sys.modules.get("audit_log")
+    if audit_log is not None and audit_log._audit_log is not None:
+        gauge("pm_audit_log", "Audit log buffer counters.", audit_log._audit_log.stats())
+    sessions = sys.modules.get("sessions")
+    if sessions is not None and sessions._store is not None:
+        gauge("pm_sessions", "Server-side session store counters.", sessions._store.stats())
+    return lines
+
+
+def render():
+    """
+    All metrics in Prometheus text exposition format.
+    """
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(_gauges())
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    """
+    Write the metrics atomically (node_exporter textfile collector style).
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+
+def _serve(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def _write_periodically(path, interval):
+    while True:
+        try:
+            write_file(path)
+        except OSError as e:
+            print(f"Error writing metrics file: {e}", file=sys.stderr)
+        time.sleep(interval)
+
+
+def start_exporter():
+    """
+    Start the /metrics endpoint or the file writer, once per process.
+    Does nothing when metrics are disabled or no target is configured.
+    """
+    global _exporter_started
+    if not enabled() or _exporter_started:
+        return
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+        port = os.getenv("METRICS_PORT")
+        path = os.getenv("METRICS_FILE")
+        try:
+            if port:
+                _serve(int(port))
+            if path:
+                interval = float(os.getenv("METRICS_FILE_INTERVAL", DEFAULT_FILE_INTERVAL))
+                threading.Thread(
+                    target=_write_periodically, args=(path, interval), name="metrics-file", daemon=True
+                ).start()
+        except OSError as e:
+            print(f"Error starting metrics exporter: {e}", file=sys.stderr)
@@ -0,0 +1,286 @@
+# otp_service.py
+"""
+Server-side one-time passwords.
+
+Codes are generated with `secrets`, stored only as keyed hashes with an
+expiry, verified in constant time and consumed on first successful use.
+Sending and verifying are rate limited per (user, action) with token
+buckets.
+
+OTP_STORE=memory (default) keeps codes in this process. Use OTP_STORE=sqlite
+when several app processes serve the same users: codes then live in the
+otp_codes table. Rate limits are always tracked per process.
+"""
+import hashlib
+import heapq
+import hmac
+import os
+import secrets
+import string
+import threading
+import time
+from collections import OrderedDict
+from writer import write
+from vault_crypto import get_master_key
+
+# Actions that can be confirmed with an OTP
+UNMASK = "unmask"
+MODIFY = "modify"
+DELETE_ONE = "delete_one"
+DELETE_ALL = "delete_all"
+RESET_PASSWORD = "reset_password"
+EXPORT = "export"
+BULK_MODIFY = "bulk_modify"
+
+# verify() results
+VERIFIED = "verified"
+MISMATCH = "mismatch"
+NO_CODE = "no_code"          # never sent, already used, expired or too many attempts
+
+DEFAULT_TTL = 300.0
+DEFAULT_LENGTH = 6
+DEFAULT_MAX_ATTEMPTS = 5
+# Token buckets: (capacity, seconds to refill one token). Override with
+# OTP_SEND_LIMIT / OTP_VERIFY_LIMIT given as "capacity/seconds", e.g. "3/120".
+DEFAULT_SEND_LIMIT = (3, 120.0)
+DEFAULT_VERIFY_LIMIT = (5, 60.0)
+# Amortized cleanup: expired entries removed per store operation
+PURGE_BATCH = 16
+SQLITE_PURGE_EVERY = 100
+
+
+class RateLimited(Exception):
+    """
+    Too many sends or verification attempts; retry after `retry_after` seconds.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many attempts. Try again in {int(retry_after) + 1} seconds.")
+        self.retry_after = retry_after
+
+
+def generate_code(length=DEFAULT_LENGTH):
+    """Generate a numeric OTP code with a CSPRNG."""
+    return "".join(secrets.choice(string.digits) for _ in range(length))
+
+
+def _hash_code(code):
+    key = hmac.new(get_master_key(), b"otp-codes", hashlib.sha256).digest()
+    return hmac.new(key, code.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+class TokenBuckets:
+    """
+    Token bucket per key. Buckets that have refilled completely carry no
+    state, so idle ones are dropped as new requests come in.
+    """
+
+    def __init__(self, capacity, refill_seconds):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self._buckets = OrderedDict()    # key -> (tokens, updated_at), oldest first
+        self._lock = threading.Lock()
+
+    def _drop_idle(self, now):
+        full_after = self.capacity * self.refill_seconds
+        for _ in range(PURGE_BATCH):
+            if not self._buckets:
+                return
+            key, (_, updated_at) = next(iter(self._buckets.items()))
+            if now - updated_at < full_after:
+                return
+            del self._buckets[key]
+
+    def take(self, key):
+        """
+        Spend one token or raise RateLimited.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._drop_idle(now)
+            tokens, updated_at = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) / self.refill_seconds)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                raise RateLimited((1 - tokens) * self.refill_seconds)
+            self._buckets[key] = (tokens - 1, now)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class MemoryOTPStore:
+    """
+    Pending codes in a dict, with a heap of expiry times so every operation
+    can cheaply drop a few expired entries.
+    """
+
+    def __init__(self):
+        self._codes = {}      # (user_id, action) -> [code_hash, expires_at, attempts]
+        self._expiry = []     # heap of (expires_at, key)
+        self._lock = threading.Lock()
+
+    def _purge(self, now):
+        for _ in range(PURGE_BATCH):
+            if not self._expiry or self._expiry[0][0] > now:
+                return
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self._codes.get(key)
+            # Skip heap entries for codes that were replaced since
+            if entry is not None and entry[1] == expires_at:
+                del self._codes[key]
+
+    def put(self, key, code_hash, expires_at):
+        with self._lock:
+            self._purge(time.time())
+            self._codes[key] = [code_hash, expires_at, 0]
+            heapq.heappush(self._expiry, (expires_at, key))
+
+    def check(self, key, code_hash, max_attempts):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            entry = self._codes.get(key)
+            if entry is None or entry[1] <= now:
+                self._codes.pop(key, None)
+                return NO_CODE
+            if hmac.compare_digest(entry[0], code_hash):
+                del self._codes[key]
+                return VERIFIED
+            entry[2] += 1
+            if entry[2] >= max_attempts:
+                del self._codes[key]
+            return MISMATCH
+
+    def __len__(self):
+        return len(self._codes)
+
+
+class SQLiteOTPStore:
+    """
+    Pending codes in the otp_codes table, shared by every process using the
+    database. Expired rows are deleted every SQLITE_PURGE_EVERY operations.
+    """
+
+    def __init__(self):
+        self._ops = 0
+        self._lock = threading.Lock()
+
+    def _maybe_purge(self, conn, now):
+        with self._lock:
+            self._ops += 1
+            due = self._ops % SQLITE_PURGE_EVERY == 0
+        if due:
+            conn.execute("DELETE FROM otp_codes WHERE expires_at <= ?", (now,))
+
+    def put(self, key, code_hash, expires_at):
+        user_id, action = key
+
+        def store(conn):
+            self._maybe_purge(conn, time.time())
+            conn.execute("""
+                INSERT OR REPLACE INTO otp_codes (user_id, action, code_hash, expires_at, attempts)
+                VALUES (?, ?, ?, ?, 0)
+            """, (user_id, action, code_hash, expires_at))
+
+        write(store)
+
+    def check(self, key, code_hash, max_attempts):
+        user_id, action = key
+        now = time.time()
+
+        def verify(conn):
+            self._maybe_purge(conn, now)
+            row = conn.execute(
+                "SELECT code_hash, expires_at FROM otp_codes WHERE user_id = ? AND action = ?",
+                (user_id, action)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return NO_CODE
+            if hmac.compare_digest(row[0], code_hash):
+                # Conditional delete: only one concurrent verifier can consume the code
+                consumed = conn.execute(
+                    "DELETE FROM otp_codes WHERE user_id = ? AND action = ? AND code_hash = ?",
+                    (user_id, action, code_hash)
+                ).rowcount
+                return VERIFIED if consumed else NO_CODE
+            conn.execute(
+                "UPDATE otp_codes SET attempts = attempts + 1 WHERE user_id = ? AND action = ?",
+                (user_id, action)
+            )
+            conn.execute(
+                "DELETE FROM otp_codes WHERE user_id = ? AND action = ? AND attempts >= ?",
+                (user_id, action, max_attempts)
+            )
+            return MISMATCH
+
+        return write(verify)
+
+
+def _limit(name, default):
+    value = os.getenv(name)
+    if not value:
+        return default
+    capacity, refill = value.split("/")
+    return int(capacity), float(refill)
+
+
+class OTPService:
+
+    def __init__(self, store=None, ttl=DEFAULT_TTL, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 send_limit=DEFAULT_SEND_LIMIT, verify_limit=DEFAULT_VERIFY_LIMIT):
+        self.store = store or MemoryOTPStore()
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.send_buckets = TokenBuckets(*send_limit)
+        self.verify_buckets = TokenBuckets(*verify_limit)
+
+    def issue(self, user_id, action):
+        """
+        Create (or replace) the pending code for this user and action and
+        return it for sending. Raises RateLimited.
+        """
+        self.send_buckets.take((user_id, action))
+        code = generate_code()
+        self.store.put((user_id, action), _hash_code(code), time.time() + self.ttl)
+        return code
+
+    def verify(self, user_id, action, code):
+        """
+        Check a code. Returns VERIFIED (the code is consumed), MISMATCH or
+        NO_CODE. Raises RateLimited.
+        """
+        self.verify_buckets.take((user_id, action))
+        return self.store.check((user_id, action), _hash_code((code or "").strip()), self.max_attempts)
+
+
+def _build_service():
+    store = SQLiteOTPStore() if os.getenv("OTP_STORE", "memory") == "sqlite" else MemoryOTPStore()
+    return OTPService(
+        store=store,
+        ttl=float(os.getenv("OTP_TTL", DEFAULT_TTL)),
+        max_attempts=int(os.getenv("OTP_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+        send_limit=_limit("OTP_SEND_LIMIT", DEFAULT_SEND_LIMIT),
+        verify_limit=_limit("OTP_VERIFY_LIMIT", DEFAULT_VERIFY_LIMIT),
+    )
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_otp_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = _build_service()
+    return _service
+
+
+def issue_otp(user_id, action):
+    return get_otp_service().issue(user_id, action)
+
+
+def verify_otp(user_id, action, code):
+    return get_otp_service().verify(user_id, action, code)
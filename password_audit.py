@@ -0,0 +1,248 @@
+# password_audit.py
+"""
+Find supplier passwords that are reused or weak, to decide what to rotate
+first.
+
+Every supplier row carries password_fp, an HMAC-SHA256 of its password
+under a per-user key derived from the vault master key. Equal passwords
+of one user get equal fingerprints, so reuse is a GROUP BY over the
+(owner_user_id, password_fp) index. Nothing is decrypted and the
+fingerprints can't be compared across users.
+Strength is scored once per fingerprint, when the password is written,
+and kept in the password_strength table.
+
+Rows written before fingerprints existed are filled in on the owner's
+first audit (or all at once with `python main.py audit --backfill`).
+"""
+import hashlib
+import hmac
+import re
+import threading
+from database import get_connection, storage_partitions
+from cache import cached_query, invalidate_user
+
+# Scores run from 0 (trivial) to 4 (strong); this and below is reported as weak
+WEAK_SCORE = 1
+BACKFILL_BATCH_SIZE = 500
+# Reuse groups and weak rows listed in the Streamlit view
+MAX_LISTED = 50
+
+COMMON_PASSWORDS = {
+    "123456", "123456789", "12345678", "1234567", "12345", "1234567890", "111111", "000000",
+    "password", "password1", "password123", "passw0rd", "qwerty", "qwerty123", "qwertyuiop",
+    "abc123", "iloveyou", "admin", "admin123", "welcome", "welcome1", "letmein", "monkey",
+    "dragon", "football", "baseball", "sunshine", "princess", "master", "login", "changeme",
+    "secret", "default", "guest", "test", "test123", "summer2024", "winter2024", "p@ssw0rd",
+}
+SEQUENCES = ("abcdefghijklmnopqrstuvwxyz", "0123456789", "qwertyuiop", "asdfghjkl", "zxcvbnm")
+
+_fp_keys = {}
+_fp_keys_lock = threading.Lock()
+
+
+def _fingerprint_key(owner_user_id):
+    key = _fp_keys.get(owner_user_id)
+    if key is None:
+        from vault_crypto import get_master_key
+        key = hmac.new(get_master_key(), f"password-fp:{int(owner_user_id)}".encode("ascii"),
+                       hashlib.sha256).digest()
+        with _fp_keys_lock:
+            _fp_keys[owner_user_id] = key
+    return key
+
+
+def fingerprint(owner_user_id, password):
+    """
+    Keyed fingerprint of a plaintext supplier password.
+    """
+    return hmac.new(_fingerprint_key(owner_user_id), password.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def score_password(password):
+    """
+    Return (score 0-4, reasons) for a plaintext password: length and
+    character variety raise it; common passwords, runs of one character
+    and keyboard/alphabet sequences lower it.
+    """
+    reasons = []
+    length = len(password)
+    if length >= 16:
+        score = 3
+    elif length >= 12:
+        score = 2
+    elif length >= 8:
+        score = 1
+    else:
+        score = 0
+        reasons.append("shorter than 8 characters")
+
+    classes = sum(bool(re.search(pattern, password))
+                  for pattern in (r"[a-z]", r"[A-Z]", r"\d", r"[^A-Za-z0-9]"))
+    if classes >= 3:
+        score += 1
+    elif classes == 1:
+        reasons.append("only one kind of character")
+
+    lowered = password.lower()
+    if lowered in COMMON_PASSWORDS:
+        score = 0
+        reasons.append("a commonly used password")
+    if re.search(r"(.)\1{3,}", password):
+        score -= 1
+        reasons.append("repeats a character")
+    if any(lowered[i:i + 4] in sequence for sequence in SEQUENCES for i in range(max(length - 3, 0))):
+        score -= 1
+        reasons.append("contains a sequence like 'abcd' or '1234'")
+    return max(0, min(score, 4)), "; ".join(reasons)
+
+
+def audit_fields(owner_user_id, password):
+    """
+    (fingerprint, score, reasons) to store alongside a new password.
+    """
+    return (fingerprint(owner_user_id, password),) + score_password(password)
+
+
+def remember_strength(conn, rows):
+    """
+    Cache scores for (fingerprint, score, reasons) rows; known ones are kept.
+    """
+    conn.executemany(
+        "INSERT OR IGNORE INTO password_strength (fingerprint, score, reasons) VALUES (?, ?, ?)", rows
+    )
+
+
+def backfill(owner_user_id, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Fingerprint and score the owner's passwords that have no fingerprint
+    yet. Returns the number of rows filled in.
+    """
+    from vault_crypto import decrypt_secret, get_data_key
+
+    total = 0
+    data_key = None
+    while True:
+        with get_connection(owner_user_id) as conn:
+            rows = conn.execute("""
+                SELECT supplier_id, password FROM suppliers
+                WHERE owner_user_id = ? AND password_fp IS NULL
+                LIMIT ?
+            """, (owner_user_id, batch_size)).fetchall()
+        if not rows:
+            break
+        data_key = data_key or get_data_key(owner_user_id, fresh=True)
+        updates = []
+        strength = {}
+        for supplier_id, stored in rows:
+            password = decrypt_secret(owner_user_id, supplier_id, stored, data_key)
+            fp, score, reasons = audit_fields(owner_user_id, password)
+            updates.append((fp, supplier_id, stored))
+            strength[fp] = (fp, score, reasons)
+        with get_connection(owner_user_id) as conn:
+            remember_strength(conn, strength.values())
+            # The password check skips rows changed since we read them
+            changed = conn.executemany(
+                "UPDATE suppliers SET password_fp = ? WHERE supplier_id = ? AND password = ?", updates
+            ).rowcount
+        total += changed
+    if total:
+        invalidate_user(owner_user_id)
+    return total
+
+
+def backfill_all(progress=None):
+    """
+    backfill() every owner that has rows without a fingerprint.
+    Returns (rows filled in, owners).
+    """
+    owners = set()
+    for partition in storage_partitions():
+        with get_connection(partition) as conn:
+            owners.update(row[0] for row in conn.execute(
+                "SELECT DISTINCT owner_user_id FROM suppliers WHERE password_fp IS NULL"
+            ))
+    total = 0
+    for done, owner in enumerate(sorted(owners), 1):
+        total += backfill(owner)
+        if progress:
+            progress(done, len(owners))
+    return total, len(owners)
+
+
+def audit(owner_user_id):
+    """
+    Audit one user's suppliers. Returns a dict with
+      suppliers:    number of suppliers
+      reuse_groups: lists of (supplier_id, supplier_name, user_id) sharing
+                    one password, largest group first
+      weak:         (supplier_id, supplier_name, user_id, score, reasons),
+                    weakest first
+      rotate_first: (supplier_id, supplier_name, user_id, shared_with, score,
+                    reasons) of every flagged supplier, riskiest first
+    """
+    backfill(owner_user_id)
+
+    total = cached_query(
+        owner_user_id, "SELECT COUNT(*) FROM suppliers WHERE owner_user_id = ?", (owner_user_id,), one=True
+    )[0]
+    # The inner GROUP BY is answered from ix_suppliers_owner_fp alone
+    reused = cached_query(owner_user_id, """
+        SELECT s.password_fp, s.supplier_id, s.supplier_name, s.user_id
+        FROM (
+            SELECT password_fp FROM suppliers
+            WHERE owner_user_id = ? AND password_fp IS NOT NULL
+            GROUP BY password_fp
+            HAVING COUNT(*) > 1
+        ) AS r
+        JOIN suppliers AS s ON s.owner_user_id = ? AND s.password_fp = r.password_fp
+        ORDER BY s.supplier_name
+    """, (owner_user_id, owner_user_id))
+    weak = cached_query(owner_user_id, """
+        SELECT s.supplier_id, s.supplier_name, s.user_id, p.score, p.reasons
+        FROM suppliers AS s
+        JOIN password_strength AS p ON p.fingerprint = s.password_fp
+        WHERE s.owner_user_id = ? AND p.score <= ?
+        ORDER BY p.score, s.supplier_name
+    """, (owner_user_id, WEAK_SCORE))
+
+    groups = {}
+    for fp, supplier_id, supplier_name, user_id in reused:
+        groups.setdefault(fp, []).append((supplier_id, supplier_name, user_id))
+    reuse_groups = sorted(groups.values(), key=len, reverse=True)
+
+    flagged = {}
+    for group in reuse_groups:
+        for supplier_id, supplier_name, user_id in group:
+            flagged[supplier_id] = [supplier_id, supplier_name, user_id, len(group) - 1, None, ""]
+    for supplier_id, supplier_name, user_id, score, reasons in weak:
+        entry = flagged.setdefault(supplier_id, [supplier_id, supplier_name, user_id, 0, None, ""])
+        entry[4], entry[5] = score, reasons
+    # Weak and reused first, then weakest, then most widely shared
+    rotate_first = sorted(
+        (tuple(entry) for entry in flagged.values()),
+        key=lambda e: (-(e[3] > 0 and e[4] is not None), e[4] if e[4] is not None else 5, -e[3], e[1])
+    )
+    return {
+        "suppliers": total,
+        "reuse_groups": reuse_groups,
+        "weak": list(weak),
+        "rotate_first": rotate_first,
+    }
+
+
+def format_report(username, report):
+    """
+    Plain-text audit report for the CLI.
+    """
+    lines = [f"Password audit for {username}: {report['suppliers']} suppliers, "
+             f"{len(report['reuse_groups'])} reused passwords, {len(report['weak'])} weak passwords."]
+    if report["rotate_first"]:
+        lines += ["", "Rotate first:"]
+        for _, supplier_name, user_id, shared_with, score, reasons in report["rotate_first"]:
+            notes = []
+            if shared_with:
+                notes.append(f"shared with {shared_with} other supplier{'s' if shared_with != 1 else ''}")
+            if score is not None:
+                notes.append(f"weak ({score}/4{': ' + reasons if reasons else ''})")
+            lines.append(f"  - {supplier_name} ({user_id or '-'}): {', '.join(notes)}")
+    return "\n".join(lines)
@@ -0,0 +1,235 @@
+# passwords.py
+"""
+Account password hashing.
+
+Hashes are stored as self-describing strings so parameters can change
+without invalidating existing rows:
+
+    scrypt$<n>$<r>$<p>$<salt_b64>$<hash_b64>
+    pbkdf2_sha256$<iterations>$<salt_b64>$<hash_b64>
+
+Run `python passwords.py --target-ms 150` to pick parameters for this host.
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT = "scrypt"
+PBKDF2 = "pbkdf2_sha256"
+
+DEFAULT_SCRYPT_N = 2 ** 14
+DEFAULT_SCRYPT_R = 8
+DEFAULT_SCRYPT_P = 1
+DEFAULT_PBKDF2_ITERATIONS = 600_000
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# hashlib releases the GIL while hashing, so a small pool lets concurrent
+# sign-ins hash in parallel while capping CPU used at peak load.
+DEFAULT_HASH_WORKERS = 4
+
+_executor = None
+
+
+def _settings():
+    return {
+        "algorithm": os.getenv("KDF_ALGORITHM", SCRYPT),
+        "scrypt_n": int(os.getenv("KDF_SCRYPT_N", DEFAULT_SCRYPT_N)),
+        "scrypt_r": int(os.getenv("KDF_SCRYPT_R", DEFAULT_SCRYPT_R)),
+        "scrypt_p": int(os.getenv("KDF_SCRYPT_P", DEFAULT_SCRYPT_P)),
+        "pbkdf2_iterations": int(os.getenv("KDF_PBKDF2_ITERATIONS", DEFAULT_PBKDF2_ITERATIONS)),
+    }
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+def _unb64(text):
+    return base64.b64decode(text.encode("ascii"))
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem must cover 128 * n * r * p bytes plus some slack
+    return hashlib.scrypt(
+        password.encode("utf-8"), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r * p + 1024 * 1024, dklen=HASH_BYTES,
+    )
+
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations, dklen=HASH_BYTES)
+
+
+def current_params():
+    """
+    The (algorithm, params) new hashes are created with.
+    """
+    settings = _settings()
+    if settings["algorithm"] == PBKDF2:
+        return PBKDF2, (settings["pbkdf2_iterations"],)
+    return SCRYPT, (settings["scrypt_n"], settings["scrypt_r"], settings["scrypt_p"])
+
+
+def hash_password(password, algorithm=None, params=None):
+    """
+    Hash an account password with a fresh salt.
+    """
+    if algorithm is None:
+        algorithm, params = current_params()
+    salt = secrets.token_bytes(SALT_BYTES)
+    if algorithm == PBKDF2:
+        (iterations,) = params
+        digest = _pbkdf2(password, salt, iterations)
+        return f"{PBKDF2}${iterations}${_b64(salt)}${_b64(digest)}"
+    n, r, p = params
+    digest = _scrypt(password, salt, n, r, p)
+    return f"{SCRYPT}${n}${r}${p}${_b64(salt)}${_b64(digest)}"
+
+
+def is_hashed(stored):
+    return stored.startswith(f"{SCRYPT}$") or stored.startswith(f"{PBKDF2}$")
+
+
+def _parse(stored):
+    parts = stored.split("$")
+    if parts[0] == SCRYPT and len(parts) == 6:
+        return SCRYPT, tuple(int(x) for x in parts[1:4]), _unb64(parts[4]), _unb64(parts[5])
+    if parts[0] == PBKDF2 and len(parts) == 4:
+        return PBKDF2, (int(parts[1]),), _unb64(parts[2]), _unb64(parts[3])
+    raise ValueError("Unrecognised password hash format.")
+
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored value.
+    Returns (matches, needs_rehash). Legacy plaintext rows match by
+    constant-time comparison and always need a rehash; hashes made with
+    other than the current parameters need one too.
+    """
+    if not is_hashed(stored):
+        matches = hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+        return matches, matches
+
+    algorithm, params, salt, expected = _parse(stored)
+    if algorithm == PBKDF2:
+        digest = _pbkdf2(password, salt, *params)
+    else:
+        digest = _scrypt(password, salt, *params)
+    matches = hmac.compare_digest(digest, expected)
+    return matches, matches and (algorithm, params) != current_params()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        workers = int(os.getenv("KDF_WORKERS", DEFAULT_HASH_WORKERS))
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+    return _executor
+
+
+def hash_password_async(password):
+    """
+    Hash on the KDF worker pool; returns a Future.
+    """
+    return _get_executor().submit(hash_password, password)
+
+
+def verify_password_async(password, stored):
+    """
+    Verify on the KDF worker pool; returns a Future of (matches, needs_rehash).
+    """
+    return _get_executor().submit(verify_password, password, stored)
+
+
+# ---------------------------------------------------------------------------
+# Calibration
+# ---------------------------------------------------------------------------
+
+def _time_once(algorithm, params, rounds=3):
+    """
+    Median seconds for one hash with the given parameters.
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        hash_password("calibration-password", algorithm, params)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def _time_concurrent(algorithm, params, concurrency, rounds=2):
+    """
+    Wall-clock seconds per login when `concurrency` logins hash at once.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda _: hash_password("calibration-password", algorithm, params),
+                      range(concurrency * rounds)))
+        return (time.perf_counter() - start) / rounds
+
+
+def calibrate(target_ms, algorithm=SCRYPT, concurrency=1):
+    """
+    Pick the strongest parameters whose per-login latency stays within
+    target_ms on this host. With concurrency > 1 the latency is measured
+    while that many logins hash at the same time.
+    Returns (params, measured_ms).
+    """
+    target = target_ms / 1000.0
+
+    def measure(params):
+        if concurrency > 1:
+            return _time_concurrent(algorithm, params, concurrency)
+        return _time_once(algorithm, params)
+
+    if algorithm == PBKDF2:
+        # Cost is linear in iterations: measure once, scale, then verify
+        probe = 100_000
+        elapsed = measure((probe,))
+        iterations = max(int(probe * target / elapsed) // 1000 * 1000, 1000)
+        while iterations > 1000 and measure((iterations,)) > target:
+            iterations = int(iterations * 0.9) // 1000 * 1000
+        params = (iterations,)
+    else:
+        # Cost doubles with n: keep doubling while we stay under the target
+        n = 2 ** 10
+        r, p = DEFAULT_SCRYPT_R, DEFAULT_SCRYPT_P
+        while measure((n * 2, r, p)) <= target:
+            n *= 2
+            if n >= 2 ** 22:
+                break
+        params = (n, r, p)
+
+    return params, measure(params) * 1000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate account password hashing for this host.")
+    parser.add_argument("--target-ms", type=float, default=250.0,
+                        help="acceptable hashing latency per login (default 250)")
+    parser.add_argument("--algorithm", choices=[SCRYPT, PBKDF2], default=SCRYPT)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="simultaneous logins to assume at peak (default 1)")
+    args = parser.parse_args()
+
+    params, measured = calibrate(args.target_ms, args.algorithm, args.concurrency)
+    print(f"Measured {measured:.1f} ms per login (target {args.target_ms:.0f} ms, "
+          f"concurrency {args.concurrency}). Add to your .env:")
+    print(f"KDF_ALGORITHM={args.algorithm}")
+    if args.algorithm == PBKDF2:
+        print(f"KDF_PBKDF2_ITERATIONS={params[0]}")
+    else:
+        n, r, p = params
+        print(f"KDF_SCRYPT_N={n}")
+        print(f"KDF_SCRYPT_R={r}")
+        print(f"KDF_SCRYPT_P={p}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+# scheduler.py
+"""
+Background password-rotation reminders.
+
+    python scheduler.py                  # run forever, every SCHEDULER_INTERVAL seconds
+    python scheduler.py --once           # one pass (e.g. from cron)
+
+Each pass finds the suppliers whose reminder date (warn_at, which follows
+each supplier's rotation policy) passed since the previous pass, with one
+range scan on ix_suppliers_warn, and sends every affected user one digest
+email.
+
+Progress is kept in the database so restarts neither re-send nor miss
+reminders:
+- scheduler_state holds the watermark, i.e. the warn_at bound covered
+  so far, and the window currently being processed.
+- reminder_deliveries records which owners of that window already got
+  their digest.
+A pass that crashes or fails to deliver some digests is resumed by the
+next pass with the same window, skipping the owners already notified.
+Run a single scheduler per database.
+
+Shortening a rotation policy can move warn_at behind the watermark,
+where the range scan never looks again. The policy change records those
+suppliers in reminder_catchup (see queue_missed_reminders) and the next
+pass sends them along with its window.
+
+Every pass also sweeps the reminders_due table (see database.py), which
+the reminders page reads, so it stays complete without app traffic.
+"""
+import argparse
+import os
+import signal
+import threading
+import time
+import metrics
+from database import get_connection, init_db, storage_partitions, sweep_reminders_due
+
+DEFAULT_INTERVAL = 3600
+# Owners whose digests are queued before waiting for delivery
+DIGEST_BATCH = 200
+# Suppliers listed in one digest; the rest are summarized
+DIGEST_MAX_LINES = 50
+DELIVERY_TIMEOUT = 120.0
+# Passes a window may stay pending because of failed deliveries before
+# the scheduler gives up on those owners and moves on
+MAX_WINDOW_ATTEMPTS = 5
+
+WATERMARK = "reminders.watermark"
+WINDOW_START = "reminders.window_start"
+WINDOW_END = "reminders.window_end"
+WINDOW_ATTEMPTS = "reminders.window_attempts"
+
+
+def _get_state(conn, name):
+    row = conn.execute("SELECT value FROM scheduler_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def _set_state(conn, name, value):
+    conn.execute(
+        "INSERT OR REPLACE INTO scheduler_state (name, value) VALUES (?, ?)", (name, value)
+    )
+
+
+def _open_window():
+    """
+    Return (start, end, attempt) of the warn_at range to process: the
+    pending one if the last pass didn't finish, else (watermark, now].
+    The first pass has no lower bound, covering everything currently due.
+    """
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        start = _get_state(conn, WINDOW_START)
+        end = _get_state(conn, WINDOW_END)
+        if start is not None and end is not None:
+            attempt = int(_get_state(conn, WINDOW_ATTEMPTS) or 0) + 1
+        else:
+            end = conn.execute("SELECT DATETIME('now')").fetchone()[0]
+            start = _get_state(conn, WATERMARK) or ""
+            attempt = 1
+            _set_state(conn, WINDOW_START, start)
+            _set_state(conn, WINDOW_END, end)
+        _set_state(conn, WINDOW_ATTEMPTS, str(attempt))
+    return start, end, attempt
+
+
+def _close_window(end):
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        _set_state(conn, WATERMARK, end)
+        conn.execute(
+            "DELETE FROM scheduler_state WHERE name IN (?, ?, ?)",
+            (WINDOW_START, WINDOW_END, WINDOW_ATTEMPTS)
+        )
+        conn.execute("DELETE FROM reminder_deliveries WHERE window_end = ?", (end,))
+
+
+def covered_until():
+    """
+    The warn_at bound reminders have been sent, or are being sent, up to;
+    None before the first pass.
+    """
+    with get_connection() as conn:
+        return _get_state(conn, WINDOW_END) or _get_state(conn, WATERMARK)
+
+
+def reminders_ahead(conn, owner_user_id, bound):
+    """
+    Ids of the owner's suppliers whose warn_at is still ahead of `bound`
+    (from covered_until). Call it in the transaction that changes their
+    policy, before the change, and pass the result to
+    queue_missed_reminders afterwards.
+    """
+    if bound is None:
+        return []
+    return [row[0] for row in conn.execute(
+        "SELECT supplier_id FROM suppliers WHERE owner_user_id = ? AND warn_at > ?", (owner_user_id, bound)
+    )]
+
+
+def queue_missed_reminders(conn, supplier_ids, bound):
+    """
+    Queue the suppliers among `supplier_ids` whose warn_at is now at or
+    behind `bound` and that haven't expired, so the next pass reminds
+    their owners. Returns how many were queued.
+    """
+    queued = 0
+    supplier_ids = list(supplier_ids)
+    for i in range(0, len(supplier_ids), 500):
+        chunk = supplier_ids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        queued += conn.execute(f"""
+            INSERT OR IGNORE INTO reminder_catchup (supplier_id, owner_user_id)
+            SELECT supplier_id, owner_user_id FROM suppliers
+            WHERE supplier_id IN ({marks}) AND warn_at <= ? AND expires_at > DATETIME('now')
+        """, chunk + [bound]).rowcount
+    return queued
+
+
+def missed_reminders(before):
+    """
+    ({owner_user_id: [(supplier_name, expires_at), ...]}, {partition: [supplier_id, ...]})
+    for the queued suppliers that are still due: warn_at at or before
+    `before` and not expired. Queue entries that no longer qualify are
+    dropped; if warn_at moved ahead again, the range scan reaches them.
+    """
+    grouped, queued = {}, {}
+    for partition in storage_partitions():
+        with get_connection(partition) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                DELETE FROM reminder_catchup
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM suppliers s
+                    WHERE s.supplier_id = reminder_catchup.supplier_id
+                      AND s.warn_at <= ? AND s.expires_at > DATETIME('now')
+                )
+            """, (before,))
+            rows = conn.execute("""
+                SELECT s.supplier_id, s.owner_user_id, s.supplier_name, s.expires_at
+                FROM reminder_catchup c JOIN suppliers s ON s.supplier_id = c.supplier_id
+                ORDER BY s.expires_at
+            """).fetchall()
+        for supplier_id, owner_user_id, supplier_name, expires_at in rows:
+            grouped.setdefault(owner_user_id, []).append((supplier_name, expires_at))
+            queued.setdefault(partition, []).append(supplier_id)
+    return grouped, queued
+
+
+def _drop_missed(queued):
+    for partition, supplier_ids in queued.items():
+        with get_connection(partition) as conn:
+            conn.executemany("DELETE FROM reminder_catchup WHERE supplier_id = ?",
+                             ((supplier_id,) for supplier_id in supplier_ids))
+
+
+def due_in_window(start, end):
+    """
+    {owner_user_id: [(supplier_name, expires_at), ...]} for suppliers whose
+    warn_at lies in (start, end] and that haven't expired yet. Range scan
+    on ix_suppliers_warn, once per shard in sharded mode.
+    """
+    grouped = {}
+    for partition in storage_partitions():
+        with get_connection(partition) as conn:
+            cursor = conn.execute("""
+                SELECT owner_user_id, supplier_name, expires_at
+                FROM suppliers
+                WHERE warn_at > ? AND warn_at <= ? AND expires_at > DATETIME('now')
+                ORDER BY expires_at
+            """, (start, end))
+            while True:
+                rows = cursor.fetchmany(5000)
+                if not rows:
+                    break
+                for owner_user_id, supplier_name, expires_at in rows:
+                    grouped.setdefault(owner_user_id, []).append((supplier_name, expires_at))
+    return grouped
+
+
+def _recipients(owner_ids):
+    """
+    {user_id: (username, email)} for the given owners.
+    """
+    recipients = {}
+    owner_ids = list(owner_ids)
+    with get_connection() as conn:
+        for i in range(0, len(owner_ids), 500):
+            chunk = owner_ids[i:i + 500]
+            marks = ",".join("?" * len(chunk))
+            for user_id, username, email in conn.execute(
+                f"SELECT user_id, username, email FROM users WHERE user_id IN ({marks})", chunk
+            ):
+                recipients[user_id] = (username, email)
+    return recipients
+
+
+def format_digest(username, items):
+    """
+    Subject and body of one user's reminder email.
+    """
+    count = len(items)
+    subject = f"{count} supplier password{'s' if count != 1 else ''} due for reset"
+    lines = [
+        f"Hello {username},",
+        "",
+        "These supplier passwords are due for reset:",
+        "",
+    ]
+    for supplier_name, expires_at in items[:DIGEST_MAX_LINES]:
+        lines.append(f"- {supplier_name}, Expiry Date: {expires_at} UTC")
+    if count > DIGEST_MAX_LINES:
+        lines.append(f"... and {count - DIGEST_MAX_LINES} more. See 'View Supplier Password Reset Reminders'.")
+    lines += ["", "Please reset them in the Password Manager."]
+    return subject, "\n".join(lines)
+
+
+def run_once(send_email=None, log=print):
+    """
+    Process one reminder window. Returns a summary dict.
+    """
+    if send_email is None:
+        from email_otp import send_email_async as send_email
+
+    for partition in storage_partitions():
+        sweep_reminders_due(partition)
+    start, end, attempt = _open_window()
+    grouped = due_in_window(start, end)
+    missed, queued = missed_reminders(start)
+    for owner, items in missed.items():
+        grouped[owner] = sorted(grouped.get(owner, []) + items, key=lambda item: item[1])
+    with get_connection() as conn:
+        done = {row[0] for row in conn.execute(
+            "SELECT owner_user_id FROM reminder_deliveries WHERE window_end = ?", (end,)
+        )}
+    pending = [owner for owner in grouped if owner not in done]
+    recipients = _recipients(pending)
+
+    summary = {"window_start": start, "window_end": end, "attempt": attempt,
+               "suppliers": sum(len(items) for items in grouped.values()),
+               "missed": sum(len(items) for items in missed.values()),
+               "owners": len(grouped), "sent": 0, "failed": 0, "skipped": len(done)}
+
+    for i in range(0, len(pending), DIGEST_BATCH):
+        handles = []
+        for owner in pending[i:i + DIGEST_BATCH]:
+            username, email = recipients.get(owner, (None, None))
+            if not email:
+                # Nothing to deliver to; count it as handled
+                handles.append((owner, None))
+                continue
+            subject, body = format_digest(username, grouped[owner])
+            handles.append((owner, send_email(email, subject, body)))
+
+        delivered = []
+        for owner, handle in handles:
+            if handle is None or handle.wait(DELIVERY_TIMEOUT):
+                delivered.append((end, owner, len(grouped[owner])))
+            else:
+                summary["failed"] += 1
+                log(f"Error sending reminder digest to user {owner}: {handle.error if handle else ''}")
+        with get_connection() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO reminder_deliveries (window_end, owner_user_id, suppliers) VALUES (?, ?, ?)",
+                delivered
+            )
+        summary["sent"] += len(delivered)
+
+    if summary["failed"] and attempt < MAX_WINDOW_ATTEMPTS:
+        log(f"{summary['failed']} digests failed; window stays open (attempt {attempt}/{MAX_WINDOW_ATTEMPTS}).")
+    else:
+        if summary["failed"]:
+            log(f"Giving up on {summary['failed']} digests after {attempt} attempts.")
+        _close_window(end)
+        _drop_missed(queued)
+    return summary
+
+
+def run_forever(interval, stop_event, log=print):
+    while not stop_event.is_set():
+        started = time.monotonic()
+        try:
+            summary = run_once(log=log)
+            log(f"Reminders ({summary['window_start']} .. {summary['window_end']}]: "
+                f"{summary['suppliers']} suppliers, {summary['sent']} digests sent, "
+                f"{summary['failed']} failed in {time.monotonic() - started:.2f}s")
+        except Exception as e:
+            log(f"Error running reminder pass: {e}")
+        stop_event.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send password reset reminder digests.")
+    parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+    parser.add_argument("--interval", type=float,
+                        default=float(os.getenv("SCHEDULER_INTERVAL", DEFAULT_INTERVAL)),
+                        help="seconds between passes (default SCHEDULER_INTERVAL or 3600)")
+    args = parser.parse_args()
+
+    init_db()
+    if args.once:
+        summary = run_once()
+        print(f"{summary['suppliers']} suppliers, {summary['sent']} digests sent, {summary['failed']} failed.")
+        return
+
+    metrics.start_exporter()
+    stop_event = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop_event.set())
+    run_forever(args.interval, stop_event)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,722 @@
+# services.py
+"""
+Streamlit-free data access and business logic.
+
+SupplierRepository and AuthService return plain values (rows, tuples,
+(ok, message) pairs) and never touch `st`; the Streamlit pages in
+suppliers.py / app.py and the main.py CLI are thin layers on top.
+
+Crypto, mail and CSV modules are imported inside the methods that need
+them, so a CLI command only pays for what it uses.
+
+Small writes from sessions (add, edit, delete, register, password
+changes) go through writer.write(), which group-commits them with other
+sessions' writes. Large ones (imports, batch edits, key rotation) keep
+their own transaction.
+
+Every supplier change, unmask, import and key rotation is recorded in
+the audit log (audit_log.py) once it has succeeded.
+"""
+import re
+import sqlite3
+import audit_log
+from database import (
+    get_connection,
+    has_table,
+    next_supplier_id,
+    storage_partitions,
+    ensure_reminders_due,
+    sweep_reminders_due,
+    PASSWORD_EXPIRY_DAYS,
+    REMINDER_WINDOW_DAYS,
+)
+from cache import cached_query, invalidate_user
+from writer import write
+
+PICKER_PAGE_SIZE = 50
+EXPORT_BATCH_SIZE = 1000
+
+# Supplier columns that can be changed through update_field() / bulk_update()
+EDITABLE_FIELDS = ("supplier_name", "office_id", "user_id", "password", "url")
+# Most suppliers one batch edit may touch
+BULK_EDIT_MAX = 5000
+# Rotation policy columns; None means "use the owner's default"
+POLICY_FIELDS = ("rotation_days", "warning_days")
+
+
+class BulkUpdateError(Exception):
+    """
+    A batch edit was rejected and rolled back.
+    """
+
+
+def _check_changes(changes):
+    """
+    Validate a {field: new_value} dict; returns its fields in a stable order.
+    """
+    if not changes:
+        raise ValueError("No changes given.")
+    unknown = set(changes) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown supplier field(s): {', '.join(sorted(unknown))}")
+    for required in ("supplier_name", "password"):
+        if required in changes and not changes[required]:
+            raise ValueError(f"The new {required.replace('_', ' ')} can't be empty.")
+    return [field for field in EDITABLE_FIELDS if field in changes]
+
+
+def _check_policy(changes):
+    """
+    Validate a {policy field: days or None} dict; returns its fields in a stable order.
+    """
+    unknown = set(changes) - set(POLICY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown policy field: {', '.join(sorted(unknown))}")
+    for field, days in changes.items():
+        if days is not None and (not isinstance(days, int) or days < 0):
+            raise ValueError(f"{field} must be a whole number of days (0 or more).")
+    return [field for field in POLICY_FIELDS if field in changes]
+
+
+def _fts_query(owner_user_id, text):
+    """
+    Turn free text into an FTS5 query: every word is a prefix match and all
+    words must appear. The owner filter is part of the MATCH so only the
+    owner's postings are read.
+    """
+    terms = [f'"{word}"*' for word in re.findall(r"\w+", text)]
+    return f'owner_user_id : "{int(owner_user_id)}" AND ' + " AND ".join(terms)
+
+
+class SupplierRepository:
+    """
+    Reads and writes of a user's suppliers. Every write invalidates the
+    owner's cached reads.
+    """
+
+    def __init__(self):
+        self._fts_available = None
+
+    def _search_uses_fts(self):
+        if self._fts_available is None:
+            with get_connection() as conn:
+                self._fts_available = has_table(conn, "suppliers_fts")
+        return self._fts_available
+
+    # -- reads -------------------------------------------------------------
+
+    def has_suppliers(self, owner_user_id):
+        row = cached_query(
+            owner_user_id,
+            "SELECT 1 FROM suppliers WHERE owner_user_id = ? LIMIT 1",
+            (owner_user_id,),
+            one=True,
+        )
+        return row is not None
+
+    def search(self, owner_user_id, text="", after=None, limit=PICKER_PAGE_SIZE):
+        """
+        Return up to `limit` (supplier_id, supplier_name, user_id) rows of the
+        owner's suppliers matching `text`, ordered by name.
+        Keyset pagination: pass the (supplier_name, supplier_id) of the last row
+        of the previous page as `after` to get the next page.
+        """
+        after_name, after_id = after if after else ("", 0)
+        words = re.findall(r"\w+", text or "")
+
+        if not words:
+            return cached_query(owner_user_id, """
+                SELECT supplier_id, supplier_name, user_id
+                FROM suppliers
+                WHERE owner_user_id = ?
+                  AND (supplier_name, supplier_id) > (?, ?)
+                ORDER BY supplier_name, supplier_id
+                LIMIT ?
+            """, (owner_user_id, after_name, after_id, limit))
+        elif self._search_uses_fts():
+            return cached_query(owner_user_id, """
+                SELECT s.supplier_id, s.supplier_name, s.user_id
+                FROM suppliers_fts
+                -- CROSS JOIN keeps the FTS match as the outer loop
+                CROSS JOIN suppliers AS s ON s.supplier_id = suppliers_fts.rowid
+                WHERE suppliers_fts MATCH ?
+                  AND s.owner_user_id = ?
+                  AND (s.supplier_name, s.supplier_id) > (?, ?)
+                ORDER BY s.supplier_name, s.supplier_id
+                LIMIT ?
+            """, (_fts_query(owner_user_id, text), owner_user_id, after_name, after_id, limit))
+        else:
+            pattern = f"%{text.strip()}%"
+            return cached_query(owner_user_id, """
+                SELECT supplier_id, supplier_name, user_id
+                FROM suppliers
+                WHERE owner_user_id = ?
+                  AND (supplier_name LIKE ? OR office_id LIKE ? OR user_id LIKE ? OR url LIKE ?)
+                  AND (supplier_name, supplier_id) > (?, ?)
+                ORDER BY supplier_name, supplier_id
+                LIMIT ?
+            """, (owner_user_id, pattern, pattern, pattern, pattern, after_name, after_id, limit))
+
+    def get(self, owner_user_id, supplier_id):
+        """
+        Fetch one supplier by primary key, only if it belongs to the owner.
+        Returns (supplier_id, supplier_name, office_id, user_id, password_length,
+        url, last_reset, reminder_at, expires_at, rotation_days, warning_days)
+        or None, with the policy the supplier actually follows (its own or the
+        owner's default; rotation_days 0 = never expires). The password itself
+        is only read by get_password(), never through the cache.
+        """
+        return cached_query(owner_user_id, """
+            SELECT supplier_id, supplier_name, office_id, user_id, password_length,
+                   url, last_reset, warn_at, expires_at,
+                   COALESCE(rotation_days, default_rotation_days),
+                   COALESCE(warning_days, default_warning_days)
+            FROM suppliers
+            WHERE supplier_id = ? AND owner_user_id = ?
+        """, (supplier_id, owner_user_id), one=True)
+
+    def get_password(self, owner_user_id, supplier_id):
+        """
+        Read and decrypt one supplier password (uncached).
+        """
+        from vault_crypto import decrypt_secret
+
+        with get_connection(owner_user_id) as conn:
+            row = conn.execute(
+                "SELECT password FROM suppliers WHERE supplier_id = ? AND owner_user_id = ?",
+                (supplier_id, owner_user_id)
+            ).fetchone()
+        if row is None:
+            return None
+        password = decrypt_secret(owner_user_id, supplier_id, row[0])
+        audit_log.record(owner_user_id, audit_log.UNMASK, supplier_id)
+        return password
+
+    def due_reminders(self, owner_user_id):
+        """
+        (supplier_name, expires_at) of the owner's suppliers whose warning
+        period has started and which haven't expired yet, read from the
+        reminders_due table: a range scan on its covering
+        (owner_user_id, expires_at, supplier_name, warn_at) index that only
+        touches due rows.
+        """
+        for owner in ensure_reminders_due(owner_user_id):
+            invalidate_user(owner)
+        return cached_query(owner_user_id, """
+            SELECT supplier_name, expires_at
+            FROM reminders_due
+            WHERE owner_user_id = ?
+              AND expires_at > DATETIME('now')
+              AND warn_at <= DATETIME('now')
+            ORDER BY expires_at
+        """, (owner_user_id,))
+
+    def all_due_reminders(self):
+        """
+        (username, email, supplier_name, expires_at) for every user, ordered
+        by user then expiry. Uncached; meant for batch jobs. Reads every
+        storage partition, so it also works in sharded mode.
+        """
+        due = []
+        for partition in storage_partitions():
+            for owner in sweep_reminders_due(partition):
+                invalidate_user(owner)
+            with get_connection(partition) as conn:
+                due += conn.execute("""
+                    SELECT owner_user_id, supplier_name, expires_at
+                    FROM reminders_due
+                    WHERE expires_at > DATETIME('now')
+                      AND warn_at <= DATETIME('now')
+                """).fetchall()
+        owners = sorted({owner for owner, _, _ in due})
+        users = {}
+        with get_connection() as conn:
+            for i in range(0, len(owners), 500):
+                chunk = owners[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for user_id, username, email in conn.execute(
+                    f"SELECT user_id, username, email FROM users WHERE user_id IN ({marks})", chunk
+                ):
+                    users[user_id] = (username, email)
+        rows = [users[owner] + (supplier_name, expires_at)
+                for owner, supplier_name, expires_at in due if owner in users]
+        rows.sort(key=lambda row: (row[0], row[3]))
+        return rows
+
+    def iter_suppliers(self, owner_user_id, decrypt=True, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Yield (supplier_name, office_id, user_id, password, url, last_reset)
+        for every supplier of the owner. One cursor is drained with
+        fetchmany, so memory stays flat and the whole run sees a single
+        consistent snapshot. The order follows the unique owner/name/user
+        index, so SQLite never has to sort.
+        """
+        from vault_crypto import decrypt_secret, get_data_key
+
+        data_key = get_data_key(owner_user_id, fresh=True) if decrypt else None
+        with get_connection(owner_user_id) as conn:
+            cursor = conn.execute("""
+                SELECT supplier_id, supplier_name, office_id, user_id, password, url, last_reset
+                FROM suppliers
+                WHERE owner_user_id = ?
+                ORDER BY supplier_name, user_id
+            """, (owner_user_id,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for supplier_id, name, office_id, user_id, password, url, last_reset in rows:
+                    if decrypt:
+                        password = decrypt_secret(owner_user_id, supplier_id, password, data_key)
+                    yield name, office_id, user_id, password, url, last_reset
+
+    # -- writes ------------------------------------------------------------
+
+    def add(self, owner_user_id, supplier_name, office_id, supplier_user_id, password, url):
+        """
+        Add one supplier. Returns (success_bool, message).
+        """
+        from vault_crypto import encrypt_secret, get_data_key
+        from password_audit import audit_fields, remember_strength
+
+        if not supplier_name or not password:
+            return False, "Supplier name and password are required."
+        audit = audit_fields(owner_user_id, password)
+        data_key = get_data_key(owner_user_id, fresh=True)
+
+        def insert(conn):
+            remember_strength(conn, [audit])
+            # The ciphertext is bound to the row's id, so pick it up front
+            supplier_id = next_supplier_id(conn)
+            conn.execute("""
+                INSERT INTO suppliers
+                  (supplier_id, supplier_name, office_id, user_id, password, password_length, password_fp,
+                   url, last_reset, owner_user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, DATETIME('now'), ?)
+            """, (supplier_id, supplier_name, office_id, supplier_user_id,
+                  encrypt_secret(owner_user_id, supplier_id, password, data_key), len(password), audit[0],
+                  url, owner_user_id))
+            return supplier_id
+
+        try:
+            supplier_id = write(insert, owner_user_id)
+        except sqlite3.IntegrityError:
+            # ux_suppliers_owner_name_user
+            return False, "Supplier already added!"
+        invalidate_user(owner_user_id)
+        audit_log.record(owner_user_id, audit_log.ADD, supplier_id, supplier_name)
+        return True, "Supplier added successfully!"
+
+    def update_field(self, owner_user_id, supplier_id, field, value):
+        """
+        Change one field of a supplier. A new password is encrypted and
+        restarts the expiry clock. Returns (success_bool, message).
+        """
+        from vault_crypto import encrypt_secret
+        from password_audit import audit_fields, remember_strength
+
+        if field not in EDITABLE_FIELDS:
+            raise ValueError(f"Unknown supplier field: {field}")
+        try:
+            _check_changes({field: value})
+        except ValueError as e:
+            return False, str(e)
+        audit = None
+        if field == "password":
+            audit = audit_fields(owner_user_id, value)
+            sql = ("UPDATE suppliers SET password = ?, password_length = ?, password_fp = ?, "
+                   "last_reset = DATETIME('now') WHERE supplier_id = ? AND owner_user_id = ?")
+            params = (encrypt_secret(owner_user_id, supplier_id, value), len(value), audit[0],
+                      supplier_id, owner_user_id)
+        else:
+            sql = f"UPDATE suppliers SET {field} = ? WHERE supplier_id = ? AND owner_user_id = ?"
+            params = (value, supplier_id, owner_user_id)
+
+        def update(conn):
+            if audit:
+                remember_strength(conn, [audit])
+            return conn.execute(sql, params).rowcount
+
+        try:
+            updated = write(update, owner_user_id)
+        except sqlite3.IntegrityError:
+            # ux_suppliers_owner_name_user
+            return False, "Another supplier already has that name and user ID."
+        invalidate_user(owner_user_id)
+        if not updated:
+            return False, "Supplier not found."
+        audit_log.record(owner_user_id, audit_log.MODIFY, supplier_id, field)
+        return True, f"{field} updated successfully."
+
+    def match_ids(self, owner_user_id, text, limit=BULK_EDIT_MAX):
+        """
+        Ids of all the owner's suppliers matching `text` (every supplier if
+        empty), up to `limit`, walking the search pages.
+        """
+        ids = []
+        after = None
+        while len(ids) < limit:
+            rows = self.search(owner_user_id, text, after=after, limit=min(limit - len(ids), 500))
+            if not rows:
+                break
+            ids.extend(row[0] for row in rows)
+            after = (rows[-1][1], rows[-1][0])
+        return ids
+
+    def preview_bulk_update(self, owner_user_id, supplier_ids, changes, limit=None):
+        """
+        (supplier_id, supplier_name, user_id, {field: (old, new)}) for the
+        suppliers a bulk_update() would change. Passwords are shown masked.
+        """
+        fields = _check_changes(changes)
+        columns = [f for f in fields if f != "password"]
+        preview = []
+        for supplier_id in list(supplier_ids)[:limit]:
+            row = self.get(owner_user_id, supplier_id)
+            if row is None:
+                continue
+            current = dict(zip(("supplier_id", "supplier_name", "office_id", "user_id", "password_length",
+                                "url"), row[:6]))
+            diff = {field: (current[field], changes[field]) for field in columns}
+            if "password" in changes:
+                diff["password"] = ("*" * (current["password_length"] or 0), "*" * len(changes["password"]))
+            preview.append((supplier_id, current["supplier_name"], current["user_id"], diff))
+        return preview
+
+    def bulk_update(self, owner_user_id, supplier_ids, changes):
+        """
+        Apply the same field changes to many suppliers with one executemany
+        in one IMMEDIATE transaction. All or nothing: if any supplier is
+        missing or not the owner's, or a change would break the unique
+        owner/name/user index, everything is rolled back and
+        BulkUpdateError is raised. A new password is encrypted per row and
+        restarts the expiry clock. Returns the number of suppliers changed.
+        """
+        from vault_crypto import encrypt_secret, get_data_key
+        from password_audit import audit_fields, remember_strength
+
+        fields = _check_changes(changes)
+        supplier_ids = list(dict.fromkeys(supplier_ids))
+        if not supplier_ids:
+            return 0
+
+        assignments = [f"{field} = ?" for field in fields if field != "password"]
+        audit = None
+        if "password" in changes:
+            assignments += ["password = ?", "password_length = ?", "password_fp = ?",
+                            "last_reset = DATETIME('now')"]
+            data_key = get_data_key(owner_user_id, fresh=True)
+            audit = audit_fields(owner_user_id, changes["password"])
+        values = [changes[field] for field in fields if field != "password"]
+
+        def params():
+            for supplier_id in supplier_ids:
+                row = list(values)
+                if "password" in changes:
+                    # A fresh nonce per row, so equal passwords don't share ciphertexts
+                    row += [encrypt_secret(owner_user_id, supplier_id, changes["password"], data_key),
+                            len(changes["password"]), audit[0]]
+                yield row + [supplier_id, owner_user_id]
+
+        sql = f"UPDATE suppliers SET {', '.join(assignments)} WHERE supplier_id = ? AND owner_user_id = ?"
+        try:
+            with get_connection(owner_user_id) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if audit:
+                    remember_strength(conn, [audit])
+                updated = conn.executemany(sql, params()).rowcount
+                if updated != len(supplier_ids):
+                    raise BulkUpdateError(
+                        f"Only {updated} of {len(supplier_ids)} suppliers could be updated; nothing was changed."
+                    )
+        except sqlite3.IntegrityError:
+            raise BulkUpdateError(
+                "The changes would create duplicate suppliers (same name and user ID); nothing was changed."
+            )
+        finally:
+            invalidate_user(owner_user_id)
+        audit_log.record(owner_user_id, audit_log.BULK_MODIFY,
+                         detail=f"{updated} suppliers: {', '.join(fields)}")
+        return updated
+
+    def set_rotation_policy(self, owner_user_id, changes, supplier_ids=None):
+        """
+        Set rotation_days / warning_days (None = inherit the owner's
+        default, rotation_days 0 = never expires) on the given suppliers,
+        or on all of the owner's suppliers when supplier_ids is None, in
+        one IMMEDIATE transaction. expires_at / warn_at follow by
+        themselves. Returns the number of suppliers changed.
+        """
+        from scheduler import covered_until, queue_missed_reminders, reminders_ahead
+
+        fields = _check_policy(changes)
+        if not fields:
+            return 0
+        assignments = ", ".join(f"{field} = ?" for field in fields)
+        values = [changes[field] for field in fields]
+        bound = covered_until()
+        with get_connection(owner_user_id) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ahead = reminders_ahead(conn, owner_user_id, bound)
+            if supplier_ids is None:
+                updated = conn.execute(
+                    f"UPDATE suppliers SET {assignments} WHERE owner_user_id = ?", values + [owner_user_id]
+                ).rowcount
+            else:
+                updated = conn.executemany(
+                    f"UPDATE suppliers SET {assignments} WHERE supplier_id = ? AND owner_user_id = ?",
+                    (values + [supplier_id, owner_user_id] for supplier_id in dict.fromkeys(supplier_ids))
+                ).rowcount
+            queue_missed_reminders(conn, ahead, bound)
+        invalidate_user(owner_user_id)
+        audit_log.record(owner_user_id, audit_log.POLICY, detail=f"{updated} suppliers: " + ", ".join(
+            f"{field}={'default' if changes[field] is None else changes[field]}" for field in fields
+        ))
+        return updated
+
+    def default_rotation_policy(self, owner_user_id):
+        """
+        (rotation_days, warning_days) the owner's suppliers inherit.
+        """
+        with get_connection(owner_user_id) as conn:
+            row = conn.execute(
+                "SELECT rotation_days, warning_days FROM rotation_defaults WHERE owner_user_id = ?",
+                (owner_user_id,)
+            ).fetchone()
+        return tuple(row) if row else (PASSWORD_EXPIRY_DAYS, REMINDER_WINDOW_DAYS)
+
+    def set_default_rotation_policy(self, owner_user_id, rotation_days, warning_days):
+        """
+        Change the policy the owner's suppliers inherit, and apply it to
+        every supplier without its own, in one transaction. Returns the
+        number of suppliers that inherit it, i.e. that leave rotation_days
+        or warning_days unset.
+        """
+        from scheduler import covered_until, queue_missed_reminders, reminders_ahead
+
+        _check_policy({"rotation_days": rotation_days, "warning_days": warning_days})
+        if rotation_days is None or warning_days is None:
+            raise ValueError("A default policy needs both rotation_days and warning_days.")
+        bound = covered_until()
+        with get_connection(owner_user_id) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            ahead = reminders_ahead(conn, owner_user_id, bound)
+            conn.execute(
+                "INSERT OR REPLACE INTO rotation_defaults (owner_user_id, rotation_days, warning_days) "
+                "VALUES (?, ?, ?)", (owner_user_id, rotation_days, warning_days)
+            )
+            conn.execute("""
+                UPDATE suppliers SET default_rotation_days = ?, default_warning_days = ?
+                WHERE owner_user_id = ?
+                  AND (default_rotation_days != ? OR default_warning_days != ?)
+            """, (rotation_days, warning_days, owner_user_id, rotation_days, warning_days))
+            queue_missed_reminders(conn, ahead, bound)
+            inheriting = conn.execute("""
+                SELECT COUNT(*) FROM suppliers
+                WHERE owner_user_id = ? AND (rotation_days IS NULL OR warning_days IS NULL)
+            """, (owner_user_id,)).fetchone()[0]
+        invalidate_user(owner_user_id)
+        audit_log.record(owner_user_id, audit_log.POLICY,
+                         detail=f"default rotation_days={rotation_days}, warning_days={warning_days}")
+        return inheriting
+
+    def delete(self, owner_user_id, supplier_id):
+        deleted = write(lambda conn: conn.execute(
+            "DELETE FROM suppliers WHERE supplier_id = ? AND owner_user_id = ?",
+            (supplier_id, owner_user_id)
+        ).rowcount, owner_user_id)
+        invalidate_user(owner_user_id)
+        if deleted:
+            audit_log.record(owner_user_id, audit_log.DELETE, supplier_id)
+        return deleted > 0
+
+    def delete_all(self, owner_user_id):
+        """
+        Delete every supplier of the owner; returns how many were removed.
+        """
+        deleted = write(lambda conn: conn.execute(
+            "DELETE FROM suppliers WHERE owner_user_id = ?", (owner_user_id,)
+        ).rowcount, owner_user_id)
+        invalidate_user(owner_user_id)
+        audit_log.record(owner_user_id, audit_log.DELETE_ALL, detail=f"{deleted} suppliers")
+        return deleted
+
+    def import_csv(self, owner_user_id, binary_file, total_bytes=None, progress=None):
+        """
+        Import a CSV opened in binary mode; see importer.import_suppliers.
+        """
+        from importer import import_suppliers
+        summary = import_suppliers(owner_user_id, binary_file, total_bytes=total_bytes, progress=progress)
+        self._record_import(owner_user_id, summary)
+        return summary
+
+    def import_csv_path(self, owner_user_id, path, progress=None):
+        from importer import import_suppliers_from_path
+        summary = import_suppliers_from_path(owner_user_id, path, progress=progress)
+        self._record_import(owner_user_id, summary)
+        return summary
+
+    def _record_import(self, owner_user_id, summary):
+        if summary["inserted"]:
+            audit_log.record(owner_user_id, audit_log.IMPORT,
+                             detail=f"{summary['inserted']} added, {summary['skipped']} skipped")
+
+    def password_audit(self, owner_user_id):
+        """
+        Reused and weak passwords of the owner; see password_audit.audit.
+        """
+        from password_audit import audit
+        return audit(owner_user_id)
+
+    def rotate_data_key(self, owner_user_id):
+        """
+        Re-encrypt the owner's vault under a fresh data key; returns the
+        number of passwords re-encrypted.
+        """
+        from vault_crypto import rotate_data_key
+        rotated = rotate_data_key(owner_user_id)
+        audit_log.record(owner_user_id, audit_log.ROTATE_KEY, detail=f"{rotated} passwords")
+        return rotated
+
+
+class AuthService:
+    """
+    Account registration, sign-in, password reset and action OTPs.
+    """
+
+    def get_user(self, username):
+        """
+        Look up a user without checking a password.
+        Returns (user_id, username, email, db_password) or None.
+        """
+        with get_connection() as conn:
+            return conn.execute(
+                "SELECT user_id, username, email, password FROM users WHERE username = ?",
+                (username,)
+            ).fetchone()
+
+    def register(self, username, email, password):
+        """
+        Returns (success_bool, message).
+        """
+        from passwords import hash_password_async
+
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM users WHERE username = ? OR email = ?",
+                (username, email)
+            ).fetchone()
+        if row:
+            return False, "That username or email is already registered."
+
+        # Hash outside the connection so the pool isn't held during the KDF
+        password_hash = hash_password_async(password).result()
+        try:
+            write(lambda conn: conn.execute("""
+                INSERT INTO users (username, email, password)
+                VALUES (?, ?, ?)
+            """, (username, email, password_hash)))
+        except sqlite3.IntegrityError:
+            # Someone registered the same name or email meanwhile
+            return False, "That username or email is already registered."
+        return True, "Registration successful!"
+
+    def sign_in(self, username, password_attempt):
+        """
+        Returns (success_bool, message, user_data).
+        user_data is a tuple: (user_id, username, email, db_password)
+        """
+        from passwords import hash_password_async, verify_password_async
+
+        user_data = self.get_user(username)
+        if not user_data:
+            return False, "No such user found. Please register first.", None
+
+        user_id, db_username, db_email, db_password = user_data
+        matches, needs_rehash = verify_password_async(password_attempt, db_password).result()
+        if not matches:
+            return False, "Incorrect password.", user_data
+
+        if needs_rehash:
+            # Upgrade plaintext or outdated hashes while we know the password
+            new_hash = hash_password_async(password_attempt).result()
+            write(lambda conn: conn.execute(
+                "UPDATE users SET password = ? WHERE user_id = ? AND password = ?",
+                (new_hash, user_id, db_password)
+            ))
+            user_data = (user_id, db_username, db_email, new_hash)
+        return True, "Sign in successful!", user_data
+
+    def reset_password(self, user_id, new_password):
+        """
+        Reset the user's password in the database.
+        """
+        from passwords import hash_password_async
+
+        password_hash = hash_password_async(new_password).result()
+        write(lambda conn: conn.execute(
+            "UPDATE users SET password = ? WHERE user_id = ?",
+            (password_hash, user_id)
+        ))
+        return True
+
+    def send_action_otp(self, user_id, email, action):
+        """
+        Issue a server-side OTP for `action` and queue it for email.
+        Returns (success_bool, error_message).
+        """
+        from email_otp import send_otp_async
+        from otp_service import issue_otp, RateLimited
+
+        try:
+            otp_code = issue_otp(user_id, action)
+        except RateLimited as e:
+            return False, str(e)
+        if send_otp_async(email, otp_code).failed():
+            return False, "Failed to send OTP. Check your email configuration."
+        return True, None
+
+    def check_action_otp(self, user_id, action, otp_attempt):
+        """
+        Verify an OTP for `action`. Returns (result, error_message) where
+        result is VERIFIED, MISMATCH or NO_CODE; rate limiting counts as NO_CODE.
+        """
+        from otp_service import verify_otp, RateLimited, NO_CODE
+
+        try:
+            return verify_otp(user_id, action, otp_attempt), None
+        except RateLimited as e:
+            return NO_CODE, str(e)
+
+    def forgot_password(self, user_id, email):
+        """
+        Issue a password-reset OTP and queue it for email.
+        Returns (success_bool, message).
+        """
+        from otp_service import RESET_PASSWORD
+
+        sent, error = self.send_action_otp(user_id, email, RESET_PASSWORD)
+        if not sent:
+            return False, error
+        return True, "OTP has been sent to your email. Please enter it below:"
+
+    def confirm_password_reset(self, user_id, otp_attempt, new_password):
+        """
+        Verify the reset OTP (single use) and set the new password.
+        Returns (success_bool, message).
+        """
+        from otp_service import RESET_PASSWORD, VERIFIED, NO_CODE
+
+        result, error = self.check_action_otp(user_id, RESET_PASSWORD, otp_attempt)
+        if error:
+            return False, error
+        if result == NO_CODE:
+            return False, "No valid OTP. Click 'Forgot Password?' to get a new one."
+        if result != VERIFIED:
+            return False, "OTP mismatch."
+        self.reset_password(user_id, new_password)
+        return True, "Password has been reset. Please sign in again."
+
+
+supplier_repository = SupplierRepository()
+auth_service = AuthService()
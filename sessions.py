@@ -0,0 +1,284 @@
+# sessions.py
+"""
+Server-side sessions for the Streamlit app.
+
+st.session_state only holds an opaque session id. The id resolves to a
+Principal (user_id, username, email) kept in a process-wide SessionStore,
+an LRU of at most SESSION_MAX_ACTIVE sessions that drops sessions idle for
+SESSION_IDLE_SECONDS. The password hash never leaves the sign-in call.
+When a session ends, is signed out for being idle or is evicted, the
+user's unwrapped data key is dropped from vault_crypto's cache.
+
+Short-lived per-session values (an unmasked password, "export unlocked",
+the batch edit an OTP was sent for) are kept next to the session with
+their own timeout and wiped by a background sweep when it passes, so
+plaintext secrets don't linger in memory. Unmasked passwords last
+SECRET_TTL_SECONDS.
+
+Settings:
+    SESSION_MAX_ACTIVE=10000    sessions kept before the least recently used is dropped
+    SESSION_IDLE_SECONDS=1800   idle time before a session is signed out
+    SECRET_TTL_SECONDS=60       how long an unmasked password stays available
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+import streamlit as st
+
+DEFAULT_MAX_ACTIVE = 10000
+DEFAULT_IDLE_SECONDS = 1800.0
+DEFAULT_SECRET_TTL = 60.0
+# How often the background sweep looks for idle sessions and expired values
+SWEEP_INTERVAL = 5.0
+
+SESSION_KEY = "session_id"
+
+
+class Principal:
+    """
+    The signed-in user, as the views see it.
+    """
+
+    __slots__ = ("user_id", "username", "email")
+
+    def __init__(self, user_id, username, email):
+        self.user_id = user_id
+        self.username = username
+        self.email = email
+
+    def __repr__(self):
+        return f"Principal(user_id={self.user_id!r}, username={self.username!r})"
+
+
+class SessionStore:
+    """
+    Thread-safe map of session id -> Principal with LRU and idle eviction,
+    plus per-session values that expire on their own.
+    """
+
+    def __init__(self, max_active=DEFAULT_MAX_ACTIVE, idle_seconds=DEFAULT_IDLE_SECONDS):
+        self.max_active = max_active
+        self.idle_seconds = idle_seconds
+        self._sessions = OrderedDict()      # session id -> [principal, last used (monotonic)]
+        self._values = {}                   # session id -> {name: (value, expires (monotonic))}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._stats = {"created": 0, "ended": 0, "idle_evictions": 0, "lru_evictions": 0, "values_expired": 0}
+
+    def create(self, principal):
+        """
+        Start a session for `principal`; returns its id.
+        """
+        session_id = secrets.token_urlsafe(32)
+        evicted = []
+        with self._lock:
+            self._sessions[session_id] = [principal, time.monotonic()]
+            self._stats["created"] += 1
+            while len(self._sessions) > self.max_active:
+                evicted.append(self._drop(next(iter(self._sessions))))
+                self._stats["lru_evictions"] += 1
+        _forget_data_keys(evicted)
+        self._start_sweeper()
+        return session_id
+
+    def get(self, session_id):
+        """
+        The session's Principal (marking it as used), or None if the session
+        ended or went idle.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if now - entry[1] <= self.idle_seconds:
+                entry[1] = now
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+            idle = self._drop(session_id)
+            self._stats["idle_evictions"] += 1
+        _forget_data_keys([idle])
+        return None
+
+    def end(self, session_id):
+        with self._lock:
+            if session_id not in self._sessions:
+                return
+            ended = self._drop(session_id)
+            self._stats["ended"] += 1
+        _forget_data_keys([ended])
+
+    def _drop(self, session_id):
+        """
+        Remove the session and its values; returns its Principal. Caller
+        holds self._lock.
+        """
+        self._values.pop(session_id, None)
+        return self._sessions.pop(session_id)[0]
+
+    def put_value(self, session_id, name, value, ttl):
+        """
+        Keep `value` for the session for `ttl` seconds.
+        """
+        with self._lock:
+            if session_id in self._sessions:
+                self._values.setdefault(session_id, {})[name] = (value, time.monotonic() + ttl)
+
+    def get_value(self, session_id, name):
+        """
+        The value, or None if it was never set, was cleared or has expired.
+        """
+        with self._lock:
+            item = self._values.get(session_id, {}).get(name)
+            if item is None:
+                return None
+            if time.monotonic() >= item[1]:
+                self._forget_value(session_id, name)
+                self._stats["values_expired"] += 1
+                return None
+            return item[0]
+
+    def clear_value(self, session_id, name):
+        with self._lock:
+            self._forget_value(session_id, name)
+
+    def _forget_value(self, session_id, name):
+        values = self._values.get(session_id)
+        if values is not None:
+            values.pop(name, None)
+            if not values:
+                del self._values[session_id]
+
+    def sweep(self):
+        """
+        Drop idle sessions and expired values. Returns how many of each.
+        """
+        now = time.monotonic()
+        dropped = []
+        expired = 0
+        with self._lock:
+            # Least recently used first, so stop at the first active session
+            while self._sessions:
+                session_id, (_, last_used) = next(iter(self._sessions.items()))
+                if now - last_used <= self.idle_seconds:
+                    break
+                dropped.append(self._drop(session_id))
+            for session_id in list(self._values):
+                for name, (_, expires) in list(self._values[session_id].items()):
+                    if now >= expires:
+                        self._forget_value(session_id, name)
+                        expired += 1
+            self._stats["idle_evictions"] += len(dropped)
+            self._stats["values_expired"] += expired
+        _forget_data_keys(dropped)
+        return len(dropped), expired
+
+    def _start_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_forever, name="session-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(SWEEP_INTERVAL)
+            self.sweep()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["active"] = len(self._sessions)
+            snapshot["sessions_with_values"] = len(self._values)
+        return snapshot
+
+
+def _forget_data_keys(principals):
+    """
+    Drop the cached data keys of users whose session ended. Another open
+    session of the same user just unwraps the key again on its next read.
+    """
+    from vault_crypto import forget_data_key
+
+    for principal in principals:
+        forget_data_key(principal.user_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SessionStore(
+                    max_active=int(os.getenv("SESSION_MAX_ACTIVE", DEFAULT_MAX_ACTIVE)),
+                    idle_seconds=float(os.getenv("SESSION_IDLE_SECONDS", DEFAULT_IDLE_SECONDS)),
+                )
+    return _store
+
+
+def secret_ttl():
+    return float(os.getenv("SECRET_TTL_SECONDS", DEFAULT_SECRET_TTL))
+
+
+# -- Streamlit helpers --------------------------------------------------------
+
+def start_session(user_row):
+    """
+    Sign the browser session in as the user of a users row
+    (user_id, username, email, password_hash). Returns the Principal.
+    """
+    end_session()
+    user_id, username, email = user_row[:3]
+    principal = Principal(user_id, username, email)
+    st.session_state[SESSION_KEY] = get_session_store().create(principal)
+    return principal
+
+
+def current_principal():
+    """
+    The signed-in Principal, or None. A session that went idle is signed
+    out here.
+    """
+    session_id = st.session_state.get(SESSION_KEY)
+    if session_id is None:
+        return None
+    principal = get_session_store().get(session_id)
+    if principal is None:
+        st.session_state[SESSION_KEY] = None
+    return principal
+
+
+def end_session():
+    session_id = st.session_state.get(SESSION_KEY)
+    if session_id is not None:
+        get_session_store().end(session_id)
+        st.session_state[SESSION_KEY] = None
+
+
+def put_value(name, value, ttl):
+    """
+    Keep a short-lived value for the current session (see SessionStore.put_value).
+    """
+    session_id = st.session_state.get(SESSION_KEY)
+    if session_id is not None:
+        get_session_store().put_value(session_id, name, value, ttl)
+
+
+def get_value(name):
+    session_id = st.session_state.get(SESSION_KEY)
+    if session_id is None:
+        return None
+    return get_session_store().get_value(session_id, name)
+
+
+def clear_value(name):
+    session_id = st.session_state.get(SESSION_KEY)
+    if session_id is not None:
+        get_session_store().clear_value(session_id, name)
@@ -0,0 +1,190 @@
+# sharding.py
+"""
+Maintenance tools for STORAGE_MODE=sharded (see database.py).
+
+    python sharding.py split [--keep]          # move suppliers out of DB_PATH into shards
+    python sharding.py backup [--label NAME]   # snapshot the directory and every shard
+    python sharding.py status                  # shard count, size and supplier rows
+
+split turns an existing single-file database into the sharded layout:
+every owner's suppliers are copied to SHARD_DIR/owner_<id>.db, the copy is
+checked row for row, and the suppliers are then removed from DB_PATH,
+which keeps users, OTPs and scheduler state as the directory database.
+Stop the app first, run split, then restart it with STORAGE_MODE=sharded.
+
+backup is `python backup.py snapshot`: one snapshot of the directory
+database, every shard and the audit log in BACKUP_DIR, checked and
+rotated like any other. Use backup.py to list, verify, restore and
+prune them.
+
+Reminders work across shards without extra steps: `python scheduler.py`
+and `python main.py report` read every shard.
+"""
+import argparse
+import os
+import sys
+from database import (
+    ShardRouter,
+    _db_settings,
+    create_connection,
+    get_connection,
+    get_router,
+    init_db,
+    migrate,
+)
+
+SPLIT_BATCH_SIZE = 5000
+
+
+def split(db_path, shard_dir, keep=False, progress=None):
+    """
+    Copy every owner's suppliers from the single-file database at db_path
+    into their own shard under shard_dir, then delete them from db_path
+    (unless keep=True), along with their rotation defaults and password
+    audit scores. supplier_id values are preserved.
+    Returns {owner_user_id: rows copied}.
+    """
+    source = create_connection(db_path)
+    if source is None:
+        raise RuntimeError(f"Could not open {db_path}.")
+    router = ShardRouter(shard_dir, max_open=4, pool_size=1)
+    try:
+        if router.owners():
+            raise RuntimeError(f"{shard_dir} already holds shards; refusing to split into it.")
+        migrate(source, db_path)
+
+        backup_path = f"{db_path}.presplit.bak"
+        target = create_connection(backup_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+        print(f"Backed up {db_path} to {backup_path}.")
+
+        columns = [row[1] for row in source.execute("PRAGMA table_info(suppliers)")]
+        column_list = ", ".join(columns)
+        insert_sql = f"INSERT INTO suppliers ({column_list}) VALUES ({', '.join('?' * len(columns))})"
+        owners = [row[0] for row in source.execute(
+            "SELECT DISTINCT owner_user_id FROM suppliers ORDER BY owner_user_id"
+        )]
+
+        copied = {}
+        for done, owner in enumerate(owners, 1):
+            cursor = source.execute(
+                f"SELECT {column_list} FROM suppliers WHERE owner_user_id = ? ORDER BY supplier_id", (owner,)
+            )
+            with router.connection(owner) as shard:
+                shard.execute("BEGIN IMMEDIATE")
+                while True:
+                    rows = cursor.fetchmany(SPLIT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    shard.executemany(insert_sql, rows)
+                # Audit scores of the owner's passwords: backfill only scores
+                # rows without a fingerprint, so it wouldn't fill them in
+                strength = source.execute("""
+                    SELECT fingerprint, score, reasons FROM password_strength
+                    WHERE fingerprint IN (
+                        SELECT password_fp FROM suppliers WHERE owner_user_id = ?
+                    )
+                """, (owner,))
+                while True:
+                    rows = strength.fetchmany(SPLIT_BATCH_SIZE)
+                    if not rows:
+                        break
+                    shard.executemany(
+                        "INSERT OR IGNORE INTO password_strength (fingerprint, score, reasons) "
+                        "VALUES (?, ?, ?)", rows
+                    )
+                # After the suppliers, which already carry the inherited values
+                defaults = source.execute(
+                    "SELECT rotation_days, warning_days FROM rotation_defaults WHERE owner_user_id = ?", (owner,)
+                ).fetchone()
+                if defaults:
+                    shard.execute(
+                        "INSERT OR REPLACE INTO rotation_defaults (owner_user_id, rotation_days, warning_days) "
+                        "VALUES (?, ?, ?)", (owner,) + tuple(defaults)
+                    )
+                copied[owner] = shard.execute(
+                    "SELECT COUNT(*) FROM suppliers WHERE owner_user_id = ?", (owner,)
+                ).fetchone()[0]
+            expected = source.execute(
+                "SELECT COUNT(*) FROM suppliers WHERE owner_user_id = ?", (owner,)
+            ).fetchone()[0]
+            if copied[owner] != expected:
+                raise RuntimeError(f"Shard of user {owner} has {copied[owner]} suppliers, expected {expected}.")
+            if progress:
+                progress(done, len(owners))
+
+        if not keep:
+            source.execute("BEGIN IMMEDIATE")
+            source.execute("DELETE FROM suppliers")
+            source.execute("DELETE FROM rotation_defaults")
+            source.execute("DELETE FROM password_strength")
+            source.commit()
+            source.execute("VACUUM")
+        return copied
+    finally:
+        router.close()
+        source.close()
+
+
+def status():
+    """
+    {"shards", "bytes", "suppliers", "largest": [(owner, bytes), ...]}.
+    """
+    router = get_router()
+    if router is None:
+        raise RuntimeError("STORAGE_MODE is not 'sharded'.")
+    sizes = []
+    suppliers = 0
+    for owner in router.owners():
+        sizes.append((owner, os.path.getsize(router.shard_path(owner))))
+        with get_connection(owner) as conn:
+            suppliers += conn.execute("SELECT COUNT(*) FROM suppliers").fetchone()[0]
+    sizes.sort(key=lambda item: item[1], reverse=True)
+    return {
+        "shards": len(sizes),
+        "bytes": sum(size for _, size in sizes),
+        "suppliers": suppliers,
+        "largest": sizes[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded storage maintenance.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("split", help="move suppliers from DB_PATH into per-owner shards")
+    p.add_argument("--keep", action="store_true", help="leave the suppliers in DB_PATH as well")
+    p = commands.add_parser("backup", help="snapshot the directory database and all shards")
+    p.add_argument("--label", help="name suffix; labelled snapshots are never rotated out")
+    commands.add_parser("status", help="summarize the shards")
+    args = parser.parse_args()
+
+    settings = _db_settings()
+    try:
+        if args.command == "split":
+            copied = split(settings["path"], settings["shard_dir"], keep=args.keep,
+                           progress=lambda done, total: print(f"\r{done}/{total} owners", end=""))
+            print(f"\nDone. {sum(copied.values())} suppliers of {len(copied)} users moved to "
+                  f"{settings['shard_dir']}. Set STORAGE_MODE=sharded to use them.")
+        elif args.command == "backup":
+            import backup
+            init_db()
+            path = backup.snapshot(label=args.label)
+            removed = backup.rotate()
+            print(f"Snapshot written to {path}." + (f" Rotated out {len(removed)}." if removed else ""))
+        else:
+            info = status()
+            print(f"{info['shards']} shards, {info['suppliers']} suppliers, "
+                  f"{info['bytes'] / 1024 / 1024:.1f} MB")
+            for owner, size in info["largest"]:
+                print(f"  user {owner}: {size / 1024 / 1024:.1f} MB")
+    except (RuntimeError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# smtp_stub.py
+"""
+A tiny in-process SMTP server for local runs, benchmarks and load tests.
+
+It speaks just enough SMTP for smtplib (EHLO/HELO, AUTH PLAIN/LOGIN,
+MAIL, RCPT, DATA, RSET, NOOP, QUIT), never uses TLS and keeps every
+accepted message in memory:
+
+    with LocalSMTPServer() as smtp:
+        os.environ["EMAIL_HOST"], os.environ["EMAIL_PORT"] = smtp.host, str(smtp.port)
+        os.environ["EMAIL_USE_TLS"] = "0"
+        ...
+        smtp.messages[-1]["body"]
+"""
+import email
+import re
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+    def _reply(self, line):
+        self.wfile.write((line + "\r\n").encode("ascii"))
+
+    def handle(self):
+        server = self.server.owner
+        with server._lock:
+            server.connections += 1
+        if server.delay:
+            time.sleep(server.delay)
+        self._reply("220 localhost smtp_stub ready")
+        mail_from, rcpt_to = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            command = line.split(" ", 1)[0].upper()
+            argument = line[len(command):].strip()
+
+            if command == "EHLO":
+                self._reply("250-localhost")
+                self._reply("250-AUTH PLAIN LOGIN")
+                self._reply("250 8BITMIME")
+            elif command == "HELO":
+                self._reply("250 localhost")
+            elif command == "AUTH":
+                if argument.upper().startswith("LOGIN"):
+                    # smtplib sends username and password as two continuation lines
+                    self._reply("334 VXNlcm5hbWU6")
+                    self.rfile.readline()
+                    self._reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                self._reply("235 Authentication successful")
+            elif command == "MAIL":
+                mail_from, rcpt_to = argument, []
+                self._reply("250 OK")
+            elif command == "RCPT":
+                rcpt_to.append(re.sub(r"^TO:\s*", "", argument, flags=re.I).strip("<>"))
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line in (b".\r\n", b".\n"):
+                        break
+                    if data_line.startswith(b".."):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                server._store(mail_from, rcpt_to, b"".join(lines))
+                mail_from, rcpt_to = None, []
+                self._reply("250 OK queued")
+            elif command in ("RSET", "NOOP"):
+                self._reply("250 OK")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class LocalSMTPServer:
+    """
+    Threaded SMTP stand-in bound to localhost. Port 0 picks a free port.
+    `delay` adds latency to every new connection to mimic a slow relay.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, delay=0.0):
+        self.delay = delay
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._server = _ThreadingTCPServer((host, port), _SMTPHandler)
+        self._server.owner = self
+        self.host, self.port = self._server.server_address[:2]
+        self._thread = None
+
+    def _store(self, mail_from, rcpt_to, data):
+        parsed = email.message_from_bytes(data)
+        body = ""
+        for part in parsed.walk():
+            if part.get_content_type() == "text/plain":
+                body = part.get_payload(decode=True).decode("utf-8", "replace")
+                break
+        with self._condition:
+            self.messages.append({
+                "from": mail_from,
+                "to": list(rcpt_to),
+                "subject": parsed.get("Subject"),
+                "body": body,
+            })
+            self._condition.notify_all()
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="smtp-stub", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def wait_for(self, count, timeout=10.0):
+        """
+        Block until at least `count` messages have arrived.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self.messages) >= count, timeout)
+
+    def last_message_to(self, address):
+        with self._lock:
+            for message in reversed(self.messages):
+                if address in message["to"]:
+                    return message
+        return None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
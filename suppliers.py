@@ -1,121 +1,170 @@
-from datetime import datetime, timedelta
-import csv
-import unicodedata
+import hashlib
+import tempfile
 import streamlit as st
-from database import create_connection
-from email_otp import generate_otp, send_otp_via_email
+import sessions
+from services import (
+    supplier_repository, auth_service, BulkUpdateError,
+    PICKER_PAGE_SIZE, EDITABLE_FIELDS, BULK_EDIT_MAX,
+)
+from exporter import CSV, JSONL, export_file_name, write_export
+from utils import remove_invisible_chars
+from otp_service import (
+    VERIFIED, MISMATCH, NO_CODE,
+    UNMASK, MODIFY, DELETE_ONE, DELETE_ALL, EXPORT, BULK_MODIFY,
+    get_otp_service,
+)
+
+# Streamlit views over services.SupplierRepository; no SQL in this module.
+
+# Short-lived values kept in the server-side session store (sessions.py)
+UNMASKED_PASSWORD = "unmasked_password"
+EXPORT_UNLOCKED = "export_unlocked"
+BATCH_EDIT_PENDING = "batch_edit_pending"
+
+
+def send_action_otp(principal, action):
+    """
+    Issue a server-side OTP for `action` and queue it for the user's email.
+    Shows an error and returns False if rate limited or sending failed.
+    """
+    sent, error = auth_service.send_action_otp(principal.user_id, principal.email, action)
+    if not sent:
+        st.error(error)
+    return sent
 
-def parse_datetime(dt_string):
-    try:
-        return datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S.%f")  # with microseconds
-    except ValueError:
-        return datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S")    # without microseconds
 
-def view_supplier_details(current_user):
+def check_action_otp(user_id, action, user_otp, send_label):
     """
-    Display all supplier details for this user.
-    Allows toggling password masking after OTP verification.
+    Verify an OTP for `action`. Shows an error for missing/expired codes and
+    rate limiting; returns VERIFIED, MISMATCH or NO_CODE.
     """
-    user_id, username, email, _ = current_user
+    result, error = auth_service.check_action_otp(user_id, action, user_otp)
+    if error:
+        st.error(error)
+    elif result == NO_CODE:
+        st.error(f"No valid OTP. Click '{send_label}' to get a new one.")
+    return result
 
-    conn = create_connection()
-    cursor = conn.cursor()
 
-    cursor.execute("""
-        SELECT supplier_id, supplier_name, office_id, user_id, password, url, last_reset
-        FROM suppliers
-        WHERE owner_user_id = ?
-    """, (user_id,))
-    suppliers = cursor.fetchall()
+def supplier_picker(owner_user_id, label, key):
+    """
+    Search box plus a paged selectbox of matching suppliers.
+    Returns the selected supplier_id, or None if nothing matches.
+    """
+    query = st.text_input("Search suppliers (name, office ID, user ID or URL):", key=f"{key}_query")
+
+    # Stack of keyset cursors for the pages visited so far; reset on a new search
+    pages_key = f"{key}_pages"
+    if st.session_state.get(f"{key}_last_query") != query or pages_key not in st.session_state:
+        st.session_state[pages_key] = [None]
+        st.session_state[f"{key}_last_query"] = query
+    pages = st.session_state[pages_key]
+
+    rows = supplier_repository.search(owner_user_id, query, after=pages[-1], limit=PICKER_PAGE_SIZE + 1)
+    has_next = len(rows) > PICKER_PAGE_SIZE
+    rows = rows[:PICKER_PAGE_SIZE]
+
+    if not rows:
+        st.write("No suppliers match your search.")
+        return None
+
+    labels = {
+        sup_id: f"{sup_id} - {sup_name}" + (f" ({sup_user_id})" if sup_user_id else "")
+        for sup_id, sup_name, sup_user_id in rows
+    }
+    selected_id = st.selectbox(label, list(labels), format_func=labels.get, key=f"{key}_select")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(pages) > 1 and st.button("Previous page", key=f"{key}_prev"):
+            pages.pop()
+            st.rerun()
+    with col2:
+        if has_next and st.button("Next page", key=f"{key}_next"):
+            last_id, last_name, _ = rows[-1]
+            pages.append((last_name, last_id))
+            st.rerun()
+
+    return selected_id
 
-    conn.close()
+def view_supplier_details(current_user):
+    """
+    Display all supplier details for this user.
+    Allows toggling password masking after OTP verification.
+    """
+    user_id = current_user.user_id
 
-    if not suppliers:
+    if not supplier_repository.has_suppliers(user_id):
         st.write("No suppliers added yet.")
         return
 
-    # Show them in a selectbox
-    options = [f"{s[0]} - {s[1]}" for s in suppliers]  # "supplier_id - supplier_name"
-    selected_option = st.selectbox("Select a supplier to view details:", options)
-
-    # Parse out the supplier_id from the string
-    selected_supplier_id = int(selected_option.split(" - ")[0])
+    selected_supplier_id = supplier_picker(user_id, "Select a supplier to view details:", key="view_picker")
+    if selected_supplier_id is None:
+        return
 
     # Retrieve the selected supplier row
-    chosen = [s for s in suppliers if s[0] == selected_supplier_id]
+    chosen = supplier_repository.get(user_id, selected_supplier_id)
     if not chosen:
         st.write("Supplier not found.")
         return
 
-    sup_id, sup_name, office_id, sup_user_id, pw, url, last_reset = chosen[0]
+    (sup_id, sup_name, office_id, sup_user_id, pw_length, url, last_reset,
+     reminder_at, expires_at, rotation_days, warning_days) = chosen
 
     st.subheader(f"Supplier: {sup_name}")
     st.write(f"Office ID: {office_id if office_id else 'Not Provided'}")
     st.write(f"User ID: {sup_user_id}")
 
     # By default, mask the password
-    masked_pw = "*" * len(pw)
+    masked_pw = "*" * (pw_length or 0)
     st.write(f"Password: {masked_pw}")
     st.write(f"Site URL: {url}")
-    st.write(f"Last Reset: {last_reset if last_reset else 'Not set'}")
+    st.write(f"Last Reset: {last_reset + ' UTC' if last_reset else 'Not set'}")
 
-    # Show reset reminder if there's a last_reset
-    if last_reset:
-        from datetime import datetime, timedelta
-        def parse_datetime(dt_string):
-            try:
-                return datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S.%f")  # microseconds
-            except ValueError:
-                return datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S")    # no microseconds
-
-        last_reset_dt = parse_datetime(last_reset)
-        next_reset_dt = last_reset_dt + timedelta(days=30)
-        reminder_dt = next_reset_dt - timedelta(days=7)
-        st.write(f"Password Reset Reminder: {reminder_dt}")
+    if rotation_days:
+        st.write(f"Rotation Policy: every {rotation_days} days, reminder {warning_days} days before")
+    else:
+        st.write("Rotation Policy: never expires")
+
+    # Show reset reminder if there's a last_reset and the password expires
+    if reminder_at:
+        st.write(f"Password Reset Reminder: {reminder_at} UTC")
+        st.write(f"Password Expires: {expires_at} UTC")
     else:
         st.write("Password Reset Reminder: Not set")
 
     # -----------
     # UNMASK FLOW
     # -----------
-    # We store OTP in st.session_state to persist across re-runs
-    if "unmask_otp" not in st.session_state:
-        st.session_state.unmask_otp = None
-    if "unmasked_password" not in st.session_state:
-        st.session_state.unmasked_password = None
-
+    # OTPs live in otp_service; the unmasked result is kept in the session
+    # store for a short while, tied to this supplier
     st.write("---")
     st.write("**Toggle Password Masking (requires OTP):**")
 
     # Step A: Send OTP
     if st.button("Send OTP to Unmask Password"):
-        otp_code = generate_otp()
-        if send_otp_via_email(email, otp_code):
-            st.session_state.unmask_otp = otp_code
-            st.session_state.unmasked_password = None  # reset any previously unmasked password
-            st.success("OTP sent! Please enter it below to unmask the password.")
-        else:
-            st.error("Failed to send OTP. Check your email configuration.")
+        if send_action_otp(current_user, UNMASK):
+            sessions.clear_value(UNMASKED_PASSWORD)  # reset any previously unmasked password
+            st.success("OTP is on its way! Please enter it below to unmask the password.")
 
     # Step B: User enters OTP
     user_otp = st.text_input("Enter OTP:", type="password")
 
     # Step C: Confirm Unmask
     if st.button("Confirm Unmask"):
-        if not st.session_state.unmask_otp:
-            st.error("No OTP was sent. Please click 'Send OTP to Unmask Password' first.")
-        else:
-            if user_otp == st.session_state.unmask_otp:
-                st.success("OTP verified. Password unmasked below.")
-                st.session_state.unmasked_password = pw
-                # Clear the stored OTP so user can't re-use
-                st.session_state.unmask_otp = None
-            else:
-                st.error("OTP mismatch. Password remains masked.")
+        result = check_action_otp(user_id, UNMASK, user_otp, "Send OTP to Unmask Password")
+        if result == VERIFIED:
+            st.success("OTP verified. Password unmasked below.")
+            sessions.put_value(UNMASKED_PASSWORD, (sup_id, supplier_repository.get_password(user_id, sup_id)),
+                               sessions.secret_ttl())
+        elif result == MISMATCH:
+            st.error("OTP mismatch. Password remains masked.")
 
     # Display unmasked password if we have it
-    if st.session_state.unmasked_password:
-        st.write(f"**Unmasked Password:** {st.session_state.unmasked_password}")
+    unmasked = sessions.get_value(UNMASKED_PASSWORD)
+    if unmasked and unmasked[0] == sup_id:
+        st.write(f"**Unmasked Password:** {unmasked[1]}")
+        st.caption(f"Masked again after {sessions.secret_ttl():.0f} seconds.")
 
 
 def modify_supplier_details(current_user):
@@ -123,31 +172,25 @@ def modify_supplier_details(current_user):
     Modify or delete suppliers. Also supports deleting all suppliers,
     using a two-step OTP flow for both single and all-supplier deletion.
     """
-    user_id, username, email, _ = current_user
-    conn = create_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT supplier_id, supplier_name 
-        FROM suppliers
-        WHERE owner_user_id = ?
-    """, (user_id,))
-    suppliers_list = cursor.fetchall()
-
-    if not suppliers_list:
+    user_id = current_user.user_id
+
+    if not supplier_repository.has_suppliers(user_id):
         st.write("No suppliers added yet.")
-        conn.close()
         return
 
     st.subheader("Modify Supplier Details")
 
-    # Create a list of strings "ID - Name"
-    supplier_opts = [f"{s[0]} - {s[1]}" for s in suppliers_list]
-    selected_opt = st.selectbox("Select supplier:", supplier_opts)
-    sup_id = int(selected_opt.split(" - ")[0])
+    # Radio to pick "Modify", "Delete", "Delete All" or "Batch Edit"
+    operation = st.radio("Choose an operation:", ["Modify", "Delete", "Delete All", "Batch Edit"])
+    if operation == "Batch Edit":
+        batch_edit_suppliers(current_user)
+        return
+
+    sup_id = supplier_picker(user_id, "Select supplier:", key="modify_picker")
 
-    # Radio to pick "Modify", "Delete", or "Delete All"
-    operation = st.radio("Choose an operation:", ["Modify", "Delete", "Delete All"])
+    if sup_id is None and operation != "Delete All":
+        st.write("Search for a supplier above to modify or delete it.")
+        return
 
     # --------------------------
     # 1) MODIFY SUPPLIER
@@ -160,43 +203,24 @@ def modify_supplier_details(current_user):
         new_val = st.text_input("Enter new value:")
 
         # STEP A: Send OTP
-        if "modify_otp" not in st.session_state:
-            st.session_state.modify_otp = None
-
         if st.button("Send OTP to Modify"):
-            otp_code = generate_otp()
-            if send_otp_via_email(email, otp_code):
-                st.session_state.modify_otp = otp_code
-                st.success("OTP sent! Enter it below to confirm the modification.")
-            else:
-                st.error("Failed to send OTP. Please check email configuration.")
+            if send_action_otp(current_user, MODIFY):
+                st.success("OTP is on its way! Enter it below to confirm the modification.")
 
         # STEP B: Prompt user for OTP
         user_otp = st.text_input("Enter OTP for modifying supplier:", type="password")
 
         # STEP C: Confirm modification
         if st.button("Confirm Modification"):
-            if not st.session_state.modify_otp:
-                st.error("No OTP was sent yet. Click 'Send OTP to Modify' first.")
-            else:
-                if user_otp == st.session_state.modify_otp:
-                    # Perform update
-                    if field_choice == 'password':
-                        cursor.execute(
-                            f"UPDATE suppliers SET {field_choice} = ?, last_reset = ? WHERE supplier_id = ?",
-                            (new_val, str(datetime.now()), sup_id)
-                        )
-                    else:
-                        cursor.execute(
-                            f"UPDATE suppliers SET {field_choice} = ? WHERE supplier_id = ?",
-                            (new_val, sup_id)
-                        )
-                    conn.commit()
-                    st.success(f"{field_choice} updated successfully.")
-                    # Clear the OTP from session
-                    st.session_state.modify_otp = None
+            result = check_action_otp(user_id, MODIFY, user_otp, "Send OTP to Modify")
+            if result == VERIFIED:
+                updated, msg = supplier_repository.update_field(user_id, sup_id, field_choice, new_val)
+                if updated:
+                    st.success(msg)
                 else:
-                    st.error("OTP mismatch. No changes made.")
+                    st.error(msg)
+            elif result == MISMATCH:
+                st.error("OTP mismatch. No changes made.")
 
     # --------------------------
     # 2) DELETE SINGLE SUPPLIER
@@ -205,32 +229,21 @@ def modify_supplier_details(current_user):
         st.write(f"You've chosen to delete supplier ID {sup_id}.")
 
         # STEP A: Send OTP
-        if "delete_one_otp" not in st.session_state:
-            st.session_state.delete_one_otp = None
-
         if st.button("Send OTP for Deletion"):
-            otp_code = generate_otp()
-            if send_otp_via_email(email, otp_code):
-                st.session_state.delete_one_otp = otp_code
+            if send_action_otp(current_user, DELETE_ONE):
                 st.success("OTP sent to your email. Enter it below to confirm deletion.")
-            else:
-                st.error("Failed to send OTP.")
 
         # STEP B: Prompt user for OTP
         user_otp = st.text_input("Enter OTP to confirm single-supplier deletion:", type="password")
 
         # STEP C: Confirm deletion
         if st.button("Confirm Deletion"):
-            if not st.session_state.delete_one_otp:
-                st.error("No OTP was sent. Click 'Send OTP for Deletion' first.")
-            else:
-                if user_otp == st.session_state.delete_one_otp:
-                    cursor.execute("DELETE FROM suppliers WHERE supplier_id = ?", (sup_id,))
-                    conn.commit()
-                    st.success("Supplier deleted successfully.")
-                    st.session_state.delete_one_otp = None
-                else:
-                    st.error("OTP mismatch. Supplier not deleted.")
+            result = check_action_otp(user_id, DELETE_ONE, user_otp, "Send OTP for Deletion")
+            if result == VERIFIED:
+                supplier_repository.delete(user_id, sup_id)
+                st.success("Supplier deleted successfully.")
+            elif result == MISMATCH:
+                st.error("OTP mismatch. Supplier not deleted.")
 
     # --------------------------
     # 3) DELETE ALL SUPPLIERS
@@ -241,18 +254,11 @@ def modify_supplier_details(current_user):
         # Extra reconfirmation step
         confirm_delete_all = st.checkbox("I confirm that I want to DELETE ALL suppliers.")
 
-        if "delete_all_otp" not in st.session_state:
-            st.session_state.delete_all_otp = None
-
         # Only allow sending OTP if user checks the box
         if confirm_delete_all:
             if st.button("Send OTP to Delete All"):
-                otp_code = generate_otp()
-                if send_otp_via_email(email, otp_code):
-                    st.session_state.delete_all_otp = otp_code
+                if send_action_otp(current_user, DELETE_ALL):
                     st.success("OTP has been sent. Enter it below to confirm.")
-                else:
-                    st.error("Failed to send OTP.")
         else:
             st.info("Check the box above to confirm you want to delete ALL suppliers.")
 
@@ -262,79 +268,142 @@ def modify_supplier_details(current_user):
             if not confirm_delete_all:
                 st.error("Please check the confirmation box above first.")
             else:
-                if not st.session_state.delete_all_otp:
-                    st.error("No OTP was sent yet. Click 'Send OTP to Delete All'.")
-                else:
-                    if user_otp == st.session_state.delete_all_otp:
-                        cursor.execute("DELETE FROM suppliers WHERE owner_user_id = ?", (user_id,))
-                        conn.commit()
-                        st.success("All suppliers have been deleted.")
-                        del st.session_state.delete_all_otp
-                    else:
-                        st.error("OTP mismatch. No suppliers were deleted.")
+                result = check_action_otp(user_id, DELETE_ALL, user_otp, "Send OTP to Delete All")
+                if result == VERIFIED:
+                    supplier_repository.delete_all(user_id)
+                    st.success("All suppliers have been deleted.")
+                elif result == MISMATCH:
+                    st.error("OTP mismatch. No suppliers were deleted.")
 
-    conn.close()
 
+# Rows shown in the batch edit preview
+BATCH_PREVIEW_ROWS = 100
 
-def remove_invisible_chars(s: str) -> str:
+
+def batch_edit_suppliers(current_user):
     """
-    Remove (or normalize away) invisible Unicode characters such as \u202A
+    Apply the same field changes to many suppliers at once, confirmed by a
+    single OTP and written in one all-or-nothing transaction.
     """
-    filtered = "".join(ch for ch in s if ch.isprintable())
-    filtered = unicodedata.normalize('NFKC', filtered)
-    return filtered
+    user_id = current_user.user_id
+
+    # STEP 1: choose the suppliers
+    mode = st.radio("Select suppliers by:", ["Filter", "Pick from list"])
+    if mode == "Filter":
+        filter_text = st.text_input("Filter (name, office ID, user ID or URL; empty = all suppliers):")
+        selected_ids = supplier_repository.match_ids(user_id, filter_text)
+    else:
+        query = st.text_input("Search suppliers to pick from:")
+        rows = supplier_repository.search(user_id, query, limit=BULK_EDIT_MAX)
+        labels = {
+            sup_id: f"{sup_id} - {sup_name}" + (f" ({sup_user_id})" if sup_user_id else "")
+            for sup_id, sup_name, sup_user_id in rows
+        }
+        selected_ids = st.multiselect("Suppliers:", list(labels), format_func=labels.get)
+
+    if not selected_ids:
+        st.write("No suppliers selected.")
+        return
+    if len(selected_ids) >= BULK_EDIT_MAX:
+        st.warning(f"Only the first {BULK_EDIT_MAX} matching suppliers are included.")
+
+    # STEP 2: choose the changes
+    fields = st.multiselect("Fields to change:", list(EDITABLE_FIELDS))
+    changes = {}
+    for field in fields:
+        changes[field] = st.text_input(
+            f"New {field}:", type="password" if field == "password" else "default", key=f"batch_{field}"
+        )
+    if not changes:
+        st.write("Choose at least one field to change.")
+        return
+
+    # STEP 3: preview
+    try:
+        preview = supplier_repository.preview_bulk_update(user_id, selected_ids, changes, limit=BATCH_PREVIEW_ROWS)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.write(f"**{len(selected_ids)} suppliers will be changed.**")
+    st.dataframe([
+        dict({"ID": sup_id, "Supplier": sup_name, "User ID": sup_user_id},
+             **{field: f"{old} -> {new}" for field, (old, new) in diff.items()})
+        for sup_id, sup_name, sup_user_id, diff in preview
+    ])
+    if len(selected_ids) > BATCH_PREVIEW_ROWS:
+        st.caption(f"Showing the first {BATCH_PREVIEW_ROWS} of {len(selected_ids)}.")
+
+    # The OTP confirms this exact batch: any change to the selection or values
+    # needs a new one. Only a digest is kept, so a new password isn't held in memory
+    batch = hashlib.sha256(repr((tuple(selected_ids), tuple(sorted(changes.items())))).encode()).hexdigest()
+
+    if st.button("Send OTP for Batch Edit"):
+        if send_action_otp(current_user, BULK_MODIFY):
+            sessions.put_value(BATCH_EDIT_PENDING, batch, get_otp_service().ttl)
+            st.success("OTP is on its way! Enter it below to apply the batch edit.")
+
+    user_otp = st.text_input("Enter OTP to confirm the batch edit:", type="password")
+
+    if st.button("Apply Batch Edit"):
+        if sessions.get_value(BATCH_EDIT_PENDING) != batch:
+            st.error("The selection or values changed since the OTP was sent. Send a new OTP.")
+            return
+        result = check_action_otp(user_id, BULK_MODIFY, user_otp, "Send OTP for Batch Edit")
+        if result == VERIFIED:
+            sessions.clear_value(BATCH_EDIT_PENDING)
+            try:
+                count = supplier_repository.bulk_update(user_id, selected_ids, changes)
+                st.success(f"{count} suppliers updated.")
+            except (BulkUpdateError, ValueError) as e:
+                st.error(str(e))
+        elif result == MISMATCH:
+            st.error("OTP mismatch. No changes made.")
+
 
 def add_new_suppliers(current_user):
     """
     Add new suppliers either by CSV or manually.
     """
-    user_id, username, email, _ = current_user
-    conn = create_connection()
-    cursor = conn.cursor()
+    user_id = current_user.user_id
 
     st.subheader("Add New Suppliers")
     import_method = st.radio("Import Method", ["CSV", "Manual"])
 
     if import_method == "CSV":
-        csv_path = st.text_input("Enter the full path of the CSV file:")
+        uploaded_file = st.file_uploader("Upload a CSV file:", type=["csv"])
+        csv_path = st.text_input("Or enter the full path of a CSV file on the server:")
         if st.button("Import CSV"):
-            csv_path = remove_invisible_chars(csv_path)
+            progress_bar = st.progress(0.0, text="Importing suppliers...")
+
+            def on_progress(fraction, summary):
+                text = f"Processed {summary['rows']} rows ({summary['inserted']} inserted)"
+                progress_bar.progress(fraction if fraction is not None else 0.0, text=text)
+
             try:
-                with open(csv_path, 'r', encoding='utf-8-sig') as file:
-                    reader = csv.DictReader(file)
-                    for row in reader:
-                        supplier_name = row.get("Supplier Name", "").strip()
-                        office_id = row.get("Office ID", "").strip()
-                        supplier_user_id = row.get("User ID", "").strip()
-                        password = row.get("Password", "").strip()
-                        url = row.get("URL", "").strip()
-
-                        if not supplier_name or not password:
-                            # Minimal check - must have at least name & password
-                            continue
-
-                        # Duplicate check
-                        cursor.execute("""
-                            SELECT 1 FROM suppliers
-                            WHERE owner_user_id = ?
-                              AND supplier_name = ?
-                              AND user_id = ?
-                        """, (user_id, supplier_name, supplier_user_id))
-                        existing = cursor.fetchone()
-                        if existing:
-                            st.write(f"Supplier '{supplier_name}' with UserID '{supplier_user_id}' already exists. Skipping...")
-                            continue
-
-                        # Insert
-                        cursor.execute("""
-                            INSERT INTO suppliers
-                              (supplier_name, office_id, user_id, password, url, last_reset, owner_user_id) 
-                            VALUES (?, ?, ?, ?, ?, DATETIME('now'), ?)
-                        """, (supplier_name, office_id, supplier_user_id, password, url, user_id))
-                    conn.commit()
-                st.write("Suppliers imported successfully from CSV.")
+                if uploaded_file is not None:
+                    summary = supplier_repository.import_csv(
+                        user_id, uploaded_file, total_bytes=uploaded_file.size, progress=on_progress
+                    )
+                elif csv_path:
+                    csv_path = remove_invisible_chars(csv_path)
+                    summary = supplier_repository.import_csv_path(user_id, csv_path, progress=on_progress)
+                else:
+                    st.write("Upload a CSV file or enter a path first.")
+                    summary = None
             except Exception as e:
-                st.write(f"Error importing from CSV: {e}")
+                st.write(f"Error importing from CSV: {e}. Suppliers imported before the error "
+                         f"were kept; importing the file again skips them.")
+                summary = None
+
+            if summary is not None:
+                progress_bar.progress(1.0, text="Import finished.")
+                st.write(
+                    f"Suppliers imported from CSV: {summary['inserted']} added, "
+                    f"{summary['skipped']} duplicates skipped, {summary['invalid']} invalid rows."
+                )
+                if summary["invalid_lines"]:
+                    lines = ", ".join(str(n) for n in summary["invalid_lines"])
+                    st.write(f"Invalid rows (missing name or password) on lines: {lines}")
 
     else:  # Manual
         with st.form("manual_supplier_form"):
@@ -346,66 +415,127 @@ def add_new_suppliers(current_user):
             submitted = st.form_submit_button("Add Supplier")
 
             if submitted:
-                if not supplier_name or not password:
-                    st.write("Supplier name and password are required.")
-                else:
-                    # Duplicate check
-                    cursor.execute("""
-                        SELECT 1 FROM suppliers
-                        WHERE owner_user_id = ?
-                          AND supplier_name = ?
-                          AND user_id = ?
-                    """, (user_id, supplier_name, supplier_user_id))
-                    existing = cursor.fetchone()
-                    if existing:
-                        st.write("Supplier already added!")
-                    else:
-                        cursor.execute("""
-                            INSERT INTO suppliers
-                              (supplier_name, office_id, user_id, password, url, last_reset, owner_user_id)
-                            VALUES (?, ?, ?, ?, ?, DATETIME('now'), ?)
-                        """, (supplier_name, office_id, supplier_user_id, password, url, user_id))
-                        conn.commit()
-                        st.write("Supplier added successfully!")
+                added, msg = supplier_repository.add(
+                    user_id, supplier_name, office_id, supplier_user_id, password, url
+                )
+                st.write(msg)
 
 def view_password_reset_reminders(current_user):
     """
-    Display suppliers whose password is due to expire in 7 days or less.
+    Display suppliers whose reminder date has passed and whose password
+    hasn't expired yet.
     """
-    user_id, username, email, _ = current_user
-    conn = create_connection()
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT supplier_name, last_reset
-        FROM suppliers
-        WHERE owner_user_id = ?
-    """, (user_id,))
-    suppliers_data = cursor.fetchall()
-    conn.close()
-
-    if not suppliers_data:
+    user_id = current_user.user_id
+    reminders = supplier_repository.due_reminders(user_id)
+
+    if not reminders and not supplier_repository.has_suppliers(user_id):
         st.write("No suppliers found.")
         return
 
-    reminders = []
-    for sup in suppliers_data:
-        sup_name, last_reset = sup
-        if last_reset:
-            try:
-                last_reset_dt = parse_datetime(last_reset)
-            except ValueError:
-                continue
-            expiry_dt = last_reset_dt + timedelta(days=30)
-            reminder_dt = expiry_dt - timedelta(days=7)
-            now = datetime.now()
-            if reminder_dt <= now < expiry_dt:
-                reminders.append((sup_name, expiry_dt.strftime("%Y-%m-%d %H:%M:%S")))
-
     if reminders:
         st.write("Suppliers requiring password reset soon:")
         for item in reminders:
             sup_name, exp_time = item
-            st.write(f"- {sup_name}, Expiry Date: {exp_time}")
+            st.write(f"- {sup_name}, Expiry Date: {exp_time} UTC")
     else:
-        st.write("No supplier passwords are due for reset in the next 7 days.")
+        st.write("No supplier passwords are due for reset.")
+
+
+def view_password_audit(current_user):
+    """
+    Reused and weak supplier passwords, and which to rotate first.
+    """
+    from password_audit import MAX_LISTED
+
+    user_id = current_user.user_id
+    report = supplier_repository.password_audit(user_id)
+    if not report["suppliers"]:
+        st.write("No suppliers found.")
+        return
+
+    reuse_groups, weak, rotate_first = report["reuse_groups"], report["weak"], report["rotate_first"]
+    st.write(f"{report['suppliers']} suppliers checked: {len(reuse_groups)} passwords are reused, "
+             f"{len(weak)} are weak.")
+    if not rotate_first:
+        st.success("No reused or weak passwords found.")
+        return
+
+    st.subheader("Rotate first")
+    st.dataframe([
+        {
+            "Supplier Name": supplier_name,
+            "User ID": sup_user_id,
+            "Shared With": shared_with,
+            "Strength": "" if score is None else f"{score}/4",
+            "Issues": reasons,
+        }
+        for _, supplier_name, sup_user_id, shared_with, score, reasons in rotate_first[:MAX_LISTED]
+    ])
+    if len(rotate_first) > MAX_LISTED:
+        st.write(f"... and {len(rotate_first) - MAX_LISTED} more.")
+
+    if reuse_groups:
+        st.subheader("Reused passwords")
+        for number, group in enumerate(reuse_groups[:MAX_LISTED], 1):
+            names = ", ".join(f"{name} ({sup_user_id})" if sup_user_id else name
+                              for _, name, sup_user_id in group)
+            st.write(f"{number}. Same password on {len(group)} suppliers: {names}")
+        if len(reuse_groups) > MAX_LISTED:
+            st.write(f"... and {len(reuse_groups) - MAX_LISTED} more groups.")
+
+
+# How long a verified export OTP keeps the download button available
+EXPORT_WINDOW_SECONDS = 300
+# Exports up to this size are built in memory, larger ones spill to disk
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+def _build_export(user_id, fmt, compress):
+    """
+    Produce the export file for st.download_button. Called by Streamlit on
+    click, in a separate thread.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+    write_export(user_id, spool, fmt, compress)
+    spool.seek(0)
+    return spool
+
+
+def export_suppliers(current_user):
+    """
+    Download all suppliers (with passwords) as CSV or JSON Lines, after OTP
+    verification.
+    """
+    user_id = current_user.user_id
+
+    if not supplier_repository.has_suppliers(user_id):
+        st.write("No suppliers added yet.")
+        return
+
+    st.subheader("Export Suppliers")
+    fmt = st.radio("Format", [CSV, JSONL], format_func={CSV: "CSV", JSONL: "JSON Lines"}.get)
+    compress = st.checkbox("Compress (gzip)", value=True)
+    st.warning("The export contains your supplier passwords in plain text. Store it safely.")
+
+    if st.button("Send OTP to Export"):
+        if send_action_otp(current_user, EXPORT):
+            sessions.clear_value(EXPORT_UNLOCKED)
+            st.success("OTP is on its way! Enter it below to unlock the download.")
+
+    user_otp = st.text_input("Enter OTP to export:", type="password")
+
+    if st.button("Confirm Export"):
+        result = check_action_otp(user_id, EXPORT, user_otp, "Send OTP to Export")
+        if result == VERIFIED:
+            sessions.put_value(EXPORT_UNLOCKED, True, EXPORT_WINDOW_SECONDS)
+        elif result == MISMATCH:
+            st.error("OTP mismatch. Export remains locked.")
+
+    # Kept with the server-side session, so signing in again starts locked
+    if sessions.get_value(EXPORT_UNLOCKED):
+        st.download_button(
+            "Download export",
+            data=lambda: _build_export(user_id, fmt, compress),
+            file_name=export_file_name(current_user.username, fmt, compress),
+            mime="application/gzip" if compress else ("text/csv" if fmt == CSV else "application/x-ndjson"),
+        )
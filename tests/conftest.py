@@ -0,0 +1,92 @@
+# tests/conftest.py
+"""
+Shared fixtures. Each test that needs a database gets a fresh one under
+tmp_path, and the module-level pools and caches are reset around it.
+"""
+import base64
+import os
+import secrets
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cheap password hashing, a throwaway master key and inline (uncoordinated) writes
+os.environ["KDF_SCRYPT_N"] = "1024"
+os.environ["VAULT_MASTER_KEY"] = base64.b64encode(secrets.token_bytes(32)).decode("ascii")
+os.environ["WRITE_COORDINATOR"] = "0"
+os.environ.pop("METRICS_ENABLED", None)
+
+
+def _reset_state():
+    import audit_log
+    import cache
+    import database
+    import vault_crypto
+
+    if audit_log._audit_log is not None:
+        audit_log._audit_log.close()
+        audit_log._audit_log = None
+    database.close_pool()
+    database._schema_ready = False
+    cache.vault_cache.clear()
+    with vault_crypto._data_keys_lock:
+        vault_crypto._data_keys.clear()
+
+
+@pytest.fixture
+def new_db_path(tmp_path, monkeypatch):
+    """
+    DB_PATH in single-file mode, for a database that doesn't exist yet.
+    """
+    path = str(tmp_path / "pm.db")
+    monkeypatch.setenv("DB_PATH", path)
+    for name in ("SHARD_DIR", "AUDIT_DB_PATH", "STORAGE_MODE", "BACKUP_DIR"):
+        monkeypatch.delenv(name, raising=False)
+    _reset_state()
+    yield path
+    _reset_state()
+
+
+@pytest.fixture
+def db_path(new_db_path):
+    """
+    DB_PATH of a fresh, migrated database in single-file mode.
+    """
+    from database import init_db
+    init_db()
+    return new_db_path
+
+
+@pytest.fixture
+def make_user(db_path):
+    """
+    make_user(name) registers a user and returns its user_id.
+    """
+    from services import auth_service
+
+    def make(name):
+        ok, message = auth_service.register(name, f"{name}@example.invalid", "user-password")
+        assert ok, message
+        return auth_service.get_user(name)[0]
+
+    return make
+
+
+@pytest.fixture
+def use_shards(db_path, monkeypatch):
+    """
+    use_shards() switches the running tests to STORAGE_MODE=sharded over
+    the default SHARD_DIR of db_path (e.g. after sharding.split) and
+    returns the shard directory.
+    """
+    from database import _db_settings, init_db
+
+    def switch():
+        monkeypatch.setenv("STORAGE_MODE", "sharded")
+        _reset_state()
+        init_db()
+        return _db_settings()["shard_dir"]
+
+    return switch
@@ -0,0 +1,154 @@
+import gzip
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import audit_log
+from audit_log import AuditLog
+
+
+def _ts(*args):
+    return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    clock.now is what audit_log sees as the current unix time.
+    """
+    clock = SimpleNamespace(now=_ts(2026, 1, 15))
+    monkeypatch.setattr(audit_log, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def log(tmp_path):
+    # Flushed only when a test asks
+    log = AuditLog(str(tmp_path / "audit.db"), flush_interval=3600, flush_size=10 ** 6)
+    yield log
+    log.close()
+
+
+def _record(log, clock, ts, owner, action=audit_log.UNMASK, supplier_id=None, detail=""):
+    clock.now = ts
+    log.record(owner, action, supplier_id, detail)
+
+
+def test_flush_writes_each_month_to_its_partition(log, clock):
+    _record(log, clock, _ts(2026, 1, 15), 1, audit_log.ADD, 10)
+    _record(log, clock, _ts(2026, 2, 3), 1, audit_log.UNMASK, 10)
+    _record(log, clock, _ts(2026, 2, 20), 2, audit_log.MODIFY, 20, "password")
+    _record(log, clock, _ts(2026, 3, 1), 1, audit_log.DELETE, 10)
+    assert log.stats()["buffered"] == 4
+
+    assert log.flush() == 4
+    assert log.flush() == 0
+    assert log.partitions() == ["audit_log_202601", "audit_log_202602", "audit_log_202603"]
+    stats = log.stats()
+    assert stats["flushed"] == 4 and stats["flushes"] == 1 and stats["buffered"] == 0
+    assert log.events(2) == [(_ts(2026, 2, 20), audit_log.MODIFY, 20, "password")]
+
+
+def test_events_reads_the_range_across_partitions(log, clock):
+    for day in (10, 20):
+        for month in (1, 2, 3):
+            _record(log, clock, _ts(2026, month, day), 1, audit_log.UNMASK, month * 100 + day)
+    _record(log, clock, _ts(2026, 3, 1), 1, audit_log.EXPORT)
+    _record(log, clock, _ts(2026, 2, 15), 2, audit_log.UNMASK, 999)
+
+    # end is exclusive; events() flushes the buffer first
+    events = log.events(1, start=_ts(2026, 1, 20), end=_ts(2026, 3, 1))
+    assert [supplier_id for _, _, supplier_id, _ in events] == [220, 210, 120]
+    assert [e[2] for e in log.events(1, start=_ts(2026, 1, 20), end=_ts(2026, 3, 2))][:2] == [None, 220]
+    # Without an end, up to now
+    assert [e[2] for e in log.events(1, action=audit_log.EXPORT)] == []
+    clock.now = _ts(2026, 4, 1)
+    assert [e[2] for e in log.events(1, action=audit_log.EXPORT)] == [None]
+    assert [e[2] for e in log.events(1, limit=2)] == [320, 310]
+    assert log.events(1, start=_ts(2025, 1, 1), end=_ts(2025, 12, 1)) == []
+
+
+def test_apply_retention_archives_and_drops_old_months(log, clock, tmp_path):
+    for month in (1, 2, 3, 4):
+        _record(log, clock, _ts(2026, month, 5), 1, audit_log.UNMASK, month)
+    log.flush()
+    archive_dir = tmp_path / "archive"
+
+    dropped = log.apply_retention(months=2, archive_dir=str(archive_dir), now=_ts(2026, 4, 10))
+    assert dropped == ["audit_log_202601"]
+    assert log.partitions() == ["audit_log_202602", "audit_log_202603", "audit_log_202604"]
+    with gzip.open(archive_dir / "audit_log_202601.jsonl.gz", "rt", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [
+            {"ts": _ts(2026, 1, 5), "owner_user_id": 1, "action": audit_log.UNMASK, "supplier_id": 1, "detail": ""}
+        ]
+    assert [e[2] for e in log.events(1, end=_ts(2026, 5, 1))] == [4, 3, 2]
+
+    assert log.apply_retention(months=2, now=_ts(2026, 4, 10)) == []
+    # Events of a dropped month can still be recorded: the table comes back
+    _record(log, clock, _ts(2026, 1, 6), 1, audit_log.UNMASK, 5)
+    assert log.flush() == 1 and log.partitions()[0] == "audit_log_202601"
+
+
+def test_failed_flush_keeps_newest_events_up_to_the_cap(log, clock, monkeypatch):
+    monkeypatch.setattr(audit_log, "MAX_BUFFERED", 5)
+    insert = log._insert
+
+    def broken(events, one_by_one=False):
+        # More events come in while the flush is failing
+        for supplier_id in (5, 6, 7):
+            _record(log, clock, _ts(2026, 1, 15), 1, audit_log.UNMASK, supplier_id)
+        raise OSError("disk full")
+
+    for supplier_id in range(1, 5):
+        _record(log, clock, _ts(2026, 1, 15), 1, audit_log.UNMASK, supplier_id)
+    monkeypatch.setattr(log, "_insert", broken)
+    assert log.flush() == 0
+    stats = log.stats()
+    assert stats["buffered"] == 5 and stats["dropped"] == 2 and stats["errors"] == 1
+
+    monkeypatch.setattr(log, "_insert", insert)
+    assert log.flush() == 5
+    assert sorted(e[2] for e in log.events(1)) == [3, 4, 5, 6, 7]
+
+
+def test_bad_event_is_dead_lettered_after_max_attempts(log, clock, monkeypatch):
+    monkeypatch.setattr(audit_log, "MAX_FLUSH_ATTEMPTS", 3)
+    _record(log, clock, _ts(2026, 1, 15), 1, audit_log.UNMASK, 1)
+    # sqlite3 can't bind it, failing the whole executemany
+    _record(log, clock, _ts(2026, 1, 15), 1, audit_log.MODIFY, 2, detail=object())
+
+    assert log.flush() == 0
+    assert log.flush() == 0
+    assert log.stats()["buffered"] == 2
+    assert log.flush() == 1
+
+    assert [e[2] for e in log.events(1)] == [1]
+    with open(log.dead_letter_path, encoding="utf-8") as f:
+        [line] = f.read().splitlines()
+    assert json.loads(line)["supplier_id"] == 2 and "object" in json.loads(line)["detail"]
+    stats = log.stats()
+    assert stats["dead_lettered"] == 1 and stats["errors"] == 3 and stats["dropped"] == 0
+
+    # Later events are no longer held up
+    _record(log, clock, _ts(2026, 1, 16), 1, audit_log.UNMASK, 3)
+    assert log.flush() == 1
+    assert log.stats()["buffered"] == 0
+
+
+def test_unreachable_database_dead_letters_the_buffer(log, clock, monkeypatch):
+    monkeypatch.setattr(audit_log, "MAX_FLUSH_ATTEMPTS", 2)
+
+    def broken(events, one_by_one=False):
+        raise OSError("disk I/O error")
+
+    monkeypatch.setattr(log, "_insert", broken)
+    for supplier_id in (1, 2):
+        _record(log, clock, _ts(2026, 1, 15), 1, audit_log.UNMASK, supplier_id)
+    assert log.flush() == 0 and log.flush() == 0
+
+    stats = log.stats()
+    assert stats["buffered"] == 0 and stats["dead_lettered"] == 2
+    with open(log.dead_letter_path, encoding="utf-8") as f:
+        assert [json.loads(line)["supplier_id"] for line in f] == [1, 2]
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import backup
+import main
+from services import supplier_repository
+
+T0 = datetime(2026, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+
+
+def _at(seconds):
+    return (T0 + timedelta(seconds=seconds)).strftime(backup.TIME_FORMAT)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    clock.advance(seconds) moves backup's idea of "now" forward.
+    """
+    class Clock:
+        now = T0
+
+        def advance(self, seconds):
+            self.now += timedelta(seconds=seconds)
+
+    clock = Clock()
+    monkeypatch.setattr(backup, "_utc_now", lambda: clock.now)
+    return clock
+
+
+@pytest.fixture
+def archived(db_path, make_user, clock):
+    """
+    A snapshot holding supplier "a", then WAL segments archived at
+    T0+10s (adds "b") and T0+20s (adds "c").
+    """
+    owner = make_user("alice")
+    quiet = lambda *args: None
+
+    def add(name):
+        ok, message = supplier_repository.add(owner, name, "", f"{name}-login", "pw", "")
+        assert ok, message
+
+    add("a")
+    archiver = backup.WalArchiver(db_path, 64 * 1024 * 1024)
+    try:
+        snapshot_dir = backup.snapshot(archiver=archiver, log=quiet)
+        for name in ("b", "c"):
+            clock.advance(10)
+            add(name)
+            assert archiver.archive() > 0
+    finally:
+        archiver.close()
+    assert [s["archived_at"] for s in backup._wal_segments(snapshot_dir)] == [_at(10), _at(20)]
+    return snapshot_dir
+
+
+def _names(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0] for row in conn.execute("SELECT supplier_name FROM suppliers")}
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("at, expected, reached", [
+    (_at(5), {"a"}, _at(0)),
+    (_at(10), {"a", "b"}, _at(10)),
+    (_at(15), {"a", "b"}, _at(10)),
+    (None, {"a", "b", "c"}, _at(20)),
+])
+def test_restore_rolls_wal_forward_to_point_in_time(db_path, archived, tmp_path, at, expected, reached):
+    manifest = backup.find_snapshot(os.path.basename(archived))
+    target = tmp_path / "restored"
+    restored_to = backup.restore(manifest, at, str(target), log=lambda *args: None)
+
+    assert _names(target / "pm.db") == expected
+    assert restored_to == reached
+    assert backup.integrity_check(str(target / "pm.db")) == []
+
+
+def test_main_restore_over_live_database(db_path, archived, clock, capsys):
+    clock.advance(10)
+    assert main.main(["restore", "--at", _at(10)]) == 0
+    assert f"as of {_at(10)} UTC" in capsys.readouterr().out
+    assert _names(db_path) == {"a", "b"}
+
+    # The live state was kept as a pre-restore snapshot first
+    labels = [m["label"] for m in backup.list_snapshots()]
+    assert labels == [None, "pre-restore"]
+
+
+def test_verify_rejects_corrupted_segment(db_path, archived, capsys):
+    assert backup.verify(archived) == []
+    assert main.main(["verify"]) == 0
+
+    segment = os.path.join(archived, backup.WAL_DIR, "00000002.frames.gz")
+    with open(segment, "r+b") as f:
+        f.seek(20)
+        byte = f.read(1)
+        f.seek(20)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    assert backup.verify(archived) == [f"{backup.WAL_DIR}/00000002.frames.gz: missing or corrupt"]
+    capsys.readouterr()
+    assert main.main(["verify", os.path.basename(archived)]) == 1
+    assert "00000002.frames.gz: missing or corrupt" in capsys.readouterr().out
+    with pytest.raises(RuntimeError, match="corrupt"):
+        backup.restore(backup.find_snapshot(), None, os.path.join(os.path.dirname(db_path), "restored"),
+                       log=lambda *args: None)
+
+
+def test_verify_rejects_changed_database_file(db_path, make_user, clock):
+    make_user("alice")
+    snapshot_dir = backup.snapshot(log=lambda *args: None)
+    with open(os.path.join(snapshot_dir, "pm.db"), "ab") as f:
+        f.write(b"\0")
+    assert backup.verify(snapshot_dir) == ["pm.db: checksum mismatch"]
+
+
+def test_main_backup_and_prune(db_path, make_user, clock, monkeypatch, capsys):
+    make_user("alice")
+    monkeypatch.setenv("BACKUP_KEEP", "5")
+    for _ in range(3):
+        assert main.main(["backup"]) == 0
+        clock.advance(60)
+    assert main.main(["backup", "--label", "before-upgrade"]) == 0
+    assert len(backup.list_snapshots()) == 4
+
+    monkeypatch.setenv("BACKUP_KEEP", "1")
+    assert main.main(["prune"]) == 0
+    assert "Removed 2 snapshots." in capsys.readouterr().out
+    assert [m["label"] for m in backup.list_snapshots()] == [None, "before-upgrade"]
+    assert [m["created_at"] for m in backup.list_snapshots()][0] == _at(120)
+
+
+def test_main_rejects_bad_arguments(db_path):
+    with pytest.raises(SystemExit):
+        main.main(["backup", "--label", "../etc"])
+    with pytest.raises(SystemExit):
+        main.main(["restore", "--at", "yesterday"])
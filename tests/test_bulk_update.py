@@ -0,0 +1,150 @@
+import sqlite3
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import email_otp
+import otp_service
+from mailer import DeliveryHandle
+from services import BulkUpdateError, supplier_repository
+
+
+@pytest.fixture
+def vault(make_user):
+    """
+    alice has x/u1, x2/u2 and acme/u2, bob one supplier of his own.
+    Returns (alice, {name: supplier_id} of hers, bob's supplier_id).
+    """
+    alice, bob = make_user("alice"), make_user("bob")
+    for name, login in (("x", "u1"), ("x2", "u2"), ("acme", "u2")):
+        assert supplier_repository.add(alice, name, "", login, f"{name}-pw", "")[0]
+    assert supplier_repository.add(bob, "bobs", "", "b1", "bob-pw", "")[0]
+    ids = {name: supplier_id for supplier_id, name, _ in supplier_repository.search(alice, "")}
+    return alice, ids, supplier_repository.match_ids(bob, "")[0]
+
+
+def _snapshot(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return (conn.execute("SELECT * FROM suppliers ORDER BY supplier_id").fetchall(),
+                conn.execute("SELECT * FROM password_strength ORDER BY fingerprint").fetchall())
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("selection, changes", [
+    # The second row would clash with acme/u2 after the first was renamed
+    (["x", "x2"], {"supplier_name": "acme"}),
+    # bob's supplier is not alice's to change
+    (["x", "bob"], {"password": "n3w-Passw0rd!", "url": "https://example.invalid"}),
+    (["x", "missing"], {"password": "n3w-Passw0rd!"}),
+])
+def test_failed_bulk_update_changes_nothing(db_path, vault, selection, changes):
+    alice, ids, bob_supplier = vault
+    ids = dict(ids, bob=bob_supplier, missing=10_000)
+    before = _snapshot(db_path)
+
+    with pytest.raises(BulkUpdateError, match="nothing was changed"):
+        supplier_repository.bulk_update(alice, [ids[name] for name in selection], changes)
+
+    assert _snapshot(db_path) == before
+    assert supplier_repository.get_password(alice, ids["x"]) == "x-pw"
+
+
+@pytest.mark.parametrize("field, message", [
+    ("supplier_name", "The new supplier name can't be empty."),
+    ("password", "The new password can't be empty."),
+])
+def test_update_field_rejects_empty_values(db_path, vault, field, message):
+    alice, ids, _ = vault
+    before = _snapshot(db_path)
+    assert supplier_repository.update_field(alice, ids["x"], field, "") == (False, message)
+    assert _snapshot(db_path) == before
+
+
+def test_bulk_update_changes_every_row(db_path, vault):
+    alice, ids, _ = vault
+    assert supplier_repository.bulk_update(alice, [ids["x"], ids["x2"]], {"password": "n3w-Passw0rd!"}) == 2
+    assert supplier_repository.get_password(alice, ids["x"]) == "n3w-Passw0rd!"
+    assert supplier_repository.get_password(alice, ids["x2"]) == "n3w-Passw0rd!"
+    assert supplier_repository.get_password(alice, ids["acme"]) == "acme-pw"
+
+
+def _urls(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT supplier_name, url FROM suppliers").fetchall()
+    finally:
+        conn.close()
+
+
+def _batch_edit_page():
+    import os
+    import sessions
+    from suppliers import batch_edit_suppliers
+
+    if sessions.current_principal() is None:
+        sessions.start_session((int(os.environ["TEST_USER_ID"]), "alice", "alice@example.invalid", ""))
+    batch_edit_suppliers(sessions.current_principal())
+
+
+@pytest.fixture
+def sent_codes(monkeypatch):
+    """
+    OTPs "emailed" during the test, newest last.
+    """
+    codes = []
+
+    def send(to_email, otp_code):
+        codes.append(otp_code)
+        handle = DeliveryHandle(to_email, "Your OTP Code")
+        handle._resolve(True)
+        return handle
+
+    monkeypatch.setattr(email_otp, "send_otp_async", send)
+    monkeypatch.setattr(otp_service, "_service", None)
+    return codes
+
+
+def _page(alice, ids, names, monkeypatch):
+    monkeypatch.setenv("TEST_USER_ID", str(alice))
+    app = AppTest.from_function(_batch_edit_page, default_timeout=30)
+    app.run()
+    app.radio[0].set_value("Pick from list").run()
+    app.multiselect[0].set_value([ids[name] for name in names]).run()
+    app.multiselect[1].set_value(["url"]).run()
+    app.text_input(key="batch_url").set_value("https://new.example.invalid").run()
+    return app
+
+
+def _button(app, label):
+    return next(button for button in app.button if button.label == label)
+
+
+def test_batch_otp_is_bound_to_the_selection(db_path, vault, sent_codes, monkeypatch):
+    alice, ids, _ = vault
+    app = _page(alice, ids, ["x"], monkeypatch)
+    _button(app, "Send OTP for Batch Edit").click().run()
+    assert len(sent_codes) == 1
+
+    # Same code, but the selection now includes x2 as well
+    app.multiselect[0].set_value([ids["x"], ids["x2"]]).run()
+    app.text_input[-1].set_value(sent_codes[-1]).run()
+    _button(app, "Apply Batch Edit").click().run()
+    assert any("changed since the OTP was sent" in error.value for error in app.error)
+    urls = dict(_urls(db_path))
+    assert urls["x"] == "" and urls["x2"] == ""
+
+    # The selection it was sent for, but another value
+    app.multiselect[0].set_value([ids["x"]]).run()
+    app.text_input(key="batch_url").set_value("https://other.example.invalid").run()
+    _button(app, "Apply Batch Edit").click().run()
+    assert any("changed since the OTP was sent" in error.value for error in app.error)
+    assert dict(_urls(db_path))["x"] == ""
+
+    # Back to exactly the batch the code was sent for: it goes through
+    app.text_input(key="batch_url").set_value("https://new.example.invalid").run()
+    _button(app, "Apply Batch Edit").click().run()
+    assert [s.value for s in app.success] == ["1 suppliers updated."]
+    urls = dict(_urls(db_path))
+    assert urls["x"] == "https://new.example.invalid" and urls["x2"] == ""
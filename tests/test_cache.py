@@ -0,0 +1,56 @@
+import pytest
+
+import cache
+from cache import SecretColumnError, VaultCache, cached_query
+from services import supplier_repository
+
+
+def test_settings_are_read_on_first_use(monkeypatch):
+    vault_cache = VaultCache()
+    # As if .env were loaded after cache.py had been imported
+    monkeypatch.setenv("CACHE_MAX_ENTRIES", "2")
+    monkeypatch.setenv("CACHE_TTL", "0")
+
+    assert vault_cache.max_entries == 2 and vault_cache.ttl == 0.0
+    for i in range(3):
+        key, found, _ = vault_cache.get(1, "SELECT ?", (i,))
+        assert not found
+        vault_cache.put(key, i)
+    assert vault_cache.stats()["entries"] == 2
+    assert vault_cache.stats()["evictions"] == 1
+    assert not vault_cache.get(1, "SELECT ?", (2,))[1]      # already expired
+
+
+def test_explicit_settings_win(monkeypatch):
+    monkeypatch.setenv("CACHE_MAX_ENTRIES", "2")
+    assert VaultCache(max_entries=10, ttl=5.0).max_entries == 10
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT supplier_name, password FROM suppliers WHERE owner_user_id = ?",
+    "SELECT * FROM suppliers WHERE owner_user_id = ?",
+    "SELECT password AS secret FROM suppliers WHERE owner_user_id = ?",
+    "SELECT UPPER(password) FROM suppliers WHERE owner_user_id = ?",
+    "SELECT supplier_name FROM suppliers WHERE owner_user_id = ? AND password IS NOT NULL",
+])
+def test_secret_columns_are_never_cached(db_path, make_user, sql):
+    owner = make_user("alice")
+    assert supplier_repository.add(owner, "acme", "", "login", "s3cret!", "")[0]
+
+    with pytest.raises(SecretColumnError, match="password"):
+        cached_query(owner, sql, (owner,))
+    assert cache.vault_cache.stats()["entries"] == 0
+
+
+def test_cached_query_hits_until_invalidated(db_path, make_user):
+    owner = make_user("alice")
+    sql = "SELECT supplier_name, password_length FROM suppliers WHERE owner_user_id = ?"
+    assert supplier_repository.add(owner, "acme", "", "login", "s3cret!", "")[0]
+
+    assert cached_query(owner, sql, (owner,)) == (("acme", 7),)
+    hits = cache.vault_cache.stats()["hits"]
+    assert cached_query(owner, sql, (owner,)) == (("acme", 7),)
+    assert cache.vault_cache.stats()["hits"] == hits + 1
+
+    assert supplier_repository.add(owner, "globex", "", "login", "pw", "")[0]
+    assert len(cached_query(owner, sql, (owner,))) == 2
@@ -0,0 +1,97 @@
+import io
+import sqlite3
+
+import pytest
+
+import importer
+from importer import import_suppliers
+from services import supplier_repository
+
+HEADER = "Supplier Name,Office ID,User ID,Password,URL\n"
+
+
+def _csv(*lines):
+    return io.BytesIO((HEADER + "".join(line + "\n" for line in lines)).encode("utf-8"))
+
+
+def _rows(db_path, sql, params=()):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def _suppliers(db_path, owner):
+    return sorted(_rows(db_path, "SELECT supplier_name, user_id FROM suppliers WHERE owner_user_id = ?", (owner,)))
+
+
+def test_summary_counts_and_dedup(db_path, make_user):
+    owner = make_user("alice")
+    assert supplier_repository.add(owner, "acme", "", "existing", "pw", "")[0]
+
+    summary = import_suppliers(owner, _csv(
+        "globex,OF1,g1,pw1,https://globex.example",
+        "initech,,i1,pw2,",
+        "globex,OF2,g1,other,",                 # duplicate within the file
+        "acme,,existing,pw3,",                  # duplicate of a stored supplier
+        "acme,,new,pw4,",                       # same name, other user id
+        ",,x,pw5,",                             # no name
+        "hooli,,h1,,",                          # no password
+        "\u200bumbrella\u200b , ,u1 ,pw6,",     # cleaned up
+    ), batch_size=2)
+
+    assert summary == {"rows": 8, "inserted": 4, "skipped": 2, "invalid": 2, "invalid_lines": [7, 8]}
+    assert _suppliers(db_path, owner) == [("acme", "existing"), ("acme", "new"), ("globex", "g1"),
+                                          ("initech", "i1"), ("umbrella", "u1")]
+    assert supplier_repository.get_password(owner, supplier_repository.match_ids(owner, "globex")[0]) == "pw1"
+
+    again = import_suppliers(owner, _csv("globex,,g1,pw1,", "initech,,i1,pw2,"))
+    assert again["inserted"] == 0 and again["skipped"] == 2
+
+
+def test_lock_is_released_between_batches(db_path, make_user):
+    owner = make_user("alice")
+    other_writes = []
+
+    def progress(fraction, summary):
+        # No busy timeout: fails at once if the import still held the lock
+        conn = sqlite3.connect(db_path, timeout=0)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO scheduler_state (name, value) VALUES (?, ?)",
+                         (f"test.{summary['inserted']}", "other session"))
+            conn.commit()
+            other_writes.append(summary["inserted"])
+        finally:
+            conn.close()
+
+    summary = import_suppliers(owner, _csv(*(f"s{i},,u{i},pw{i}," for i in range(10))),
+                               batch_size=3, progress=progress)
+    assert summary["inserted"] == 10
+    assert other_writes == [3, 6, 9, 10]
+
+
+def test_failed_batch_is_rolled_back_and_import_can_resume(db_path, make_user, monkeypatch):
+    owner = make_user("alice")
+    lines = [f"s{i},,u{i},pw{i}," for i in range(10)]
+    encrypt = importer.encrypt_secret
+
+    def failing_encrypt(owner_user_id, supplier_id, password, data_key=None):
+        if password == "pw7":
+            raise ValueError("cannot encrypt pw7")
+        return encrypt(owner_user_id, supplier_id, password, data_key)
+
+    monkeypatch.setattr(importer, "encrypt_secret", failing_encrypt)
+    with pytest.raises(ValueError, match="pw7"):
+        import_suppliers(owner, _csv(*lines), batch_size=3)
+
+    # s0-s5 were committed in two batches; the batch s6-s8 left nothing behind
+    assert _suppliers(db_path, owner) == [(f"s{i}", f"u{i}") for i in range(6)]
+    strength = _rows(db_path, "SELECT COUNT(*) FROM password_strength")[0][0]
+    assert strength == 6
+
+    monkeypatch.setattr(importer, "encrypt_secret", encrypt)
+    summary = import_suppliers(owner, _csv(*lines), batch_size=3)
+    assert summary["inserted"] == 4 and summary["skipped"] == 6
+    assert len(_suppliers(db_path, owner)) == 10
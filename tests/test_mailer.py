@@ -0,0 +1,148 @@
+import smtplib
+import socket
+import time
+
+import pytest
+
+from mailer import MailDispatcher
+from smtp_stub import LocalSMTPServer
+
+
+@pytest.fixture
+def smtp():
+    with LocalSMTPServer() as server:
+        yield server
+
+
+def _dispatcher(smtp, **kwargs):
+    kwargs.setdefault("backoff", 0.05)
+    kwargs.setdefault("workers", 1)
+    return MailDispatcher(smtp.host, smtp.port, user="vault@example.invalid",
+                          password="secret", use_tls=False, **kwargs)
+
+
+def _closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _FlakySMTP(smtplib.SMTP):
+    """
+    An SMTP client whose first `failures` connections are refused with the
+    given error.
+    """
+    failures = 0
+    error = smtplib.SMTPConnectError(421, b"Try again later")
+
+    def __init__(self, *args, **kwargs):
+        if type(self).failures > 0:
+            type(self).failures -= 1
+            raise type(self).error
+        super().__init__(*args, **kwargs)
+
+
+def _flaky(failures, error=None):
+    attrs = {"failures": failures}
+    if error is not None:
+        attrs["error"] = error
+    return type("FlakySMTP", (_FlakySMTP,), attrs)
+
+
+def test_delivers_over_one_connection(smtp):
+    dispatcher = _dispatcher(smtp)
+    try:
+        handles = [dispatcher.send(f"user{i}@example.invalid", f"Code {i}", f"Your code is {i}")
+                   for i in range(3)]
+        assert all(handle.wait(10) for handle in handles)
+    finally:
+        dispatcher.stop(10)
+
+    assert smtp.wait_for(3)
+    message = smtp.last_message_to("user2@example.invalid")
+    assert message["subject"] == "Code 2"
+    assert message["body"] == "Your code is 2"
+    assert smtp.connections == 1
+    stats = dispatcher.stats()
+    assert stats["sent"] == 3 and stats["failed"] == 0 and stats["connections"] == 1
+
+
+def test_transient_failures_are_retried_with_backoff(smtp):
+    dispatcher = _dispatcher(smtp, backoff=0.1, smtp_factory=_flaky(2))
+    started = time.monotonic()
+    try:
+        handle = dispatcher.send("user@example.invalid", "Code", "123456")
+        assert handle.wait(10) is True
+    finally:
+        dispatcher.stop(10)
+
+    # Two retries: 0.1s, then 0.2s
+    assert time.monotonic() - started >= 0.3
+    assert handle.attempts == 3 and handle.error is None
+    assert dispatcher.stats()["retries"] == 2
+    assert smtp.last_message_to("user@example.invalid")["body"] == "123456"
+
+
+def test_backoff_is_capped(smtp):
+    dispatcher = _dispatcher(smtp, backoff=0.05, max_backoff=0.05, max_attempts=5,
+                             smtp_factory=_flaky(3))
+    started = time.monotonic()
+    try:
+        assert dispatcher.send("user@example.invalid", "Code", "1").wait(10) is True
+    finally:
+        dispatcher.stop(10)
+    # Uncapped the three waits would take 0.05 + 0.1 + 0.2s
+    assert time.monotonic() - started < 0.3
+
+
+def test_failure_is_reported_after_max_attempts():
+    dispatcher = MailDispatcher("127.0.0.1", _closed_port(), use_tls=False, workers=1,
+                                max_attempts=3, backoff=0.01, smtp_timeout=2)
+    try:
+        handle = dispatcher.send("user@example.invalid", "Code", "123456")
+        assert handle.wait(10) is False
+    finally:
+        dispatcher.stop(10)
+
+    assert handle.failed()
+    assert isinstance(handle.error, OSError)
+    assert handle.attempts == 3
+    stats = dispatcher.stats()
+    assert stats["failed"] == 1 and stats["retries"] == 2 and stats["sent"] == 0
+
+
+def test_permanent_failure_is_not_retried(smtp):
+    error = smtplib.SMTPResponseException(550, b"Mailbox unavailable")
+    dispatcher = _dispatcher(smtp, smtp_factory=_flaky(5, error))
+    try:
+        handle = dispatcher.send("user@example.invalid", "Code", "123456")
+        assert handle.wait(10) is False
+    finally:
+        dispatcher.stop(10)
+
+    assert handle.error is error
+    assert handle.attempts == 1
+    assert dispatcher.stats()["retries"] == 0
+    assert smtp.messages == []
+
+
+def test_stop_drains_the_queue(smtp):
+    smtp.delay = 0.2
+    dispatcher = _dispatcher(smtp, workers=2)
+    handles = [dispatcher.send(f"user{i}@example.invalid", "Code", str(i)) for i in range(10)]
+    dispatcher.stop(10)
+
+    assert all(handle.done() and handle.ok for handle in handles)
+    assert len(smtp.messages) == 10
+    assert dispatcher.stats()["pending"] == 0
+
+
+def test_send_after_stop_fails_at_once(smtp):
+    dispatcher = _dispatcher(smtp)
+    dispatcher.start()
+    dispatcher.stop(10)
+
+    handle = dispatcher.send("user@example.invalid", "Code", "123456")
+    assert handle.failed()
+    assert isinstance(handle.error, RuntimeError)
+    assert smtp.messages == []
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import database
+
+# create_tables() of databases from before schema versioning
+BASELINE_SCHEMA = """
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL
+);
+CREATE TABLE suppliers (
+    supplier_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    supplier_name TEXT NOT NULL,
+    office_id TEXT,
+    user_id TEXT,
+    password TEXT NOT NULL,
+    url TEXT,
+    date_created TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_reset TEXT,
+    owner_user_id INTEGER NOT NULL,
+    FOREIGN KEY (owner_user_id) REFERENCES users(user_id)
+);
+"""
+
+# str(datetime.now()): local time with microseconds
+LOCAL_RESET = "2024-03-10 14:30:15.123456"
+UTC_RESET = "2024-03-11 08:00:00"
+
+
+def _baseline(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany("INSERT INTO users (username, email, password) VALUES (?, ?, 'x')",
+                     [("alice", "alice@example.invalid"), ("bob", "bob@example.invalid")])
+    conn.executemany("""
+        INSERT INTO suppliers (supplier_id, supplier_name, user_id, password, last_reset, owner_user_id)
+        VALUES (?, ?, ?, 'pw', ?, ?)
+    """, [
+        (1, "acme", "login", UTC_RESET, 1),
+        (2, "acme", "login", LOCAL_RESET, 1),
+        (3, "acme", "login", None, 1),
+        # Already taken by the name the first rename would pick
+        (4, "acme (duplicate #3)", "login", None, 1),
+        (5, "acme", "login", None, 2),
+        (6, "acme", None, "not a date", 1),
+        (7, "acme", None, None, 1),
+    ])
+    conn.commit()
+    conn.close()
+
+
+def _rows(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_upgrade_from_baseline(new_db_path, capsys):
+    _baseline(new_db_path)
+    database.init_db()
+
+    assert _rows(new_db_path, "SELECT MAX(version) FROM schema_version") == [(database.SCHEMA_VERSION,)]
+    names = dict(_rows(new_db_path, "SELECT supplier_id, supplier_name FROM suppliers"))
+    assert names == {
+        1: "acme",
+        2: "acme (duplicate #2)",
+        3: "acme (duplicate #3) #3",
+        4: "acme (duplicate #3)",
+        5: "acme",                  # another owner
+        6: "acme",                  # NULL user_id never clashes
+        7: "acme",
+    }
+    out = capsys.readouterr().out
+    assert "Renamed duplicate supplier 2 (owner 1, 'acme' / 'login') to 'acme (duplicate #2)'." in out
+    assert f"Backed up database to {new_db_path}.v0.bak" in out
+
+    local = datetime.strptime(LOCAL_RESET, "%Y-%m-%d %H:%M:%S.%f")
+    local_as_utc = local.astimezone(timezone.utc).replace(microsecond=0).strftime("%Y-%m-%d %H:%M:%S")
+    resets = dict(_rows(new_db_path, "SELECT supplier_id, last_reset FROM suppliers"))
+    assert resets[1] == UTC_RESET
+    assert resets[2] == local_as_utc
+    assert resets[3] is None
+    assert resets[6] == "not a date"
+
+    expires = dict(_rows(new_db_path, "SELECT supplier_id, expires_at FROM suppliers"))
+    due = datetime.strptime(UTC_RESET, "%Y-%m-%d %H:%M:%S") + timedelta(days=database.PASSWORD_EXPIRY_DAYS)
+    assert expires[1] == due.strftime("%Y-%m-%d %H:%M:%S")
+    assert expires[3] is None
+
+    # The backup holds the database exactly as it was before the upgrade
+    backup_path = f"{new_db_path}.v0.bak"
+    assert _rows(backup_path, "SELECT supplier_id, supplier_name, last_reset FROM suppliers ORDER BY 1")[:2] == [
+        (1, "acme", UTC_RESET), (2, "acme", LOCAL_RESET)
+    ]
+    assert _rows(backup_path, "SELECT COUNT(*) FROM schema_version") == [(0,)]
+
+
+def test_current_database_is_not_backed_up_again(db_path):
+    database._schema_ready = False
+    database.init_db()
+    assert not [name for name in os.listdir(os.path.dirname(db_path)) if name.endswith(".bak")]
@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+import otp_service
+from otp_service import (
+    MISMATCH,
+    MODIFY,
+    NO_CODE,
+    UNMASK,
+    VERIFIED,
+    MemoryOTPStore,
+    OTPService,
+    RateLimited,
+    SQLiteOTPStore,
+)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_service(request):
+    """
+    make_service(**kwargs) builds an OTPService on each kind of store.
+    """
+    if request.param == "sqlite":
+        request.getfixturevalue("db_path")
+
+    def make(**kwargs):
+        kwargs.setdefault("send_limit", (100, 1.0))
+        kwargs.setdefault("verify_limit", (100, 1.0))
+        store = SQLiteOTPStore() if request.param == "sqlite" else MemoryOTPStore()
+        return OTPService(store=store, **kwargs)
+
+    return make
+
+
+def test_code_is_single_use(make_service):
+    service = make_service()
+    code = service.issue(1, UNMASK)
+    assert len(code) == otp_service.DEFAULT_LENGTH and code.isdigit()
+    assert service.verify(1, UNMASK, code) == VERIFIED
+    assert service.verify(1, UNMASK, code) == NO_CODE
+
+
+def test_code_is_bound_to_user_and_action(make_service):
+    service = make_service()
+    code = service.issue(1, UNMASK)
+    assert service.verify(2, UNMASK, code) == NO_CODE
+    assert service.verify(1, MODIFY, code) == NO_CODE
+    assert service.verify(1, UNMASK, code) == VERIFIED
+
+
+def test_code_expires_after_ttl(make_service):
+    service = make_service(ttl=0.2)
+    code = service.issue(1, UNMASK)
+    time.sleep(0.3)
+    assert service.verify(1, UNMASK, code) == NO_CODE
+
+
+def test_new_code_replaces_the_pending_one(make_service):
+    service = make_service()
+    first = service.issue(1, UNMASK)
+    second = service.issue(1, UNMASK)
+    if first != second:
+        assert service.verify(1, UNMASK, first) == MISMATCH
+    assert service.verify(1, UNMASK, second) == VERIFIED
+
+
+def test_code_is_dropped_after_max_attempts(make_service):
+    service = make_service(max_attempts=2)
+    code = service.issue(1, UNMASK)
+    wrong = "x" * len(code)
+    assert service.verify(1, UNMASK, wrong) == MISMATCH
+    assert service.verify(1, UNMASK, wrong) == MISMATCH
+    assert service.verify(1, UNMASK, code) == NO_CODE
+
+
+def test_sends_are_refused_once_the_bucket_is_empty(make_service):
+    service = make_service(send_limit=(2, 3600.0))
+    service.issue(1, UNMASK)
+    service.issue(1, UNMASK)
+    with pytest.raises(RateLimited) as excinfo:
+        service.issue(1, UNMASK)
+    assert excinfo.value.retry_after > 0
+    # Buckets are per (user, action)
+    service.issue(1, MODIFY)
+    service.issue(2, UNMASK)
+
+
+def test_bucket_refills_over_time():
+    buckets = otp_service.TokenBuckets(1, 0.2)
+    buckets.take("key")
+    with pytest.raises(RateLimited):
+        buckets.take("key")
+    time.sleep(0.25)
+    buckets.take("key")
+
+
+def test_verification_attempts_are_rate_limited(make_service):
+    service = make_service(verify_limit=(3, 3600.0))
+    service.issue(1, UNMASK)
+    for _ in range(3):
+        service.verify(1, UNMASK, "000000x")
+    with pytest.raises(RateLimited):
+        service.verify(1, UNMASK, "000000x")
@@ -0,0 +1,155 @@
+import sqlite3
+import time
+
+import pytest
+
+import scheduler
+from mailer import DeliveryHandle
+from services import supplier_repository
+
+# warn_at 10 days ago, expiry 10 days ahead: due now
+DUE = {"rotation_days": 10, "warning_days": 20}
+
+
+class FakeMail:
+    """
+    send_email stand-in. Deliveries to addresses in `failing` fail, each
+    as many times as given; `crash_after` sends make the next one raise.
+    """
+
+    def __init__(self, failing=None, crash_after=None):
+        self.failing = dict(failing or {})
+        self.crash_after = crash_after
+        self.sent = []
+
+    def __call__(self, to_email, subject, body):
+        if self.crash_after is not None and len(self.sent) >= self.crash_after:
+            raise RuntimeError("scheduler crashed")
+        handle = DeliveryHandle(to_email, subject)
+        if self.failing.get(to_email):
+            self.failing[to_email] -= 1
+            handle._resolve(False, OSError("connection refused"))
+        else:
+            self.sent.append((to_email, body))
+            handle._resolve(True)
+        return handle
+
+    def recipients(self):
+        return sorted(to_email.split("@")[0] for to_email, _ in self.sent)
+
+
+def _run(mail):
+    return scheduler.run_once(send_email=mail, log=lambda *args: None)
+
+
+@pytest.fixture
+def owners(make_user):
+    """
+    alice, bob and carol, each with one supplier due now and one that isn't.
+    """
+    owners = {}
+    for name in ("alice", "bob", "carol"):
+        owner = owners[name] = make_user(name)
+        for supplier in ("due", "later"):
+            assert supplier_repository.add(owner, f"{name}-{supplier}", "", "login", "pw", "")[0]
+        supplier_repository.set_rotation_policy(owner, DUE, supplier_repository.match_ids(owner, "due"))
+    return owners
+
+
+def test_failed_delivery_is_retried_without_resending(db_path, owners):
+    mail = FakeMail(failing={"bob@example.invalid": 1})
+    first = _run(mail)
+    assert mail.recipients() == ["alice", "carol"]
+    assert first["failed"] == 1 and first["sent"] == 2
+    assert scheduler.covered_until() == first["window_end"]
+
+    mail.sent.clear()
+    second = _run(mail)
+    # Same window, only the owner still waiting
+    assert (second["window_start"], second["window_end"]) == (first["window_start"], first["window_end"])
+    assert second["attempt"] == 2 and second["skipped"] == 2
+    assert mail.recipients() == ["bob"]
+    assert "bob-due" in mail.sent[0][1] and "bob-later" not in mail.sent[0][1]
+
+    mail.sent.clear()
+    third = _run(mail)
+    assert mail.recipients() == [] and third["window_start"] == first["window_end"]
+
+
+def test_crash_between_batches_resumes_where_it_stopped(db_path, owners, monkeypatch):
+    monkeypatch.setattr(scheduler, "DIGEST_BATCH", 1)
+    mail = FakeMail(crash_after=1)
+    with pytest.raises(RuntimeError, match="crashed"):
+        _run(mail)
+    assert len(mail.sent) == 1
+    first = mail.recipients()
+
+    mail.crash_after = None
+    second = _run(mail)
+    assert second["skipped"] == 1
+    # Everyone got exactly one digest
+    assert mail.recipients() == ["alice", "bob", "carol"]
+    assert first[0] in mail.recipients()
+
+
+def test_window_gives_up_after_max_attempts(db_path, owners, monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_WINDOW_ATTEMPTS", 2)
+    mail = FakeMail(failing={"bob@example.invalid": 10})
+    _run(mail)
+    last = _run(mail)
+    assert last["attempt"] == 2 and last["failed"] == 1
+    # The window is closed: the next pass starts a new one
+    assert _run(mail)["window_start"] == last["window_end"]
+    assert mail.recipients() == ["alice", "carol"]
+
+
+def test_supplier_due_while_window_is_open_is_not_missed(db_path, owners):
+    mail = FakeMail(failing={"bob@example.invalid": 1})
+    first = _run(mail)
+
+    # dave's reminder falls due after the open window's end
+    time.sleep(1.1)
+    assert supplier_repository.add(owners["alice"], "dave", "", "login", "pw", "")[0]
+    conn = sqlite3.connect(db_path)
+    # Default policy (30 days, warned 7 ahead): warn_at is now
+    conn.execute("UPDATE suppliers SET last_reset = DATETIME('now', '-23 days') WHERE supplier_name = 'dave'")
+    conn.commit()
+    conn.close()
+
+    mail.sent.clear()
+    assert _run(mail)["window_end"] == first["window_end"]
+    assert mail.recipients() == ["bob"]
+
+    mail.sent.clear()
+    third = _run(mail)
+    assert mail.recipients() == ["alice"]
+    assert "dave" in mail.sent[0][1] and "alice-due" not in mail.sent[0][1]
+    assert third["window_start"] == first["window_end"]
+
+
+def test_policy_change_behind_watermark_is_caught_up_once(db_path, owners):
+    mail = FakeMail()
+    _run(mail)
+    assert mail.recipients() == ["alice", "bob", "carol"]
+
+    # Moves the "later" suppliers' warn_at behind the watermark
+    for name in ("alice", "bob"):
+        owner = owners[name]
+        supplier_repository.set_rotation_policy(owner, DUE, supplier_repository.match_ids(owner, "later"))
+
+    mail.sent.clear()
+    mail.failing = {"bob@example.invalid": 1}
+    first = _run(mail)
+    assert first["missed"] == 2 and first["failed"] == 1
+    assert mail.recipients() == ["alice"]
+    assert "alice-later" in mail.sent[0][1]
+
+    # The catch-up entries survive the failed pass
+    mail.sent.clear()
+    second = _run(mail)
+    assert mail.recipients() == ["bob"]
+    assert "bob-later" in mail.sent[0][1] and second["skipped"] == 1
+
+    mail.sent.clear()
+    third = _run(mail)
+    assert mail.recipients() == [] and third["missed"] == 0
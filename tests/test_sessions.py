@@ -0,0 +1,72 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import sessions
+import vault_crypto
+from sessions import Principal, SessionStore
+
+
+@pytest.fixture
+def alice(make_user):
+    user_id = make_user("alice")
+    vault_crypto.get_data_key(user_id)
+    return Principal(user_id, "alice", "alice@example.invalid")
+
+
+def _key_cached(user_id):
+    with vault_crypto._data_keys_lock:
+        return user_id in vault_crypto._data_keys
+
+
+def test_end_forgets_data_key(alice):
+    store = SessionStore()
+    session_id = store.create(alice)
+    assert store.get(session_id) is alice and _key_cached(alice.user_id)
+
+    store.end(session_id)
+    assert store.get(session_id) is None
+    assert not _key_cached(alice.user_id)
+    assert store.stats()["ended"] == 1
+
+
+def test_idle_session_forgets_data_key_on_get(alice):
+    store = SessionStore(idle_seconds=0.05)
+    session_id = store.create(alice)
+    time.sleep(0.1)
+
+    assert store.get(session_id) is None
+    assert not _key_cached(alice.user_id)
+    assert store.stats()["idle_evictions"] == 1
+
+
+def test_sweep_forgets_data_keys_of_idle_sessions(alice):
+    store = SessionStore(idle_seconds=0.05)
+    session_id = store.create(alice)
+    store.put_value(session_id, "unmasked", "s3cret!", ttl=60)
+    time.sleep(0.1)
+
+    assert store.sweep() == (1, 0)
+    assert not _key_cached(alice.user_id)
+    assert store.get_value(session_id, "unmasked") is None
+
+
+def test_lru_eviction_forgets_data_key(alice):
+    store = SessionStore(max_active=1)
+    store.create(alice)
+    store.create(Principal(alice.user_id + 1, "bob", "bob@example.invalid"))
+
+    assert not _key_cached(alice.user_id)
+    assert store.stats()["lru_evictions"] == 1
+
+
+def test_end_session_signs_out_and_forgets_data_key(alice, monkeypatch):
+    monkeypatch.setattr(sessions, "st", SimpleNamespace(session_state={}))
+    monkeypatch.setattr(sessions, "_store", SessionStore())
+    sessions.start_session((alice.user_id, alice.username, alice.email, "hash"))
+    assert sessions.current_principal().user_id == alice.user_id
+
+    sessions.end_session()
+    assert sessions.current_principal() is None
+    assert not _key_cached(alice.user_id)
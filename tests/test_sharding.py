@@ -0,0 +1,105 @@
+import sqlite3
+
+import password_audit
+import sharding
+from database import ShardRouter, _db_settings
+from services import supplier_repository
+
+DUE = {"rotation_days": 10, "warning_days": 20}
+
+
+def _audit_counts(owner):
+    report = password_audit.audit(owner)
+    return report["suppliers"], sorted(len(group) for group in report["reuse_groups"]), len(report["weak"])
+
+
+def test_split_keeps_audit_results(db_path, make_user, use_shards):
+    alice, bob = make_user("alice"), make_user("bob")
+    for owner, name, password in ((alice, "mail", "password"), (alice, "bank", "k8#Lq2!vZp9@wR"),
+                                  (alice, "shop", "k8#Lq2!vZp9@wR"), (alice, "forum", "123456"),
+                                  (bob, "mail", "qwerty"), (bob, "bank", "Tz4$mN7&xQ1!cV")):
+        ok, message = supplier_repository.add(owner, name, "", f"{name}-login", password, "")
+        assert ok, message
+    before = {owner: _audit_counts(owner) for owner in (alice, bob)}
+    assert before[alice] == (4, [2], 2) and before[bob] == (2, [], 1)
+
+    copied = sharding.split(db_path, _db_settings()["shard_dir"])
+    assert copied == {alice: 4, bob: 2}
+    use_shards()
+
+    assert {owner: _audit_counts(owner) for owner in (alice, bob)} == before
+
+
+def _touch(router, owner):
+    with router.connection(owner) as conn:
+        conn.execute("SELECT 1").fetchone()
+
+
+def test_router_closes_least_recently_used_idle_shard(tmp_path):
+    router = ShardRouter(str(tmp_path / "shards"), max_open=2, pool_size=1)
+    try:
+        with router.connection(2) as conn:
+            conn.execute("INSERT INTO scheduler_state (name, value) VALUES ('test.kept', 'yes')")
+        _touch(router, 1)
+        _touch(router, 2)
+        _touch(router, 3)                   # 1 is now the least recently used
+        assert list(router._pools) == [2, 3]
+        assert router.stats() == {"opened": 3, "evicted": 1, "open": 2, "in_use": 0, "max_open": 2}
+
+        with router.connection(2):
+            # 2 is checked out, so 3 goes instead
+            _touch(router, 1)
+            assert list(router._pools) == [2, 1]
+            _touch(router, 4)
+            assert list(router._pools) == [2, 4]
+            with router.connection(4):
+                # Nothing idle to close: over the limit until a shard is returned
+                with router.connection(5):
+                    assert router.stats()["open"] == 3 and router.stats()["in_use"] == 3
+                assert router.stats()["open"] == 2
+        stats = router.stats()
+        assert stats["open"] == 2 and stats["in_use"] == 0 and stats["opened"] == 6
+
+        # An evicted shard reopens with its data intact
+        _touch(router, 1)
+        _touch(router, 3)
+        assert 2 not in router._pools
+        with router.connection(2) as conn:
+            assert conn.execute("SELECT value FROM scheduler_state WHERE name = 'test.kept'").fetchone() == ("yes",)
+    finally:
+        router.close()
+
+
+def _snapshot(owners):
+    return {
+        "suppliers": {owner: sorted(supplier_repository.search(owner, "")) for owner in owners},
+        "passwords": {owner: sorted(supplier_repository.get_password(owner, supplier_id)
+                                    for supplier_id, _, _ in supplier_repository.search(owner, ""))
+                      for owner in owners},
+        "audit": {owner: _audit_counts(owner) for owner in owners},
+        "due": {owner: supplier_repository.due_reminders(owner) for owner in owners},
+        "all_due": supplier_repository.all_due_reminders(),
+    }
+
+
+def test_split_round_trip(db_path, make_user, use_shards):
+    owners = [make_user(name) for name in ("alice", "bob", "carol")]
+    for i, owner in enumerate(owners):
+        for j in range(3 + i):
+            ok, message = supplier_repository.add(owner, f"supplier {j}", "", f"login{j}", f"pw-{i}-{j % 2}", "")
+            assert ok, message
+        supplier_repository.set_rotation_policy(owner, DUE, supplier_repository.match_ids(owner, "supplier 0"))
+    before = _snapshot(owners)
+    assert [len(before["suppliers"][owner]) for owner in owners] == [3, 4, 5]
+    assert len(before["all_due"]) == 3
+
+    assert sharding.split(db_path, _db_settings()["shard_dir"]) == dict(zip(owners, [3, 4, 5]))
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM suppliers").fetchone() == (0,)
+        assert conn.execute("SELECT COUNT(*) FROM password_strength").fetchone() == (0,)
+    finally:
+        conn.close()
+    use_shards()
+
+    assert _snapshot(owners) == before
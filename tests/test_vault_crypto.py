@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+from cryptography.exceptions import InvalidTag
+
+import vault_crypto
+from services import supplier_repository
+
+
+def _stored(db_path, supplier_id):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT password FROM suppliers WHERE supplier_id = ?", (supplier_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _ids(owner):
+    return {row[2]: row[0] for row in supplier_repository.search(owner, "")}
+
+
+def test_round_trip(db_path, make_user):
+    owner = make_user("alice")
+    assert supplier_repository.add(owner, "acme", "", "a1", "s3cret!", "")[0]
+    supplier_id = _ids(owner)["a1"]
+
+    stored = _stored(db_path, supplier_id)
+    assert stored.startswith(vault_crypto.TOKEN_PREFIX)
+    assert "s3cret!" not in stored
+    assert supplier_repository.get_password(owner, supplier_id) == "s3cret!"
+
+
+def test_ciphertext_swapped_between_rows_does_not_decrypt(db_path, make_user):
+    owner = make_user("alice")
+    supplier_repository.add(owner, "acme", "", "a1", "first", "")
+    supplier_repository.add(owner, "acme", "", "a2", "second", "")
+    ids = _ids(owner)
+
+    other = _stored(db_path, ids["a2"])
+    with pytest.raises(InvalidTag):
+        vault_crypto.decrypt_secret(owner, ids["a1"], other, vault_crypto.get_data_key(owner))
+
+
+def test_wrong_owner_key_does_not_decrypt(db_path, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+    supplier_repository.add(alice, "acme", "", "a1", "alice-pw", "")
+    supplier_id = _ids(alice)["a1"]
+    stored = _stored(db_path, supplier_id)
+
+    with pytest.raises(InvalidTag):
+        vault_crypto.decrypt_secret(alice, supplier_id, stored, vault_crypto.get_data_key(bob))
+    with pytest.raises(InvalidTag):
+        vault_crypto.decrypt_secret(bob, supplier_id, stored)
+
+
+def test_encrypt_existing_upgrades_plaintext_and_v1(db_path, make_user):
+    owner = make_user("alice")
+    supplier_repository.add(owner, "acme", "", "a1", "placeholder", "")
+    supplier_repository.add(owner, "acme", "", "a2", "placeholder", "")
+    ids = _ids(owner)
+    key = vault_crypto.get_data_key(owner)
+    legacy = vault_crypto.LEGACY_TOKEN_PREFIX + vault_crypto.base64.b64encode(
+        vault_crypto._seal(key, b"old-format", vault_crypto._legacy_supplier_aad(owner))
+    ).decode("ascii")
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE suppliers SET password = ? WHERE supplier_id = ?", ("plain", ids["a1"]))
+    conn.execute("UPDATE suppliers SET password = ? WHERE supplier_id = ?", (legacy, ids["a2"]))
+    conn.commit()
+    conn.close()
+    assert supplier_repository.get_password(owner, ids["a2"]) == "old-format"
+
+    assert vault_crypto.encrypt_existing() == 2
+    for supplier_id in ids.values():
+        assert _stored(db_path, supplier_id).startswith(vault_crypto.TOKEN_PREFIX)
+    assert supplier_repository.get_password(owner, ids["a1"]) == "plain"
+    assert supplier_repository.get_password(owner, ids["a2"]) == "old-format"
+
+
+def test_rotate_data_key_keeps_passwords(db_path, make_user):
+    owner = make_user("alice")
+    supplier_repository.add(owner, "acme", "", "a1", "before-rotation", "")
+    supplier_id = _ids(owner)["a1"]
+    before = _stored(db_path, supplier_id)
+
+    assert vault_crypto.rotate_data_key(owner) == 1
+    assert _stored(db_path, supplier_id) != before
+    assert supplier_repository.get_password(owner, supplier_id) == "before-rotation"
@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+
+import pytest
+
+import writer
+from services import supplier_repository
+from writer import WriteCoordinator
+
+
+@pytest.fixture
+def coordinator(db_path):
+    # A wide tick so everything submitted in a test lands in one batch
+    coordinator = WriteCoordinator(tick=0.3)
+    yield coordinator
+    coordinator.stop(10)
+
+
+@pytest.fixture
+def default_coordinator(db_path, monkeypatch):
+    """
+    The process-wide coordinator, as in production (WRITE_COORDINATOR=1).
+    """
+    monkeypatch.setenv("WRITE_COORDINATOR", "1")
+    monkeypatch.setattr(writer, "_coordinator", None)
+    yield writer.get_write_coordinator()
+    writer.get_write_coordinator().stop(10)
+
+
+def _set(name, value):
+    def op(conn):
+        conn.execute("INSERT INTO scheduler_state (name, value) VALUES (?, ?)", (name, value))
+        return name
+    return op
+
+
+def _fail(name):
+    def op(conn):
+        _set(name, "half-written")(conn)
+        raise ValueError(f"{name} failed")
+    return op
+
+
+def _state(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(conn.execute("SELECT name, value FROM scheduler_state WHERE name LIKE 'test.%'"))
+    finally:
+        conn.close()
+
+
+def test_failing_operation_doesnt_undo_the_rest_of_its_group(db_path, coordinator):
+    futures = [
+        coordinator.submit(_set("test.a", "1")),
+        coordinator.submit(_fail("test.b")),
+        coordinator.submit(_set("test.c", "3")),
+        coordinator.submit(_set("test.a", "duplicate")),     # violates the primary key
+        coordinator.submit(_set("test.d", "4")),
+    ]
+
+    assert futures[0].result(10) == "test.a"
+    with pytest.raises(ValueError, match="test.b failed"):
+        futures[1].result(10)
+    assert futures[2].result(10) == "test.c"
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[3].result(10)
+    assert futures[4].result(10) == "test.d"
+
+    assert _state(db_path) == {"test.a": "1", "test.c": "3", "test.d": "4"}
+    stats = coordinator.stats()
+    assert stats["transactions"] == 1 and stats["batches"] == 1
+    assert stats["committed"] == 3 and stats["failed"] == 2
+
+
+def test_futures_resolve_after_commit(db_path, coordinator):
+    seen = []
+    called = threading.Semaphore(0)
+
+    def check(future):
+        seen.append(_state(db_path))
+        called.release()
+
+    futures = [coordinator.submit(_set(f"test.{i}", str(i))) for i in range(3)]
+    for future in futures:
+        # Done callbacks run on the writer thread as the future resolves
+        future.add_done_callback(check)
+    for _ in futures:
+        assert called.acquire(timeout=10)
+
+    expected = {f"test.{i}": str(i) for i in range(3)}
+    assert seen == [expected] * 3
+
+
+def test_failed_commit_fails_the_whole_group(db_path, coordinator):
+    def orphan(conn):
+        # Checked only at COMMIT, which then fails for everyone in the group
+        conn.execute("PRAGMA defer_foreign_keys = ON")
+        conn.execute("INSERT INTO suppliers (supplier_name, password, owner_user_id) VALUES ('x', 'x', 999)")
+
+    futures = [
+        coordinator.submit(_set("test.a", "1")),
+        coordinator.submit(orphan),
+        coordinator.submit(_set("test.b", "2")),
+    ]
+    for future in futures:
+        with pytest.raises(sqlite3.IntegrityError, match="FOREIGN KEY"):
+            future.result(10)
+
+    assert _state(db_path) == {}
+    stats = coordinator.stats()
+    assert stats["failed"] == 3 and stats["committed"] == 0 and stats["transactions"] == 0
+
+    # The writer keeps going afterwards
+    assert coordinator.submit(_set("test.c", "3")).result(10) == "test.c"
+    assert _state(db_path) == {"test.c": "3"}
+
+
+def test_submit_after_stop_fails(db_path, coordinator):
+    coordinator.start()
+    coordinator.stop(10)
+    with pytest.raises(RuntimeError, match="stopped"):
+        coordinator.submit(_set("test.a", "1")).result(10)
+
+
+def test_concurrent_adds_through_default_coordinator(db_path, make_user, default_coordinator):
+    owner = make_user("alice")
+    results = []
+
+    def add(i):
+        results.append(supplier_repository.add(owner, f"supplier {i}", "", f"login{i}", "pw", "")[0])
+
+    threads = [threading.Thread(target=add, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert results == [True] * 20
+    assert len(supplier_repository.search(owner, "")) == 20
+    stats = default_coordinator.stats()
+    assert stats["committed"] >= 20 and stats["failed"] == 0
+    assert stats["transactions"] <= stats["committed"]
@@ -1,12 +1,5 @@
 # utils.py
 import unicodedata
-from datetime import datetime
-
-def parse_datetime(dt_string):
-    try:
-        return datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S.%f")  # with microseconds
-    except ValueError:
-        return datetime.strptime(dt_string, "%Y-%m-%d %H:%M:%S")    # without microseconds
 
 def remove_invisible_chars(s: str) -> str:
     """
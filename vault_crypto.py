@@ -0,0 +1,303 @@
+# vault_crypto.py
+"""
+Encryption of supplier passwords at rest.
+
+Every user has a random 256-bit data key, stored in users.data_key wrapped
+(AES-GCM) under the server's master key. Supplier passwords are encrypted
+with the owner's data key and stored as "v2:<base64(nonce + ciphertext)>",
+authenticated with the owner and the supplier_id, so a ciphertext copied
+onto another row doesn't decrypt. Older "v1:" values were bound to the
+owner only; they still decrypt, and --encrypt-existing (or a key
+rotation) re-encrypts them as v2.
+Unwrapped data keys are kept in memory for DATA_KEY_TTL seconds so a
+session unwraps its key once, not on every read.
+
+The master key comes from VAULT_MASTER_KEY (base64, 32 bytes) or, if that
+is unset, from VAULT_KEY_FILE (created on first use). Generate one with
+`python vault_crypto.py --generate-key`.
+
+Encrypt the passwords of an existing database (and upgrade v1 values)
+with `python vault_crypto.py --encrypt-existing`.
+"""
+import argparse
+import base64
+import os
+import secrets
+import threading
+import time
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from dotenv import load_dotenv
+from database import get_connection, get_router, init_db, storage_partitions
+
+load_dotenv()
+
+TOKEN_PREFIX = "v2:"
+LEGACY_TOKEN_PREFIX = "v1:"
+NONCE_BYTES = 12
+KEY_BYTES = 32
+DEFAULT_KEY_FILE = "vault_master.key"
+DEFAULT_DATA_KEY_TTL = 900.0
+DEFAULT_BATCH_SIZE = 500
+
+_master_key = None
+_master_lock = threading.Lock()
+_data_keys = {}
+_data_keys_lock = threading.Lock()
+
+
+def _load_master_key():
+    encoded = os.getenv("VAULT_MASTER_KEY")
+    if not encoded:
+        key_file = os.getenv("VAULT_KEY_FILE", DEFAULT_KEY_FILE)
+        if not os.path.exists(key_file):
+            # First run: create a key readable only by this user
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "w") as f:
+                f.write(base64.b64encode(secrets.token_bytes(KEY_BYTES)).decode("ascii"))
+            print(f"Created new vault master key in {key_file}. Back it up: without it "
+                  f"supplier passwords cannot be decrypted.")
+        with open(key_file) as f:
+            encoded = f.read().strip()
+    key = base64.b64decode(encoded)
+    if len(key) != KEY_BYTES:
+        raise ValueError("The vault master key must be 32 bytes (base64 encoded).")
+    return key
+
+
+def get_master_key():
+    global _master_key
+    if _master_key is None:
+        with _master_lock:
+            if _master_key is None:
+                _master_key = _load_master_key()
+    return _master_key
+
+
+def _seal(key, plaintext, aad):
+    nonce = secrets.token_bytes(NONCE_BYTES)
+    return nonce + AESGCM(key).encrypt(nonce, plaintext, aad)
+
+
+def _open(key, sealed, aad):
+    return AESGCM(key).decrypt(sealed[:NONCE_BYTES], sealed[NONCE_BYTES:], aad)
+
+
+def _user_aad(user_id):
+    return f"user:{int(user_id)}".encode("ascii")
+
+
+def _data_key_ttl():
+    return float(os.getenv("DATA_KEY_TTL", DEFAULT_DATA_KEY_TTL))
+
+
+def get_data_key(user_id, fresh=False):
+    """
+    Return the user's unwrapped data key, creating one on first use.
+    Cached in memory for DATA_KEY_TTL seconds. Writers pass fresh=True:
+    the stored wrapped key is re-read (one primary-key lookup) so a key
+    rotated by another process is never used to encrypt new data.
+    """
+    now = time.monotonic()
+    with _data_keys_lock:
+        cached = _data_keys.get(user_id)
+    if cached and cached[2] > now and not fresh:
+        return cached[1]
+
+    with get_connection() as conn:
+        row = conn.execute("SELECT data_key FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"No user with id {user_id}.")
+        wrapped = row[0]
+        if wrapped is None:
+            data_key = secrets.token_bytes(KEY_BYTES)
+            conn.execute(
+                "UPDATE users SET data_key = ? WHERE user_id = ? AND data_key IS NULL",
+                (_seal(get_master_key(), data_key, _user_aad(user_id)), user_id)
+            )
+            # Another session may have created the key first; use the stored one
+            wrapped = conn.execute(
+                "SELECT data_key FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+
+    if cached and cached[0] == wrapped:
+        data_key = cached[1]
+    else:
+        data_key = _open(get_master_key(), wrapped, _user_aad(user_id))
+    with _data_keys_lock:
+        _data_keys[user_id] = (wrapped, data_key, now + _data_key_ttl())
+        # Drop other expired keys while we hold the lock
+        for expired in [uid for uid, (_, _, expires) in _data_keys.items() if expires <= now]:
+            del _data_keys[expired]
+    return data_key
+
+
+def forget_data_key(user_id):
+    """
+    Drop a cached data key (e.g. on log out).
+    """
+    with _data_keys_lock:
+        _data_keys.pop(user_id, None)
+
+
+def _supplier_aad(owner_user_id, supplier_id):
+    return f"supplier:{int(owner_user_id)}:{int(supplier_id)}".encode("ascii")
+
+
+def _legacy_supplier_aad(owner_user_id):
+    return f"supplier:{int(owner_user_id)}".encode("ascii")
+
+
+def is_encrypted(stored):
+    return stored is not None and stored.startswith((TOKEN_PREFIX, LEGACY_TOKEN_PREFIX))
+
+
+def is_current(stored):
+    """
+    Whether a stored password is encrypted in the current (v2) format.
+    """
+    return stored is not None and stored.startswith(TOKEN_PREFIX)
+
+
+def encrypt_secret(owner_user_id, supplier_id, plaintext, data_key=None):
+    """
+    Encrypt a supplier password for storage in row supplier_id. New rows
+    take their id from database.next_supplier_id().
+    """
+    data_key = data_key or get_data_key(owner_user_id, fresh=True)
+    sealed = _seal(data_key, plaintext.encode("utf-8"), _supplier_aad(owner_user_id, supplier_id))
+    return TOKEN_PREFIX + base64.b64encode(sealed).decode("ascii")
+
+
+def decrypt_secret(owner_user_id, supplier_id, stored, data_key=None):
+    """
+    Decrypt the stored password of row supplier_id. Rows not yet encrypted
+    by --encrypt-existing are returned unchanged. If the cached key fails,
+    it may have been rotated by another process: reload it and try once
+    more.
+    """
+    if not is_encrypted(stored):
+        return stored
+    if is_current(stored):
+        aad = _supplier_aad(owner_user_id, supplier_id)
+    else:
+        aad = _legacy_supplier_aad(owner_user_id)
+    sealed = base64.b64decode(stored[len(TOKEN_PREFIX):])
+    try:
+        return _open(data_key or get_data_key(owner_user_id), sealed, aad).decode("utf-8")
+    except InvalidTag:
+        if data_key is not None:
+            raise
+        data_key = get_data_key(owner_user_id, fresh=True)
+        return _open(data_key, sealed, aad).decode("utf-8")
+
+
+def encrypt_existing(batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Encrypt every plaintext supplier password, and re-encrypt every v1
+    one as v2, in place.
+    Walks the table by primary key in batches, each in its own short
+    transaction, so memory stays flat and live sessions keep working.
+    In sharded mode every shard is walked in turn.
+    Returns the number of rows encrypted.
+    """
+    total = 0
+    for partition in storage_partitions():
+        total += _encrypt_partition(partition, batch_size, progress, total)
+    return total
+
+
+def _encrypt_partition(partition, batch_size, progress, done):
+    last_id = 0
+    total = 0
+    while True:
+        with get_connection(partition) as conn:
+            rows = conn.execute("""
+                SELECT supplier_id, owner_user_id, password
+                FROM suppliers
+                WHERE supplier_id > ?
+                ORDER BY supplier_id
+                LIMIT ?
+            """, (last_id, batch_size)).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for supplier_id, owner, password in rows:
+            if is_current(password):
+                continue
+            plaintext = decrypt_secret(owner, supplier_id, password)
+            updates.append((encrypt_secret(owner, supplier_id, plaintext), len(plaintext),
+                            supplier_id, password))
+        with get_connection(partition) as conn:
+            # The password check skips rows changed since we read them
+            total += conn.executemany(
+                "UPDATE suppliers SET password = ?, password_length = ? "
+                "WHERE supplier_id = ? AND password = ?",
+                updates
+            ).rowcount
+        if progress:
+            progress(last_id, done + total)
+    return total
+
+
+def rotate_data_key(user_id):
+    """
+    Give the user a fresh data key and re-encrypt all their supplier
+    passwords under it, in one IMMEDIATE transaction so no write made with
+    the old key can slip in between. Returns the number of passwords
+    re-encrypted.
+
+    In sharded mode the suppliers and the wrapped key live in different
+    files. The shard transaction stays open until the new key is committed
+    to the directory, so a failed key update rolls the passwords back; only
+    a crash between the two commits can leave them out of step. Don't run
+    a rotation while a backup is being taken.
+    """
+    old_key = get_data_key(user_id, fresh=True)
+    new_key = secrets.token_bytes(KEY_BYTES)
+    with get_connection(user_id) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute(
+            "SELECT supplier_id, password FROM suppliers WHERE owner_user_id = ?", (user_id,)
+        ).fetchall()
+        updates = [
+            (encrypt_secret(user_id, supplier_id, decrypt_secret(user_id, supplier_id, password, old_key),
+                            new_key), supplier_id)
+            for supplier_id, password in rows
+        ]
+        conn.executemany("UPDATE suppliers SET password = ? WHERE supplier_id = ?", updates)
+        wrapped = (_seal(get_master_key(), new_key, _user_aad(user_id)), user_id)
+        if get_router() is None:
+            conn.execute("UPDATE users SET data_key = ? WHERE user_id = ?", wrapped)
+        else:
+            with get_connection() as directory:
+                directory.execute("UPDATE users SET data_key = ? WHERE user_id = ?", wrapped)
+    forget_data_key(user_id)
+    return len(updates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Supplier password encryption tools.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--generate-key", action="store_true", help="print a new master key")
+    group.add_argument("--encrypt-existing", action="store_true",
+                       help="encrypt all plaintext (and re-encrypt v1) supplier passwords in the database")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.generate_key:
+        print(base64.b64encode(secrets.token_bytes(KEY_BYTES)).decode("ascii"))
+        return
+
+    init_db()
+    total = encrypt_existing(
+        args.batch_size,
+        progress=lambda last_id, done: print(f"\r{done} passwords encrypted (up to id {last_id})", end=""),
+    )
+    print(f"\nDone. {total} supplier passwords encrypted.")
+
+
+if __name__ == "__main__":
+    main()
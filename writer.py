@@ -0,0 +1,251 @@
+# writer.py
+"""
+Group commit for small writes from many Streamlit sessions.
+
+Instead of every session opening its own write transaction (and paying
+one lock round-trip and one fsync per tiny write), sessions hand their
+write to the WriteCoordinator. A single writer thread collects what
+arrives within one tick, runs it in one IMMEDIATE transaction per
+database file (each operation under its own SAVEPOINT, so one failing
+write doesn't undo the others) and commits once. Every caller gets a
+Future that resolves with its own result or exception after the commit.
+
+Reads don't go through here; they keep using pooled WAL readers.
+
+Settings:
+    WRITE_COORDINATOR=0   write inline instead (one transaction per call)
+    WRITE_TICK_MS=2       how long the writer waits for more writes to batch
+    WRITE_MAX_BATCH=256   most operations committed together
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from database import get_connection, get_router
+
+DEFAULT_TICK_MS = 2.0
+DEFAULT_MAX_BATCH = 256
+# Upper bounds of the batch size histogram in stats()
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class WriteCoordinator:
+    """
+    Runs write operations fn(conn) -> result on a dedicated thread,
+    grouping them into one transaction per tick.
+
+    Operations must only use the connection they are given: no
+    get_connection() calls, no slow work (hashing, encryption, mail) inside.
+    Do that before submitting.
+    """
+
+    def __init__(self, tick=DEFAULT_TICK_MS / 1000.0, max_batch=DEFAULT_MAX_BATCH):
+        self.tick = tick
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._stats = {
+            "submitted": 0,
+            "committed": 0,
+            "failed": 0,
+            "transactions": 0,
+            "batches": 0,
+            "max_batch": 0,
+            "max_queue_depth": 0,
+            "commit_seconds": 0.0,
+        }
+        self._batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+
+    # -- public API -------------------------------------------------------
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="write-coordinator", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Commit what is queued, then stop the writer thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, fn, owner_user_id=None):
+        """
+        Queue fn(conn) for the database holding owner_user_id's suppliers
+        (the main / directory database when None). Returns a Future.
+        """
+        future = Future()
+        if self._stopping:
+            future.set_exception(RuntimeError("Write coordinator is stopped."))
+            return future
+        self.start()
+        self._queue.put((owner_user_id, fn, future))
+        depth = self._queue.qsize()
+        with self._lock:
+            self._stats["submitted"] += 1
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+        return future
+
+    def stats(self):
+        """
+        Counters plus the current queue depth, mean batch size and a
+        {"<=N": batches} histogram of batch sizes.
+        """
+        with self._lock:
+            snapshot = dict(self._stats)
+            sizes = list(self._batch_sizes)
+        snapshot["queue_depth"] = self._queue.qsize()
+        snapshot["mean_batch"] = (
+            (snapshot["committed"] + snapshot["failed"]) / snapshot["batches"] if snapshot["batches"] else 0.0
+        )
+        labels = [f"<={bound}" for bound in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+        snapshot["batch_sizes"] = dict(zip(labels, sizes))
+        return snapshot
+
+    # -- writer thread ----------------------------------------------------
+
+    def _collect(self, first):
+        """
+        The first operation plus whatever arrives within one tick.
+        Returns (batch, stop_requested).
+        """
+        batch = [first]
+        deadline = time.monotonic() + self.tick
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, stop = self._collect(item)
+            self._record_batch(len(batch))
+
+            # One transaction per database file touched by this batch: the
+            # owner's shard in sharded mode, else the one main database
+            sharded = get_router() is not None
+            groups = {}
+            for owner_user_id, fn, future in batch:
+                groups.setdefault(owner_user_id if sharded else None, []).append((fn, future))
+            for partition, ops in groups.items():
+                self._commit_group(partition, ops)
+            if stop:
+                return
+
+    def _commit_group(self, partition, ops):
+        results = []
+        started = time.perf_counter()
+        try:
+            with get_connection(partition) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, future in ops:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT write_op")
+                    try:
+                        results.append((future, True, fn(conn)))
+                        conn.execute("RELEASE write_op")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_op")
+                        conn.execute("RELEASE write_op")
+                        results.append((future, False, e))
+        except Exception as e:
+            # BEGIN or COMMIT failed: nothing in this group was written
+            for fn, future in ops:
+                if future.done():
+                    continue
+                if future.running() or future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            with self._lock:
+                self._stats["failed"] += len(ops)
+            return
+
+        with self._lock:
+            self._stats["transactions"] += 1
+            self._stats["commit_seconds"] += time.perf_counter() - started
+            for future, ok, _ in results:
+                self._stats["committed" if ok else "failed"] += 1
+        # Resolve only after the commit, so callers never see uncommitted data
+        for future, ok, value in results:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _record_batch(self, size):
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["max_batch"] = max(self._stats["max_batch"], size)
+            for i, bound in enumerate(BATCH_SIZE_BUCKETS):
+                if size <= bound:
+                    self._batch_sizes[i] += 1
+                    break
+            else:
+                self._batch_sizes[-1] += 1
+
+
+_coordinator = None
+_coordinator_lock = threading.Lock()
+
+
+def get_write_coordinator():
+    """
+    The process-wide coordinator, or None when WRITE_COORDINATOR=0.
+    """
+    global _coordinator
+    if os.getenv("WRITE_COORDINATOR", "1") != "1":
+        return None
+    if _coordinator is None:
+        with _coordinator_lock:
+            if _coordinator is None:
+                _coordinator = WriteCoordinator(
+                    tick=float(os.getenv("WRITE_TICK_MS", DEFAULT_TICK_MS)) / 1000.0,
+                    max_batch=int(os.getenv("WRITE_MAX_BATCH", DEFAULT_MAX_BATCH)),
+                )
+    return _coordinator
+
+
+def submit_write(fn, owner_user_id=None):
+    """
+    Queue fn(conn) and return a Future. Without a coordinator the write
+    runs inline and the returned Future is already resolved.
+    """
+    coordinator = get_write_coordinator()
+    if coordinator is not None:
+        return coordinator.submit(fn, owner_user_id)
+    future = Future()
+    try:
+        with get_connection(owner_user_id) as conn:
+            future.set_result(fn(conn))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def write(fn, owner_user_id=None):
+    """
+    Run fn(conn) as a coordinated write and return its result (or raise
+    its exception).
+    """
+    return submit_write(fn, owner_user_id).result()